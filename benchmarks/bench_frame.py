@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Benchmark of pipeline reporting:  the sum of Deal.value by stage_id over 100k Deal records, building Resources and
+iterating them or building a ResourceFrame and grouping its columns.  Run from the repository root with:
+
+    python -m benchmarks.bench_frame
+"""
+
+import timeit
+from benchmarks.bench_timestamps import record
+from frame import numpy
+from v2.collection import DealSet
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+RECORDS = [record(i) for i in range(0, 100000)]
+
+
+def copies():
+    # Resources convert their records in place
+    return [dict(item, data=dict(item['data'])) for item in RECORDS]
+
+
+def with_resources(records):
+    totals = dict()
+    for deal in DealSet().format_page(records):
+        totals[deal.stage_id] = totals.get(deal.stage_id, 0) + deal.value
+    return totals
+
+
+def with_frame(records):
+    return DealSet().format_frame(records).group_by('stage_id', 'value')
+
+
+def best(function, records, repeat):
+    times = list()
+    for i in range(0, repeat):
+        data = records()
+        start = timeit.default_timer()
+        function(data)
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+
+def main(repeat=3):
+    assert with_resources(copies()) == with_frame(RECORDS)
+    resources = best(with_resources, copies, repeat)
+    frame = best(with_frame, lambda: RECORDS, repeat)
+    print("Sum of value by stage_id over %d Deals (%s)" % (len(RECORDS), 'numpy' if numpy else 'without numpy'))
+    print("  Resources:      %.3fs" % resources)
+    print("  ResourceFrame:  %.3fs" % frame)
+    print("  speedup:        %.2fx" % (resources / frame))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Benchmark of lazy hydration:  turning pages of Contact records into Resources and reading only id and name, with
+every field converted up front (eager) or on first access (lazy).  Run from the repository root with:
+
+    python -m benchmarks.bench_hydration
+"""
+
+import json
+import timeit
+from benchmarks.bench_memory import RESPONSE
+from v2.collection import ContactSet
+from v2.resource import Contact
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+RECORD = dict(RESPONSE['data'], address={'line1': '2726 Smith Street', 'city': 'Hyannis', 'postal_code': '02601',
+                                         'state': 'MA', 'country': 'US'})
+PAGE = json.dumps({'items': [{'data': dict(RECORD, id=i)} for i in range(0, 100)]})
+
+
+def list_page():
+    """Parses a page, builds its Resources and reads id and name"""
+    page = ContactSet().format_page(json.loads(PAGE)['items'])
+    return [(contact.id, contact.name) for contact in page]
+
+
+def main(pages=100, repeat=5):
+    parse = min(timeit.repeat(lambda: json.loads(PAGE), number=pages, repeat=repeat))
+    eager = min(timeit.repeat(list_page, number=pages, repeat=repeat))
+    Contact.LAZY = True
+    try:
+        lazy = min(timeit.repeat(list_page, number=pages, repeat=repeat))
+    finally:
+        Contact.LAZY = False
+    print("Listing %d pages of 100 Contacts (reading id and name)" % pages)
+    print("  JSON parse only:  %.3fs" % parse)
+    print("  eager:            %.3fs" % eager)
+    print("  lazy:             %.3fs" % lazy)
+    print("  speedup:          %.2fx" % (eager / lazy))
+
+
+if __name__ == '__main__':
+    main()
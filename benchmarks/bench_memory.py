@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Memory benchmark of the compact Resource storage:  the bytes used by a loaded Contact compared to the dicts (_data,
+_dirty and the instance __dict__) Resources used to keep.  Run from the repository root with:
+
+    python -m benchmarks.bench_memory
+"""
+
+import gc
+import sys
+from v2.resource import Contact
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+RESPONSE = {
+    'data': {
+        'id': 1,
+        'creator_id': 10,
+        'owner_id': 10,
+        'is_organization': False,
+        'contact_id': 2,
+        'name': 'Mark Johnson',
+        'first_name': 'Mark',
+        'last_name': 'Johnson',
+        'customer_status': 'none',
+        'prospect_status': 'current',
+        'title': 'CEO',
+        'description': None,
+        'industry': 'Design Services',
+        'website': 'www.designservices.com',
+        'email': 'mark@designservices.com',
+        'phone': '508-778-6516',
+        'mobile': '508-778-6516',
+        'fax': None,
+        'twitter': 'mjohnson',
+        'facebook': None,
+        'linkedin': None,
+        'skype': None,
+        'tags': ['important'],
+        'custom_fields': {'known_via': 'tom'},
+        'created_at': '2014-08-27T16:32:56Z',
+        'updated_at': '2014-08-27T16:32:56Z',
+    }
+}
+
+
+class DictStorage(object):
+    """Holds a Resource's values the way Resources used to:  in _data and _dirty dicts on the instance __dict__"""
+    def __init__(self, data):
+        self._data = dict(data)
+        self._dirty = dict()
+        self._loaded = True
+        self._etag = None
+        self._last_modified = None
+        self._Resource__initialized = True
+
+
+def footprint(entity):
+    """Returns the bytes used by an entity and the containers holding its values (the values themselves are shared)"""
+    size = sys.getsizeof(entity)
+    for referent in gc.get_referents(entity):
+        if isinstance(referent, (dict, list, set)):
+            size += sys.getsizeof(referent)
+            if isinstance(referent, dict) and '_data' in referent:
+                # The instance __dict__ of DictStorage
+                size += sys.getsizeof(referent['_data']) + sys.getsizeof(referent['_dirty'])
+    return size
+
+
+def main(count=300000):
+    contact = Contact(1).set_data(RESPONSE)
+    compact = footprint(contact)
+    dicts = footprint(DictStorage(contact._data))
+    print("A loaded %s (%d fields)" % (contact.__class__.__name__, len(RESPONSE['data'])))
+    print("  dict storage:     %d bytes" % dicts)
+    print("  compact storage:  %d bytes" % compact)
+    print("  reduction:        %.1fx" % (dicts / float(compact)))
+    print("%d Contacts save %.1f MB (excluding the values they share)" % (count, count * (dicts - compact) / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main()
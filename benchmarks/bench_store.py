@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+Benchmark of local searches:  the time to answer a Collection search (Persons in one city owned by one user) and an
+indexed lookup (find() by owner_id and email) from a mirror of 50k Contacts in each Store.  Run from the repository root with:
+
+    python -m benchmarks.bench_store
+"""
+
+import timeit
+from benchmarks.bench_memory import RESPONSE
+from store import InMemory, SQLite
+from v2.collection import AddressFilter, ContactSet
+from v2.resource import Contact
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+CITIES = ['Boston', 'Hyannis', 'Springfield', 'Worcester', 'Lowell']
+RECORDS = [dict(RESPONSE['data'], id=i, contact_id=i % 1000, owner_id=i % 50, email='contact%d@example.com' % i,
+                address={'city': CITIES[i % len(CITIES)], 'country': 'US'})
+           for i in range(0, 50000)]
+
+
+def main(repeat=5):
+    search = ContactSet(contact_id=7, address=AddressFilter(city='Springfield'))
+    print("Searching %d Contacts for contact_id=7 in Springfield" % len(RECORDS))
+    for name, store in [('InMemory', InMemory()), ('SQLite', SQLite(':memory:'))]:
+        load = timeit.timeit(lambda: store.put_many(Contact, RECORDS), number=1)
+        found = len(store.query(search))
+        query = min(timeit.repeat(lambda: store.query(search), number=10, repeat=repeat)) / 10
+        find = min(timeit.repeat(lambda: store.find(Contact, owner_id=7, email='contact1007@example.com'),
+                                 number=100, repeat=repeat)) / 100
+        print("  %-9s load:  %.2fs  search:  %.2fms (%d found)  find:  %.3fms" %
+              (name, load, query * 1000, found, find * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+Benchmark of streamed pages:  the time to the first Resource and to the whole page when a large page of Contacts is
+decoded at once or parsed incrementally from 16KB chunks (as read from the socket).  Run from the repository root with:
+
+    python -m benchmarks.bench_streaming
+"""
+
+import json
+import timeit
+from benchmarks.bench_hydration import RECORD
+from codec import iter_array
+from v2.collection import ContactSet
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+PAGE = json.dumps({'items': [{'data': dict(RECORD, id=i)} for i in range(0, 1000)]})
+CHUNKS = [PAGE[i:i + 16384] for i in range(0, len(PAGE), 16384)]
+
+
+def buffered(first=False):
+    page = ContactSet().iter_page(json.loads(''.join(CHUNKS))['items'])
+    return next(page) if first else list(page)
+
+
+def streamed(first=False):
+    page = ContactSet().iter_page(iter_array(iter(CHUNKS)))
+    return next(page) if first else list(page)
+
+
+def main(repeat=15):
+    print("A page of %d Contacts (%d KB)" % (1000, len(PAGE) // 1024))
+    for name, function in [('buffered', buffered), ('streamed', streamed)]:
+        first = min(timeit.repeat(lambda: function(True), number=1, repeat=repeat))
+        total = min(timeit.repeat(function, number=1, repeat=repeat))
+        print("  %-9s first item:  %.4fs  whole page:  %.3fs" % (name, first, total))
+
+
+if __name__ == '__main__':
+    main()
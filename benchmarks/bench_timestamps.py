@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Benchmark of timestamp parsing:  turning 10k Deal records (100 pages of 100) into Resources with every timestamp parsed
+by dateutil or by the ISO-8601 fast path.  Run from the repository root with:
+
+    python -m benchmarks.bench_timestamps
+"""
+
+import dateutil.parser
+import prototype
+import timeit
+from datetime import datetime, timedelta
+from v2.collection import DealSet
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+START = datetime(2015, 3, 1, 9, 0, 0)
+
+
+def record(i):
+    """A Deal record; deals are created a few minutes apart and updated in batches (e.g. by a nightly import)"""
+    created_at = START + timedelta(seconds=i * 173)
+    updated_at = START + timedelta(days=30 + i // 500)
+    return {'data': {
+        'id': i,
+        'creator_id': 10,
+        'owner_id': 10,
+        'contact_id': i + 1000,
+        'name': 'Website Redesign %d' % i,
+        'value': 1000 + i,
+        'currency': 'USD',
+        'hot': i % 2 == 0,
+        'stage_id': 1 + i % 5,
+        'source_id': 2,
+        'loss_reason_id': None,
+        'dropbox_email': 'dropbox@4e627bcd.deals.futuresimple.com',
+        'organization_id': None,
+        'tags': ['important'],
+        'custom_fields': {'known_via': 'tom'},
+        'created_at': created_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'updated_at': updated_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }}
+
+PAGES = [[record(page * 100 + i) for i in range(0, 100)] for page in range(0, 100)]
+
+
+def load_pages():
+    """Builds the Resources of every page"""
+    collection = DealSet()
+    for page in PAGES:
+        collection.format_page([dict(item, data=dict(item['data'])) for item in page])
+
+
+def main(repeat=5):
+    parse_datetime = prototype.parse_datetime
+    prototype.parse_datetime = dateutil.parser.parse
+    try:
+        slow = min(timeit.repeat(load_pages, number=1, repeat=repeat))
+    finally:
+        prototype.parse_datetime = parse_datetime
+    fast = min(timeit.repeat(load_pages, number=1, repeat=repeat))
+    print("Loading %d Deals (created_at and updated_at)" % sum(len(page) for page in PAGES))
+    print("  dateutil:   %.3fs" % slow)
+    print("  fast path:  %.3fs" % fast)
+    print("  speedup:    %.2fx" % (slow / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of Resource.__setattr__:  bulk-populating Leads with the compiled validators versus the PROPERTIES walk
+they replaced.  Run from the repository root with:
+
+    python -m benchmarks.bench_validators
+"""
+
+import gc
+import timeit
+from prototype import Resource, _MASK
+from v2.resource import Deal, Lead, Task
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+class Walk(object):
+    """Validates assignments by walking PROPERTIES, like Resource.__setattr__ used to (the storage is unchanged)"""
+    def __setattr__(self, key, value):
+        index = self._LAYOUT.get(key)
+        if index is None:
+            return Resource.__setattr__(self, key, value)
+        values = self._values
+        if value is values[index]:
+            return self
+        if key in self.PROPERTIES:
+            if isinstance(self.PROPERTIES[key], dict):
+                rules = self.PROPERTIES[key]
+                if 'type' in rules:
+                    type_ = rules['type']
+                    if not isinstance(type_, list):
+                        type_ = [type_]
+                    match = False
+                    for t in type_:
+                        if isinstance(value, t):
+                            match = True
+                            break
+                    if not match:
+                        raise TypeError("%s is not a valid type for %s.%s" % (value, self.__class__.__name__, key))
+                if 'in' in rules and value not in rules['in']:
+                    raise ValueError("%s is not a valid value for %s.%s" % (value, self.__class__.__name__, key))
+            elif not isinstance(value, self.PROPERTIES[key]):
+                raise TypeError("%s.%s must be of type %s" % (self.__class__.__name__, key, self.PROPERTIES[key].__name__))
+            values[index] = value
+            _MASK.__set__(self, self._mask | 1 << index)
+            return self
+        elif '_%s' % key in self.PROPERTIES:
+            raise KeyError("%s is readonly for %s" % (key, self.__class__.__name__))
+        else:
+            raise AttributeError("%s is not a valid attribute for %s" % (key, self.__class__.__name__))
+
+
+class WalkLead(Walk, Lead):
+    pass
+
+
+class WalkTask(Walk, Task):
+    pass
+
+
+LEAD_VALUES = [
+    ('owner_id', 1),
+    ('first_name', 'Mark'),
+    ('last_name', 'Johnson'),
+    ('organization_name', 'Design Services Company'),
+    ('status', 'Unqualified'),
+    ('title', 'CEO'),
+    ('email', 'mark@designservices.com'),
+    ('phone', '508-778-6516'),
+    ('website', 'www.designservices.com'),
+    ('tags', ['important']),
+    ('custom_fields', {'known_via': 'tom'}),
+]
+
+TASK_VALUES = [
+    ('owner_id', 1),
+    ('resource', Deal(1)),
+    ('completed', False),
+    ('due_date', '2015-06-01'),
+    ('content', 'Call back'),
+]
+
+
+def populate(entities, values):
+    for entity in entities:
+        for key, value in values:
+            setattr(entity, key, value)
+
+
+def time_populate(class_, values, count):
+    """Times populating `count` entities, which are created up front so only the assignments are timed"""
+    entities = [class_() for i in range(0, count)]
+    # Like timeit, keep the garbage collector from skewing the timings
+    gc.disable()
+    try:
+        start = timeit.default_timer()
+        populate(entities, values)
+        return timeit.default_timer() - start
+    finally:
+        gc.enable()
+
+
+def compare(name, walk_class, class_, values, count, repeat):
+    # Alternate between the implementations so both see the same machine load
+    walk, compiled = list(), list()
+    for i in range(0, repeat):
+        walk.append(time_populate(walk_class, values, count))
+        compiled.append(time_populate(class_, values, count))
+    walk, compiled = min(walk), min(compiled)
+    print("Populating %d %ss (%d attributes each)" % (count, name, len(values)))
+    print("  PROPERTIES walk:      %.3fs" % walk)
+    print("  compiled validators:  %.3fs" % compiled)
+    print("  speedup:              %.2fx" % (walk / compiled))
+
+
+def main(count=20000, repeat=15):
+    compare('Lead', WalkLead, Lead, LEAD_VALUES, count, repeat)
+    compare('Task', WalkTask, Task, TASK_VALUES, count, repeat)
+
+
+if __name__ == '__main__':
+    main()
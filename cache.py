@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Implements a read-through cache for BaseCRM Resources"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+from collections import OrderedDict
+from prototype import snapshot
+from threading import Lock
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+class ResourceCache(object):
+    """
+    A bounded LRU cache of API responses keyed by (class, API_VERSION, id).  It is meant for reference data that rarely
+    changes (e.g. User, Stage, Pipeline and Source) and is consulted by Rest.get() before going to the network.
+
+    Keyword arguments:
+    max_size -- maximum number of Resources kept; the least recently used entry is evicted first
+    ttls -- dict mapping Resource classes to the number of seconds their entries stay fresh (subclasses inherit the
+            TTL of their parent, e.g. a TTL for Contact applies to Person and Organization)
+    default_ttl -- TTL for classes not found in ttls; None (the default) means other classes are not cached
+
+    Entries are copied in and out of the cache so callers can never modify a cached response.
+    """
+    def __init__(self, max_size=1000, ttls=None, default_ttl=None):
+        self.max_size = max_size
+        self.ttls = ttls or dict()
+        self.default_ttl = default_ttl
+        self.clock = time.time
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def key(entity, class_=None):
+        return class_ or entity.__class__, entity.API_VERSION, entity.id
+
+    def ttl(self, class_):
+        for parent in class_.__mro__:
+            if parent in self.ttls:
+                return self.ttls[parent]
+        return self.default_ttl
+
+    def get(self, entity):
+        """Returns a copy of the cached response for an entity or None if it is not cached (or has expired)"""
+        key = self.key(entity)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, data = entry
+            if expires <= self.clock():
+                self.expirations += 1
+                self.misses += 1
+                return None
+            # Reinsert as the most recently used entry
+            self.entries[key] = entry
+            self.hits += 1
+        return snapshot(data)
+
+    def put(self, entity, data, class_=None):
+        """
+        Caches the response for an entity (if its class has a TTL).  Since some entities change class when loaded (e.g.
+        Contact), class_ may be used to store the response under the class that was requested.
+        """
+        key = self.key(entity, class_)
+        ttl = self.ttl(key[0])
+        if ttl is None or entity.id is None:
+            return
+        entry = (self.clock() + ttl, snapshot(data))
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def refresh(self, entity, data):
+        """
+        Caches data again for an entity the server reported unchanged, under its class and its parent classes of the
+        same endpoint (e.g. a Person loaded as a Contact), like invalidate() removes it.
+        """
+        for class_ in entity.__class__.__mro__:
+            if getattr(class_, '_PATH', None) == entity._PATH:
+                self.put(entity, data, class_)
+
+    def invalidate(self, entity):
+        """Removes an entity from the cache, including entries stored under its parent classes"""
+        with self.lock:
+            for class_ in entity.__class__.__mro__:
+                self.entries.pop(self.key(entity, class_), None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+            }
@@ -4,10 +4,19 @@
 import logging
 logger = logging.getLogger(__name__)
 
-import json
 import requests
+import time
+import uuid
+from codec import default_codec
+from heapq import heapify, heappop, heappush
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+from threading import Lock
 from v2.authentication import Password, Token
-from prototype import Resource, Collection
+from prototype import Resource, Collection, PageError, snapshot
+from store import InMemory
+from transport import Session
+from v2.resource import Contact, Deal, Lead, LossReason, Note, Pipeline, Source, Stage, Tag, Task, User
 
 __author__ = 'Clayton Daley III'
 __copyright__ = "Copyright 2015, Clayton Daley III"
@@ -47,37 +56,141 @@ class ConcurrencyError(Exception):
     pass
 
 
+class SyncError(Exception):
+    """Raised when the Sync API rejects a request"""
+    pass
+
+
+class RateLimitError(Exception):
+    """Raised when the API answers 429 (Too Many Requests)"""
+    def __init__(self, message, retry_after=None):
+        super(RateLimitError, self).__init__(message)
+        # seconds the server asked us to wait (if provided)
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_response(cls, response):
+        try:
+            retry_after = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            retry_after = None
+        return cls("Rate limit exceeded:  %s" % response.text, retry_after)
+
+
+class WriteResult(object):
+    """The outcome for one entity of save_many() or create_many()"""
+    SUCCESS = 'success'
+    # The API (or the client) rejected the data, sending it again will not help
+    VALIDATION_ERROR = 'validation_error'
+    # The request failed for any other reason (5xx, 429, connection errors...)
+    SERVER_ERROR = 'server_error'
+
+    def __init__(self, entity, status, response=None, error=None):
+        self.entity = entity
+        self.status = status
+        # the API response, if one was received
+        self.response = response
+        # the exception raised, if any.  A SUCCESS may also carry one:  the write was applied but its response could not
+        # be loaded into the entity (so the entity does not reflect it and must not be written again)
+        self.error = error
+
+    @property
+    def success(self):
+        return self.status == self.SUCCESS
+
+    def __repr__(self):
+        code = None if self.response is None else self.response.status_code
+        return "WriteResult(%s, %s, %s)" % (self.entity.__class__.__name__, self.status, code or self.error)
+
+
 class Rest(object):
     """
     The BaseAPI class is a Mediator that knows how to combine authentication an entity objects to achieve specific API
     actions (get, put, post, delete).  It also knows how to handle a variety of common API endpoint errors.
     """
     debug = False
+    # The largest page the API will return
+    MAX_PER_PAGE = 100
 
-    def __init__(self, auth):
+    def __init__(self, auth, session=None, cache=None, codec=None):
+        """
+        Keyword arguments:
+        auth -- an authentication object (see v1.authentication and v2.authentication)
+        session -- (optional) a transport.Session; by default, the client shares the Session of its auth object so
+                   every verb and every token refresh reuse the same connection pool
+        cache -- (optional) a cache.ResourceCache consulted by get() and invalidated by save() and delete()
+        codec -- (optional) a codec.JsonCodec for request and response bodies; by default, the fastest JSON backend
+                 installed
+        """
         self.auth = auth
+        self.cache = cache
+        self.codec = codec or default_codec()
+        if session is None:
+            session = getattr(auth, 'session', None)
+            if session is None:
+                session = Session()
+        self.session = session
+        self.auth.session = session
+
+    def pool_stats(self):
+        """Returns the connection pool statistics of the shared Session (see transport.Session.stats())"""
+        return self.session.stats()
 
     def get(self, entity):
         if not isinstance(entity, Resource):
             raise TypeError("Can only get() a Resource")
+        if entity.id is None:
+            raise ValueError("ID must be set to get()")
+
+        if self.cache is not None:
+            data = self.cache.get(entity)
+            if data is not None:
+                logger.debug("Loaded %s %s from cache" % (entity.__class__.__name__, entity.id))
+                return entity.set_data(data)
+        # Some entities (e.g. Contact) change class once loaded
+        class_ = entity.__class__
 
         headers = self.auth.headers(entity.API_VERSION)
         headers['Content-Type'] = 'application/json'
+        # A loaded entity is only sent again if it changed on the server
+        headers.update(entity.conditional_headers())
 
         logger.debug("Preparing GET with:")
         logger.debug("url:  %s" % entity.URL(self.debug))
         logger.debug("headers:  %s" % headers)
-        response = requests.get(url=entity.URL(self.debug), headers=headers)
-
-        if requests.codes.multiple_choices > response.status_code >= requests.codes.ok:
-            print("GET SUCCESS:  %s" % response.text)
-            entity.set_data(response.json()[entity.DATA_PARENT_KEY])
+        response = self.session.get(url=entity.URL(self.debug), headers=headers)
+
+        if response.status_code == requests.codes.not_modified:
+            logger.debug("GET NOT MODIFIED:  %s %s" % (entity.__class__.__name__, entity.id))
+            if self.cache is not None and len(entity._dirty) == 0:
+                # The data is still current, so it is cached again (otherwise an expired entry is never refreshed)
+                self.cache.refresh(entity, {entity.DATA_PARENT_KEY: entity.get_record()})
+        elif requests.codes.multiple_choices > response.status_code >= requests.codes.ok:
+            logger.debug("GET SUCCESS:  %s %s" % (entity.__class__.__name__, entity.id))
+            data = self.codec.decode(response)
+            if self.cache is not None:
+                self.cache.put(entity, data, class_)
+            entity.set_data(data)
+            entity.set_validators(response.headers.get('ETag'), response.headers.get('Last-Modified'))
         else:
-            print("GET ERROR:  %s" % response.text)
+            logger.error("GET ERROR:  %s" % response.text)
         # entity is mutable, but this simplifies chaining and assignment
         return entity
 
     def save(self, entity):
+        self._save(entity)
+        # entity is mutable, but this simplifies chaining and assignment
+        return entity
+
+    def _save(self, entity):
+        """Implements save(), returning the response"""
+        response = self._put(entity, self._save_data(entity))
+        self._load_written(entity, response, 'PUT')
+        return response
+
+    @staticmethod
+    def _save_data(entity):
+        """Validates an entity for save() and returns the data to send (raises before anything is sent)"""
         if not isinstance(entity, Resource):
             raise TypeError("Can only save() a Resource")
         if entity.id is None:
@@ -87,26 +200,35 @@ class Rest(object):
         if len(data) == 0:
             raise UnchangedError("No data to save()")
         # Wrap the item in the relevant key
-        data = {entity.DATA_PARENT_KEY: data}
+        return {entity.DATA_PARENT_KEY: data}
 
+    def _put(self, entity, data):
         headers = self.auth.headers(entity.API_VERSION)
         headers['Content-Type'] = 'application/json'
 
+        if self.cache is not None:
+            self.cache.invalidate(entity)
+
         logger.debug("Preparing PUT with:")
         logger.debug("url:  %s" % entity.URL(self.debug))
         logger.debug("headers:  %s" % headers)
         logger.debug("data:  %s" % data)
-        response = requests.put(url=entity.URL(self.debug), headers=headers, data=json.dumps(data))
+        return self.session.put(url=entity.URL(self.debug), headers=headers, data=self.codec.dumps(data))
 
-        if requests.codes.multiple_choices > response.status_code >= requests.codes.ok:
-            print("PUT SUCCESS:  %s" % response.text)
-            entity.set_data(response.json()[entity.DATA_PARENT_KEY])
-        else:
-            print("PUT ERROR:  %s" % response.text)
+    def create(self, entity):
+        self._create(entity)
         # entity is mutable, but this simplifies chaining and assignment
         return entity
 
-    def create(self, entity):
+    def _create(self, entity):
+        """Implements create(), returning the response"""
+        response = self._post(entity, self._create_data(entity))
+        self._load_written(entity, response, 'POST')
+        return response
+
+    @staticmethod
+    def _create_data(entity):
+        """Validates an entity for create() and returns the data to send (raises before anything is sent)"""
         if not isinstance(entity, Resource):
             raise TypeError("Can only create() a Resource")
         if entity.id is not None:
@@ -116,8 +238,9 @@ class Rest(object):
         if len(data) == 0:
             raise UnchangedError("No data for create()")
         # Wrap the item in the relevant key
-        data = {entity.DATA_PARENT_KEY: data}
+        return {entity.DATA_PARENT_KEY: data}
 
+    def _post(self, entity, data):
         headers = self.auth.headers(entity.API_VERSION)
         headers['Content-Type'] = 'application/json'
 
@@ -125,15 +248,58 @@ class Rest(object):
         logger.debug("url:  %s" % entity.URL(self.debug))
         logger.debug("headers:  %s" % headers)
         logger.debug("data:  %s" % data)
-        response = requests.post(url=entity.URL(self.debug), headers=headers, data=json.dumps(data))
+        return self.session.post(url=entity.URL(self.debug), headers=headers, data=self.codec.dumps(data))
 
+    def _load_written(self, entity, response, method):
+        """Loads the response to a PUT or POST into the entity"""
         if requests.codes.multiple_choices > response.status_code >= requests.codes.ok:
-            print("POST SUCCESS:  %s" % response.text)
-            entity.set_data(response.json()[entity.DATA_PARENT_KEY])
+            entity.set_data(self.codec.decode(response))
+            logger.debug("%s SUCCESS:  %s %s" % (method, entity.__class__.__name__, entity.id))
         else:
-            print("POST ERROR:  %s" % response.text)
-        # entity is mutable, but this simplifies chaining and assignment
-        return entity
+            logger.error("%s ERROR:  %s" % (method, response.text))
+
+    def save_many(self, entities, concurrency=10):
+        """
+        Saves many Resources using a pool of `concurrency` worker threads (sharing the client's connection pool).  A
+        failure never aborts the batch.  Returns a WriteResult for each entity, in the order they were provided.
+        """
+        return self._write_many(self._save_data, self._put, 'PUT', entities, concurrency)
+
+    def create_many(self, entities, concurrency=10):
+        """
+        Creates many Resources using a pool of `concurrency` worker threads (sharing the client's connection pool).  A
+        failure never aborts the batch.  Returns a WriteResult for each entity, in the order they were provided.
+        """
+        return self._write_many(self._create_data, self._post, 'POST', entities, concurrency)
+
+    def _write_many(self, prepare, send, method, entities, concurrency):
+        def write_one(entity):
+            try:
+                data = prepare(entity)
+            except (TypeError, ValueError, UnchangedError) as e:
+                # Rejected before anything was sent
+                return WriteResult(entity, WriteResult.VALIDATION_ERROR, error=e)
+            try:
+                response = send(entity, data)
+            except Exception as e:
+                return WriteResult(entity, WriteResult.SERVER_ERROR, error=e)
+            if requests.codes.multiple_choices > response.status_code >= requests.codes.ok:
+                try:
+                    self._load_written(entity, response, method)
+                except Exception as e:
+                    # The write was applied, only loading the response failed (so it must not be sent again)
+                    return WriteResult(entity, WriteResult.SUCCESS, response, e)
+                return WriteResult(entity, WriteResult.SUCCESS, response)
+            elif response.status_code in [requests.codes.bad_request, requests.codes.unprocessable_entity]:
+                return WriteResult(entity, WriteResult.VALIDATION_ERROR, response)
+            else:
+                return WriteResult(entity, WriteResult.SERVER_ERROR, response)
+
+        pool = ThreadPool(concurrency)
+        try:
+            return pool.map(write_one, entities)
+        finally:
+            pool.close()
 
     def delete(self, entity):
         if not isinstance(entity, Resource):
@@ -141,17 +307,58 @@ class Rest(object):
         if entity.id is None:
             raise ValueError("ID must be set to delete()")
 
-        response = requests.delete(url=entity.URL(self.debug), headers=self.auth.headers(entity.API_VERSION))
+        if self.cache is not None:
+            self.cache.invalidate(entity)
+
+        response = self.session.delete(url=entity.URL(self.debug), headers=self.auth.headers(entity.API_VERSION))
         logger.debug("Response:  \n%s" % response.text)
 
         if requests.codes.multiple_choices > response.status_code >= requests.codes.ok:
-            print("DELETE SUCCESS:  %s" % response.text)
+            logger.debug("DELETE SUCCESS:  %s" % response.text)
         else:
-            print("DELETE ERROR:  %s" % response.text)
+            logger.error("DELETE ERROR:  %s" % response.text)
         # entity is mutable, but this simplifies chaining and assignment
         return entity
 
-    def get_page(self, entity, page, per_page=20, order_by=None):
+    def get_page(self, entity, page, per_page=20, order_by=None, stream=False):
+        """
+        Returns a page of a Collection as a list of Resources (PageError is raised if the API reported an error).
+
+        If stream is True, the page is returned as a generator instead:  the `items` array is parsed as the response
+        arrives and each Resource is yielded as soon as its record is complete, so large pages are never held in
+        memory (the connection stays checked out of the pool until the generator is exhausted or closed).
+        """
+        items = self._get_items(entity, page, per_page, order_by, stream)
+        if stream:
+            return entity.iter_page(items)
+        return entity.format_page(items)
+
+    def get_frame(self, entity, page, per_page=20, order_by=None):
+        """
+        Returns a page of a Collection as a frame.ResourceFrame (PageError is raised if the API reported an error), so
+        its records can be aggregated without building a Resource for each of them.
+        """
+        return entity.format_frame(self._get_items(entity, page, per_page, order_by))
+
+    def iter_frames(self, collection, per_page=100, order_by=None):
+        """
+        Yields a frame.ResourceFrame for each page of a Collection until the first short page.  Combine them with
+        ResourceFrame.concat() to report on the whole Collection.  If a page fails, PageError is raised so a report is
+        never computed over part of the Collection.
+        """
+        page_number = 1
+        while True:
+            frame = self.get_frame(collection, page_number, per_page, order_by)
+            yield frame
+            if len(frame) < per_page:
+                return
+            page_number += 1
+
+    def _get_items(self, entity, page, per_page=20, order_by=None, stream=False):
+        """
+        Loads one page of a Collection and returns the raw items (PageError is raised if the API reported an error).
+        If stream is True, the items are returned as a generator parsing the response incrementally.
+        """
         if not isinstance(entity, Collection):
             raise TypeError("Can only loadpage() for a Collection")
 
@@ -162,13 +369,15 @@ class Rest(object):
         data['page'] = page
         data['per_page'] = per_page
 
-        # clean up boolean formatting
+        # clean up boolean and list formatting
         for k, v in data.iteritems():
             if isinstance(data[k], bool):
                 if data[k]:
                     data[k] = 'true'
                 else:
                     data[k] = 'false'
+            elif isinstance(data[k], list):
+                data[k] = ','.join([str(i) for i in data[k]])
 
         logger.debug("Preparing GET with:")
         logger.debug("url:  %s" % entity.URL(self.debug))
@@ -177,82 +386,516 @@ class Rest(object):
 
         if order_by is not None:
             if order_by not in entity.ORDERS:
-                raise ValueError('%s is not a valid sort order for %s' % order_by, entity.__class__.__name__)
+                raise ValueError('%s is not a valid sort order for %s' % (order_by, entity.__class__.__name__))
             data['order_by'] = order_by
 
-        response = requests.get(url=url, params=data, headers=headers)
+        response = self.session.get(url=url, params=data, headers=headers, stream=stream)
 
         if requests.codes.multiple_choices > response.status_code >= requests.codes.ok:
-            print("GET SUCCESS:  %s" % response.text)
-            return entity.format_page(response.json()['items'])
+            logger.debug("GET SUCCESS:  %s page %d" % (entity.__class__.__name__, page))
+            if stream:
+                return self.codec.iter_items(response)
+            return self.codec.decode(response)['items']
+        elif response.status_code == requests.codes.too_many_requests:
+            raise RateLimitError.from_response(response)
         else:
-            print("GET ERROR:  %s" % response.text)
+            logger.error("GET ERROR:  %s" % response.text)
+            raise PageError("Page %d of %s could not be loaded (%d)" %
+                            (page, entity.__class__.__name__, response.status_code))
 
+    def get_many(self, resources):
+        """
+        Loads many Resources with as few requests as possible.  Resources are grouped by class and their ids are sent,
+        MAX_PER_PAGE at a time, to the `ids` filter of the Collection listing that class.  Each Resource is populated
+        in place (using set_data()) so it behaves exactly as if get() had been called on it.
 
-class Sync(object):
-    """
-    Sync client...
-    """
-    @staticmethod
-    def start(sync_service):
+        Returns a list of the Resources that were not found (or could not be loaded).
         """
-        Establishes a Sync cursor with the server
-        :param sync_service: an object providing the SyncService interface
-        :return: the id used to pull Sync data for the sync_service's device id
+        by_class = dict()
+        for resource in resources:
+            if not isinstance(resource, Resource):
+                raise TypeError("Can only get_many() Resources")
+            if resource.id is None:
+                raise ValueError("ID must be set to get_many()")
+            by_class.setdefault(resource.__class__, dict()).setdefault(resource.id, []).append(resource)
+
+        missing = list()
+        for class_, by_id in by_class.iteritems():
+            collection_class = Collection.for_item(class_)
+            if collection_class is None or 'ids' not in collection_class.FILTERS:
+                raise ValueError("No Collection with an ids filter found for %s" % class_.__name__)
+            ids = sorted(by_id)
+            for start in range(0, len(ids), self.MAX_PER_PAGE):
+                chunk = ids[start:start + self.MAX_PER_PAGE]
+                try:
+                    items = self._get_items(collection_class(ids=chunk), 1, self.MAX_PER_PAGE)
+                except PageError:
+                    # Reported as missing
+                    items = []
+                for record in items:
+                    entities = by_id.pop(record[class_.DATA_PARENT_KEY]['id'], [])
+                    for i, entity in enumerate(entities):
+                        # set_data() converts the record in place so duplicates need their own copy
+                        entity.set_data(record if i == len(entities) - 1 else snapshot(record))
+            for entities in by_id.itervalues():
+                missing.extend(entities)
+        return missing
+
+    def iter_collection(self, collection, per_page=20, order_by=None, concurrency=1):
         """
-        url = 'https://sync.futuresimple.com/api/v1/sync/start.json'
-        headers = sync_service.headers()
-        headers['Content-Type'] = 'application/json'
+        Yields every Resource in a Collection, loading one page at a time.  While a page is being consumed, the next
+        page is loaded in the background.  Iteration stops after the first short page so, regardless of the size of
+        the Collection, only two pages are held in memory at once.  If a page fails, PageError is raised after the
+        pages before it were yielded.
 
-        known_types = []
+        If concurrency is greater than 1, up to that many pages are requested at once (see iter_collection_parallel).
+        """
+        if concurrency > 1:
+            for entity in self.iter_collection_parallel(collection, per_page, order_by, concurrency):
+                yield entity
+            return
+        if not isinstance(collection, Collection):
+            raise TypeError("Can only iter_collection() for a Collection")
+
+        pool = ThreadPool(1)
+        try:
+            page_number = 1
+            pending = pool.apply_async(self.get_page, (collection, page_number, per_page, order_by))
+            while pending is not None:
+                page = pending.get()
+                if len(page) < per_page:
+                    pending = None
+                else:
+                    # Prefetch the next page while this one is consumed
+                    page_number += 1
+                    pending = pool.apply_async(self.get_page, (collection, page_number, per_page, order_by))
+                for entity in page:
+                    yield entity
+        finally:
+            # Lets an abandoned prefetch finish in the background
+            pool.close()
+
+    def iter_collection_parallel(self, collection, per_page=20, order_by=None, concurrency=4):
+        """
+        Yields every Resource in a Collection (in page order) while requesting up to `concurrency` pages at once on a
+        pool of worker threads.  Pages are reordered as they arrive so the output matches iter_collection().
+
+        Concurrency adapts to the rate limit:  every 429 response (once the Session has given up retrying it) halves the
+        number of pages in flight (down to 1) and the page is requested again.  The wait before that request is left to
+        the RateLimiter of the Session, which holds requests to the host until Retry-After has passed.  Each run of
+        successful pages (as many as the current limit) adds one back, up to `concurrency`.  New pages are only
+        requested while pages in flight and pages waiting to be yielded are under the limit, so memory stays bounded.
+        Retried pages only count the pages in flight, since the pages waiting behind them cannot be yielded until they
+        succeed.
+
+        If a page fails with an error, the pages before it are yielded and PageError is raised, so a failure is never
+        mistaken for the end of the Collection.
+        """
+        if not isinstance(collection, Collection):
+            raise TypeError("Can only iter_collection_parallel() for a Collection")
+
+        def fetch(page_number):
+            try:
+                return page_number, self.get_page(collection, page_number, per_page, order_by), None
+            except Exception as e:
+                return page_number, None, e
+
+        pool = ThreadPool(concurrency)
+        done = Queue()
+        limit = concurrency
+        successes = 0
+        next_page = 1  # the next new page to request
+        expected = 1  # the next page to yield
+        last = None  # the first short page, once known
+        failed = None  # the first page that failed (and its PageError), once known
+        failure = None
+        in_flight = set()
+        retries = []
+        ready = dict()
+        try:
+            while True:
+                while retries and len(in_flight) < limit:
+                    page_number = heappop(retries)
+                    in_flight.add(page_number)
+                    pool.apply_async(fetch, (page_number,), callback=done.put)
+                while not retries and last is None and len(in_flight) + len(ready) < limit:
+                    in_flight.add(next_page)
+                    pool.apply_async(fetch, (next_page,), callback=done.put)
+                    next_page += 1
+
+                page_number, page, error = done.get()
+                in_flight.discard(page_number)
+                if isinstance(error, RateLimitError):
+                    limit = max(1, limit // 2)
+                    successes = 0
+                    logger.info("Rate limited on page %d, concurrency reduced to %d" % (page_number, limit))
+                    heappush(retries, page_number)
+                    continue
+                elif isinstance(error, PageError):
+                    # Raised once the pages before it were yielded
+                    if failed is None or page_number < failed:
+                        failed, failure = page_number, error
+                    page = []
+                elif error is not None:
+                    raise error
+
+                successes += 1
+                if successes >= limit and limit < concurrency:
+                    limit += 1
+                    successes = 0
+                if last is not None and page_number > last:
+                    # Past the end of the Collection
+                    continue
+                if len(page) < per_page:
+                    last = page_number
+                    retries = [r for r in retries if r < last]
+                    heapify(retries)
+                    for number in [r for r in ready if r > last]:
+                        del ready[number]
+                ready[page_number] = page
+
+                while expected in ready:
+                    if expected == failed:
+                        raise failure
+                    for entity in ready.pop(expected):
+                        yield entity
+                    if expected == last:
+                        return
+                    expected += 1
+        finally:
+            # Lets abandoned requests finish in the background
+            pool.close()
+
+
+class AsyncRest(object):
+    """
+    Runs Rest calls on a bounded pool of worker threads so many entities can be fetched (or saved) concurrently.
 
-        types = sync_service.types()
-        for type, version in types.iteritems():
-            known_types.append({
-                'known_type': {
-                    'name': type,
-                    'version': "api.v%d" % version
-                }
-            })
+    Every verb returns immediately with an AsyncResult.  Call result.get() to wait for the call to finish; it returns
+    what Rest would have returned (or raises what Rest would have raised).  At most `concurrency` calls are in flight
+    at once and all of them share the same connection pool.
 
-        data = {
-            'data': known_types
-        }
+    The results are multiprocessing AsyncResults, not awaitables:  this client runs on Python 2, which has no asyncio,
+    so AsyncRest does not plug into an event loop.  An asyncio service has to bridge the blocking calls itself, e.g.
+    with `await loop.run_in_executor(None, rest.get, entity)` (or run_in_executor(None, result.get) for a call already
+    submitted here).  For a Twisted client, see TxBaseCRM.
+    """
+    def __init__(self, auth, session=None, concurrency=10, cache=None, codec=None):
+        self.rest = Rest(auth, session, cache, codec)
+        pool_maxsize = getattr(self.rest.session, 'pool_maxsize', concurrency)
+        if pool_maxsize < concurrency:
+            logger.warning("Session pool_maxsize (%d) is smaller than concurrency (%d), extra connections will not be "
+                           "reused" % (pool_maxsize, concurrency))
+        self.concurrency = concurrency
+        self.pool = ThreadPool(concurrency)
+
+    @property
+    def debug(self):
+        return self.rest.debug
+
+    @debug.setter
+    def debug(self, value):
+        self.rest.debug = value
 
-        response = requests.post(url=url, headers=headers, data=data)
-        if 200 <= response.status_code <= 206:
-            return response.json()['data']['id']
+    def get(self, entity):
+        return self.pool.apply_async(self.rest.get, (entity,))
 
-    @staticmethod
-    def get_permission(sync_service):
-        url = 'https://sync.futuresimple.com/api/v1/sync/start.json'
-        headers = sync_service.headers()
-        headers['Content-Type'] = 'application/json'
+    def save(self, entity):
+        return self.pool.apply_async(self.rest.save, (entity,))
 
-        response = requests.get(url=url, headers=headers)
-        if response.status_code == 204:
-            raise StopIteration("The Sync API reports that no more records are available")
-        # TODO:  Finish logic
+    def create(self, entity):
+        return self.pool.apply_async(self.rest.create, (entity,))
 
-    @staticmethod
-    def get_main(sync_service):
-        url = 'https://sync.futuresimple.com/api/v1/sync/start.json'
-        headers = sync_service.headers()
-        headers['Content-Type'] = 'application/json'
+    def delete(self, entity):
+        return self.pool.apply_async(self.rest.delete, (entity,))
 
-        response = requests.get(url=url, headers=headers)
-        if response.status_code == 204:
-            raise StopIteration("The Sync API reports that no more records are available")
-        # TODO:  Finish logic
+    def get_page(self, entity, page, per_page=20, order_by=None):
+        return self.pool.apply_async(self.rest.get_page, (entity, page, per_page, order_by))
 
     @staticmethod
-    def ack(sync_service):
-        url = 'https://sync.futuresimple.com/api/v1/acks.json'
-        headers = sync_service.headers()
-        headers['Content-Type'] = 'application/json'
+    def wait(results):
+        """Waits for a list of AsyncResults and returns their values in the same order"""
+        return [result.get() for result in results]
+
+    def close(self):
+        """Waits for pending calls to finish and stops the worker threads"""
+        self.pool.close()
+        self.pool.join()
 
-        acks = sync_service.acks()
-        data = {'ack': acks}
+    def __enter__(self):
+        return self
 
-        response = requests.post(url=url, headers=headers, data=data)
-        # TODO:  Finish logic
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Sync(object):
+    """
+    Consumes the Sync API, which sends every change (created, updated and deleted records) since the device last synced
+    instead of polling whole Collections.  run() starts a session, drains its queue and yields a (event_type, Resource)
+    pair for each change, applying it to the store on the way so the store stays a mirror of the account.
+
+    Each change is acknowledged once the consumer asks for the next one.  Acknowledgements are coalesced into batches
+    of at most `ack_batch_size` keys, sent when a batch is full, when the oldest key has waited `ack_interval` seconds
+    and at the end of each page.  Batches are sent by a background thread, so the next page is fetched while the
+    previous acknowledgements are in flight.  Keys stay in the pending set (kept in the store) until the server accepts
+    them, so a restarted consumer first sends those left behind.  The device UUID identifying this consumer to the
+    server is also kept in the store (and generated on first use) so a restart resumes where the previous run stopped.
+
+    Keyword arguments:
+    auth -- a v2 authentication object
+    store -- (optional) a store.Store receiving the changes and keeping the state; by default, a store.InMemory
+    session -- (optional) a transport.Session; by default, the Session of the auth object
+    ack_batch_size -- the maximum number of acknowledgements sent per request
+    ack_interval -- the maximum number of seconds an acknowledgement waits for its batch to fill
+    codec -- (optional) a codec.JsonCodec; by default, the fastest JSON backend installed
+    """
+    debug = False
+    DEVICE_HEADER = 'X-Basecrm-Device-UUID'
+    # Resource classes for the types named in the meta of each change
+    TYPES = {
+        'contact': Contact,
+        'deal': Deal,
+        'lead': Lead,
+        'loss_reason': LossReason,
+        'note': Note,
+        'pipeline': Pipeline,
+        'source': Source,
+        'stage': Stage,
+        'tag': Tag,
+        'task': Task,
+        'user': User,
+    }
+    DELETED = 'deleted'
+    PENDING_ACKS_KEY = 'sync_pending_acks'
+
+    def __init__(self, auth, store=None, session=None, ack_batch_size=50, ack_interval=1.0, codec=None):
+        self.auth = auth
+        self.store = store if store is not None else InMemory()
+        if session is None:
+            session = getattr(auth, 'session', None)
+            if session is None:
+                session = Session()
+        self.session = session
+        self.auth.session = session
+        self.ack_batch_size = ack_batch_size
+        self.ack_interval = ack_interval
+        self.codec = codec or default_codec()
+        self.clock = time.time
+        self.lock = Lock()
+        # Keys not confirmed by the server (in order) and the ones not sent yet
+        self.pending_acks = list(self.store.get_meta(self.PENDING_ACKS_KEY) or [])
+        self.unsent_acks = list(self.pending_acks)
+        self.oldest_unsent = None
+        self.in_flight = list()
+        self.pool = None
+        self.counters = {
+            'changes': 0,
+            'stale': 0,
+            'pages': 0,
+            'fetch_time': 0.0,
+            'acks': 0,
+            'ack_requests': 0,
+            'ack_failures': 0,
+            'ack_time': 0.0,
+        }
+        self.started = None
+
+    @property
+    def device_id(self):
+        device_id = self.store.device_id
+        if device_id is None:
+            device_id = str(uuid.uuid4())
+            self.store.device_id = device_id
+        return device_id
+
+    def URL(self, path):
+        if self.debug:
+            return 'https://api.sandbox.getbase.com/v2/sync%s' % path
+        return 'https://api.getbase.com/v2/sync%s' % path
+
+    def headers(self):
+        headers = self.auth.headers(2)
+        headers[self.DEVICE_HEADER] = self.device_id
+        return headers
+
+    def start(self):
+        """Starts a sync session and returns its id, or None if there is nothing to sync"""
+        response = self.session.post(url=self.URL('/start'), headers=self.headers())
+        if response.status_code == requests.codes.no_content:
+            logger.debug("SYNC START:  nothing to sync")
+            return None
+        if requests.codes.multiple_choices > response.status_code >= requests.codes.ok:
+            return self.codec.decode(response)['data']['id']
+        raise SyncError("Sync session could not be started:  %s %s" % (response.status_code, response.text))
+
+    def fetch(self, session_id, queue='main'):
+        """Returns the next page of changes from a queue of the session, or an empty list once it is drained"""
+        start = self.clock()
+        response = self.session.get(url=self.URL('/%s/queues/%s' % (session_id, queue)), headers=self.headers())
+        self.count('fetch_time', self.clock() - start)
+        if response.status_code == requests.codes.no_content:
+            return list()
+        if requests.codes.multiple_choices > response.status_code >= requests.codes.ok:
+            self.count('pages')
+            return self.codec.decode(response)['items']
+        raise SyncError("Sync queue %s could not be fetched:  %s %s" % (queue, response.status_code, response.text))
+
+    def ack(self, ack_keys):
+        """Acknowledges changes so the server stops sending them"""
+        headers = self.headers()
+        headers['Content-Type'] = 'application/json'
+        response = self.session.post(url=self.URL('/ack'), headers=headers,
+                                     data=self.codec.dumps({'data': {'ack_keys': ack_keys}}))
+        if not requests.codes.multiple_choices > response.status_code >= requests.codes.ok:
+            raise SyncError("Sync acknowledgements were not accepted:  %s %s" % (response.status_code, response.text))
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] += value
+
+    def queue_ack(self, ack_key):
+        """Adds a key to the pending set and sends the unsent keys if a batch is full or has waited ack_interval"""
+        with self.lock:
+            self.pending_acks.append(ack_key)
+            self.unsent_acks.append(ack_key)
+            if self.oldest_unsent is None:
+                self.oldest_unsent = self.clock()
+            due = len(self.unsent_acks) >= self.ack_batch_size or \
+                self.clock() - self.oldest_unsent >= self.ack_interval
+        if due:
+            self.send_acks()
+
+    def send_acks(self):
+        """Hands the unsent keys, in batches of ack_batch_size, to the background thread"""
+        with self.lock:
+            unsent = self.unsent_acks
+            self.unsent_acks = list()
+            self.oldest_unsent = None
+        for start in range(0, len(unsent), self.ack_batch_size):
+            batch = unsent[start:start + self.ack_batch_size]
+            if self.pool is None:
+                self._send(batch)
+            else:
+                self.in_flight.append(self.pool.apply_async(self._send, (batch,)))
+
+    def _send(self, batch):
+        start = self.clock()
+        try:
+            self.ack(batch)
+        except Exception as e:
+            # The keys stay pending (and are sent again by the next run)
+            logger.warning("Failed to acknowledge %d changes:  %s" % (len(batch), e))
+            self.count('ack_failures')
+            return False
+        finally:
+            self.count('ack_requests')
+            self.count('ack_time', self.clock() - start)
+        with self.lock:
+            confirmed = set(batch)
+            self.pending_acks = [key for key in self.pending_acks if key not in confirmed]
+            self.counters['acks'] += len(batch)
+        self.save_pending()
+        return True
+
+    def save_pending(self):
+        """Keeps the pending keys in the store"""
+        with self.lock:
+            self.store.set_meta(self.PENDING_ACKS_KEY, self.pending_acks)
+
+    def wait(self):
+        """Waits for the batches in flight"""
+        while self.in_flight:
+            self.in_flight.pop(0).wait()
+
+    def flush(self):
+        """Sends every unsent acknowledgement and waits for the server to answer"""
+        self.send_acks()
+        self.wait()
+
+    def resource(self, item):
+        """
+        Returns the (event_type, Resource) for a change, or (event_type, None) for a type with no Resource class or a
+        change the store rejected as older than its copy (e.g. delivered out of order)
+        """
+        meta = item['meta']
+        event_type = meta['sync']['event_type']
+        class_ = self.TYPES.get(meta['type'])
+        if class_ is None:
+            return event_type, None
+        data = item['data']
+        resource = class_(data.get('id'))
+        # The store keeps the original since set_data() converts the record in place
+        if not self.store.apply(class_, event_type, data, meta['sync'].get('revision')):
+            logger.debug("SYNC STALE:  %s %s %s" % (event_type, meta['type'], data.get('id')))
+            self.count('stale')
+            return event_type, None
+        if event_type != self.DELETED:
+            resource.set_data({resource.DATA_PARENT_KEY: snapshot(data)})
+        return event_type, resource
+
+    def run(self):
+        """
+        Yields (event_type, Resource) for every change until the queue is drained.  event_type is 'created', 'updated'
+        or 'deleted' (deleted Resources only have an id).  Changes of types without a Resource class are stored in
+        neither the store nor the output, and changes older than the stored copy are not yielded, but both are still
+        acknowledged.
+        """
+        self.started = self.clock()
+        # Sends every key left pending, including batches that failed during a previous run
+        with self.lock:
+            self.unsent_acks = list(self.pending_acks)
+            self.oldest_unsent = None
+        self.flush()
+        session_id = self.start()
+        if session_id is None:
+            return
+        self.pool = ThreadPool(1)
+        try:
+            while True:
+                items = self.fetch(session_id)
+                if not items:
+                    break
+                for item in items:
+                    event_type, resource = self.resource(item)
+                    if resource is not None:
+                        yield event_type, resource
+                    self.count('changes')
+                    self.queue_ack(item['meta']['sync']['ack_key'])
+                self.save_pending()
+                # Acknowledges the page while the next one is fetched
+                self.send_acks()
+            self.flush()
+        finally:
+            self.wait()
+            self.pool.close()
+            self.pool = None
+            self.save_pending()
+
+    def stats(self):
+        """
+        Returns the counters of the consumer:
+
+            {
+                'changes': ...  # changes processed
+                'stale': ...  # changes skipped because the store had a newer copy
+                'pages': ...  # pages fetched
+                'fetch_time': ...  # seconds spent fetching pages
+                'acks': ...  # acknowledgements confirmed by the server
+                'ack_requests': ...  # acknowledgement requests sent (including failures)
+                'ack_failures': ...  # acknowledgement requests that failed
+                'ack_time': ...  # seconds spent sending acknowledgements (in the background)
+                'pending': ...  # acknowledgements not confirmed yet
+                'elapsed': ...  # seconds since run() started
+                'changes_per_second': ...
+                'acks_per_second': ...
+            }
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats['pending'] = len(self.pending_acks)
+        elapsed = self.clock() - self.started if self.started is not None else 0.0
+        stats['elapsed'] = elapsed
+        stats['changes_per_second'] = stats['changes'] / elapsed if elapsed else 0.0
+        stats['acks_per_second'] = stats['acks'] / elapsed if elapsed else 0.0
+        return stats
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""Implements the JSON codec used to encode request bodies and decode responses"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import importlib
+import json
+import re
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+# Backends tried (in order) when none is requested; the first one that can be imported is used
+BACKENDS = ['ujson', 'simplejson', 'json']
+
+
+def find_backend(names=None):
+    """Returns the first JSON module in `names` (default BACKENDS) that can be imported"""
+    for name in names or BACKENDS:
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            continue
+    raise ImportError("None of the JSON backends %s are available" % (names or BACKENDS,))
+
+
+class JsonCodec(object):
+    """
+    Encodes request bodies and decodes response bodies with a JSON module (anything providing dumps() and loads()).
+    By default, the fastest installed backend is used (see BACKENDS) so large pages decode faster when ujson or
+    simplejson are available, and the standard library is used otherwise.
+
+    Keyword arguments:
+    backend -- (optional) a JSON module or the name of one (e.g. 'json' to force the standard library)
+    """
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = find_backend()
+        elif isinstance(backend, basestring):
+            backend = find_backend([backend])
+        self.backend = backend
+        self.name = backend.__name__
+
+    def dumps(self, data):
+        return self.backend.dumps(data)
+
+    def loads(self, content):
+        return self.backend.loads(content)
+
+    def decode(self, response):
+        """
+        Decodes the body of a requests.Response.  Unlike response.json(), the body is parsed straight from its bytes
+        (the API always sends UTF-8) instead of guessing its encoding and building a unicode copy first.  Streamed
+        responses are parsed incrementally by iter_items() instead.
+        """
+        return self.backend.loads(response.content)
+
+    def iter_items(self, response, key='items', chunk_size=16384):
+        """
+        Yields the records of the `key` array of a JSON response one at a time, parsing the body incrementally as it is
+        read (see iter_array()).  Meant for responses requested with stream=True so only the record being parsed is
+        held in memory.  The response is closed once the array ends (or the generator is abandoned).
+        """
+        try:
+            for item in iter_array(response.iter_content(chunk_size), key):
+                yield item
+        finally:
+            response.close()
+
+
+class _ChunkReader(object):
+    """A cursor over a JSON document arriving in chunks, keeping only the unparsed tail of the data in memory"""
+    WHITESPACE = ' \t\n\r'
+    NUMBER = '0123456789.eE+-'
+    # The characters that matter when looking for the end of an array or object, outside and inside of strings
+    STRUCTURE = re.compile(r'["\[\]{}]')
+    STRING = re.compile(r'["\\]')
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """Reads the next chunk, dropping the data already parsed.  Returns False at the end of the document."""
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer = self.buffer[self.pos:] + chunk
+                self.pos = 0
+                return True
+        self.eof = True
+        return False
+
+    def next_char(self):
+        """Consumes and returns the next character that is not whitespace"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                self.pos += 1
+                return self.buffer[self.pos - 1]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, chars):
+        char = self.next_char()
+        if char not in chars:
+            raise ValueError("Expected %s but found %r in JSON document" % (' or '.join(chars), char))
+        return char
+
+    def value(self):
+        """Consumes and returns the next JSON value, reading more chunks until it is complete"""
+        if self.next_char() in '[{':
+            # Find where the array or object ends first so it is decoded once, however many chunks it spans
+            self.pos -= 1
+            self.container_end()
+            value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+            return value
+        self.pos -= 1
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number ending with the buffer (or before a '.' or an exponent) may continue in the next chunk
+                if self.eof or end < len(self.buffer) and self.buffer[end] not in self.NUMBER:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def container_end(self):
+        """
+        Reads chunks until the array or object at pos is complete and returns the offset of its end (or None at the end
+        of the document).  The scan resumes where it stopped after each chunk, so every character is looked at once.
+        """
+        depth = 0
+        in_string = False
+        # Relative to pos, which fill() moves to the start of the buffer
+        scanned = 0
+        while True:
+            buffer = self.buffer
+            index = self.pos + scanned
+            while True:
+                match = (self.STRING if in_string else self.STRUCTURE).search(buffer, index)
+                if match is None:
+                    index = len(buffer)
+                    break
+                char = match.group()
+                index = match.end()
+                if char == '\\':
+                    if index == len(buffer):
+                        # The escaped character is in the next chunk
+                        index -= 1
+                        break
+                    index += 1
+                elif char == '"':
+                    in_string = not in_string
+                elif char in '[{':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return index
+            scanned = index - self.pos
+            if not self.fill():
+                return None
+
+
+def iter_array(chunks, key='items'):
+    """
+    Incrementally parses a JSON object arriving as an iterable of (byte string) chunks and yields the elements of its
+    `key` array as soon as each one is complete.  Other members of the object are parsed and discarded.  Raises
+    KeyError if the object has no `key` member.
+
+    Elements are decoded with the standard library's JSONDecoder.raw_decode() since most faster backends cannot parse
+    a prefix of a document.
+    """
+    reader = _ChunkReader(chunks)
+    reader.expect('{')
+    if reader.next_char() == '}':
+        raise KeyError(key)
+    reader.pos -= 1
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name != key:
+            reader.value()
+        else:
+            reader.expect('[')
+            if reader.next_char() == ']':
+                return
+            reader.pos -= 1
+            while True:
+                yield reader.value()
+                if reader.expect(',]') == ']':
+                    return
+        if reader.expect(',}') == '}':
+            raise KeyError(key)
+
+
+_default = None
+
+
+def default_codec():
+    """Returns the codec shared by clients that were not given one"""
+    global _default
+    if _default is None:
+        _default = JsonCodec()
+        logger.debug("Using the %s JSON backend" % _default.name)
+    return _default
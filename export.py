@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""Exports Collections into columnar files for analytics"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import json
+import os
+from datetime import datetime
+from prototype import Resource, parse_datetime
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+# Column types for the property types found in PROPERTIES (bool must come before int since it is a subclass)
+COLUMN_TYPES = [
+    (bool, 'bool'),
+    ((int, long), 'int64'),
+    (float, 'float64'),
+    (datetime, 'timestamp'),
+    (basestring, 'string'),
+    (list, 'list'),
+]
+
+
+def _column_type(type_):
+    for types, column_type in COLUMN_TYPES:
+        if issubclass(type_, types):
+            return column_type
+    return 'string'
+
+
+class Column(object):
+    """
+    A column of an export:  its name, its type (one of the COLUMN_TYPES values) and the function reading its value from
+    a Resource.
+    """
+    def __init__(self, name, type_, read):
+        self.name = name
+        self.type = type_
+        self.read = read
+
+    def __repr__(self):
+        return "Column(%s, %s)" % (self.name, self.type)
+
+
+def _read_attribute(name):
+    return lambda entity: getattr(entity, name)
+
+
+def _read_nested(name, key):
+    def read(entity):
+        nested = getattr(entity, name)
+        return None if nested is None else getattr(nested, key)
+    return read
+
+
+def _read_custom_field(name, key):
+    def read(entity):
+        value = (getattr(entity, name) or {}).get(key)
+        return value if value is None or isinstance(value, basestring) else unicode(value)
+    return read
+
+
+def _read_json(name):
+    def read(entity):
+        value = getattr(entity, name)
+        return None if value is None else json.dumps(value, sort_keys=True)
+    return read
+
+
+def _read_resource_type(name, resource_types):
+    def read(entity):
+        value = getattr(entity, name)
+        if value is None:
+            return None
+        for resource_type, class_ in resource_types.iteritems():
+            if isinstance(value, class_):
+                return resource_type
+    return read
+
+
+def columns(resource_class, custom_fields=None):
+    """
+    Returns the Columns of an export of resource_class, derived from its PROPERTIES and ordered by name (after id):
+
+     - Resources without an endpoint of their own (e.g. Address) are flattened into a column for each of their
+       properties (address.line1, address.city...)
+     - other Resources (e.g. the deal of a DealContact) are exported as their id (deal.id)
+     - composite `resource` properties (e.g. Note and Task) become resource_type and resource_id columns
+     - dicts (e.g. custom_fields) are flattened into a string column for each key in custom_fields (e.g.
+       custom_fields.known_via) or, if custom_fields is None, exported as JSON text
+    """
+    result = [Column('id', 'int64', _read_attribute('id'))]
+    for name in resource_class._FIELDS:
+        if name == 'id':
+            continue
+        type_ = resource_class._VALIDATORS[name][3]
+        if name == 'resource' and hasattr(resource_class, 'RESOURCE_TYPES'):
+            result.append(Column('resource_type', 'string',
+                                 _read_resource_type(name, resource_class.RESOURCE_TYPES)))
+            result.append(Column('resource_id', 'int64', _read_nested(name, 'id')))
+        elif not isinstance(type_, type) or type_ is object:
+            result.append(Column(name, 'string', _read_json(name)))
+        elif issubclass(type_, Resource) and getattr(type_, '_PATH', None) is None:
+            for key in type_._FIELDS:
+                if key != 'id':
+                    result.append(Column('%s.%s' % (name, key), _column_type(type_._VALIDATORS[key][3]),
+                                         _read_nested(name, key)))
+        elif issubclass(type_, Resource):
+            result.append(Column('%s.id' % name, 'int64', _read_nested(name, 'id')))
+        elif issubclass(type_, dict) and custom_fields is not None:
+            for key in custom_fields:
+                result.append(Column('%s.%s' % (name, key), 'string', _read_custom_field(name, key)))
+        elif issubclass(type_, dict):
+            result.append(Column(name, 'string', _read_json(name)))
+        else:
+            result.append(Column(name, _column_type(type_), _read_attribute(name)))
+    return result
+
+
+class BatchWriter(object):
+    """
+    Writes batches of columns to a JSON lines file:  the first line lists the columns ([name, type] pairs) and each
+    following line holds one batch as {name: [values...]}.  Timestamps are written in ISO-8601.  This is the built-in
+    format used when pyarrow is not installed; use read_batches() to read it back.
+    """
+    def __init__(self, path, columns_):
+        self.file = open(path, 'wb')
+        self.columns = columns_
+        self.file.write(json.dumps({'columns': [[column.name, column.type] for column in columns_]}) + '\n')
+
+    def write(self, batch):
+        for column, values in zip(self.columns, batch):
+            if column.type == 'timestamp':
+                values[:] = [None if value is None else value.isoformat() for value in values]
+        self.file.write(json.dumps(dict((column.name, values) for column, values in zip(self.columns, batch))) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter(object):
+    """Writes batches of columns as the row groups of a Parquet file (requires pyarrow)"""
+    def __init__(self, path, columns_):
+        if pyarrow is None:
+            raise ImportError("pyarrow is required to export Parquet files")
+        types = {
+            'bool': pyarrow.bool_(),
+            'int64': pyarrow.int64(),
+            'float64': pyarrow.float64(),
+            'timestamp': pyarrow.timestamp('us', tz='UTC'),
+            'string': pyarrow.string(),
+            'list': pyarrow.list_(pyarrow.string()),
+        }
+        self.columns = columns_
+        self.schema = pyarrow.schema([pyarrow.field(column.name, types[column.type]) for column in columns_])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, batch):
+        arrays = [pyarrow.array(values, type=field.type) for values, field in zip(batch, self.schema)]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {
+    'jsonl': BatchWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def read_batches(path):
+    """Yields each batch of a file written by BatchWriter as a dict of columns, with timestamps parsed"""
+    with open(path, 'rb') as file_:
+        columns_ = json.loads(file_.readline())['columns']
+        for line in file_:
+            batch = json.loads(line)
+            for name, type_ in columns_:
+                if type_ == 'timestamp':
+                    batch[name] = [None if value is None else parse_datetime(value) for value in batch[name]]
+            yield batch
+
+
+def export(rest, collection, path, format=None, resource_class=None, custom_fields=None, chunk_size=10000,
+           per_page=100, order_by=None):
+    """
+    Streams every Resource of a Collection into a columnar file and returns the number of rows written.  Resources are
+    loaded page by page (see Rest.iter_collection()) and written in batches of chunk_size rows, so memory stays constant
+    however large the Collection is.
+
+    Keyword arguments:
+    format -- 'parquet' (requires pyarrow) or 'jsonl' (see BatchWriter); by default, parquet if pyarrow is installed
+    resource_class -- the class whose PROPERTIES define the columns (see columns()); by default, the Collection's
+                      _ITEM.  Collections of mixed classes (e.g. ContactSet) need one (e.g. Contact).
+    custom_fields -- names of the custom fields to flatten into columns (see columns())
+
+    If a page cannot be loaded, the incomplete file is removed and PageError is raised.
+    """
+    if format is None:
+        format = 'jsonl' if pyarrow is None else 'parquet'
+        if pyarrow is None:
+            logger.warning("pyarrow is not installed, exporting %s as jsonl instead of parquet" % path)
+    if format not in WRITERS:
+        raise ValueError("format must be one of %s" % ', '.join(sorted(WRITERS)))
+    if resource_class is None:
+        resource_class = getattr(collection, '_ITEM', None)
+        if resource_class is None:
+            raise ValueError("resource_class is required to export a %s" % collection.__class__.__name__)
+
+    columns_ = columns(resource_class, custom_fields)
+    writer = WRITERS[format](path, columns_)
+    rows = 0
+    complete = False
+    try:
+        batch = [list() for column in columns_]
+        for entity in rest.iter_collection(collection, per_page, order_by):
+            for column, values in zip(columns_, batch):
+                values.append(column.read(entity))
+            rows += 1
+            if len(batch[0]) >= chunk_size:
+                writer.write(batch)
+                batch = [list() for column in columns_]
+        if batch[0]:
+            writer.write(batch)
+        complete = True
+    finally:
+        writer.close()
+        if not complete:
+            # A partial export must never be mistaken for the whole Collection
+            os.remove(path)
+            logger.error("Removed the incomplete export %s after %d rows" % (path, rows))
+    logger.info("Exported %d %s rows to %s (%s)" % (rows, resource_class.__name__, path, format))
+    return rows
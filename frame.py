@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""Implements a columnar representation of pages of Resources for analytics"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from array import array
+from datetime import datetime
+from itertools import compress
+from prototype import parse_datetime, _ISO_8601, _UTC
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+def _kind(type_):
+    if not isinstance(type_, type):
+        return 'object'
+    if issubclass(type_, bool):
+        return 'bool'
+    if issubclass(type_, (int, long)):
+        return 'int'
+    if issubclass(type_, float):
+        return 'float'
+    if issubclass(type_, datetime):
+        return 'datetime'
+    return 'object'
+
+
+def _utc(value):
+    """Converts a timestamp (string or datetime) into a naive UTC datetime"""
+    if isinstance(value, basestring):
+        value = parse_datetime(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(_UTC).replace(tzinfo=None)
+    return value
+
+
+class ResourceFrame(object):
+    """
+    The records of one or more pages of a Collection stored by column instead of as Resources, so reports (e.g. the sum
+    of Deal.value by stage_id) never build a Resource per row.  Columns are derived from the PROPERTIES of a Resource
+    class and hold the raw API values:
+
+     - with numpy, int, bool and float fields are int64, bool and float64 arrays, datetime fields are datetime64[us]
+       arrays (UTC) and other fields (strings, Addresses, custom_fields...) are object arrays
+     - without numpy, int fields are array('l') and other fields are lists (datetimes as naive UTC datetimes)
+
+    Missing values (None) are stored as 0 (or False, NaN, NaT) in typed columns and flagged in self.nulls[name].
+    """
+    def __init__(self, resource_class, columns, nulls):
+        self.resource_class = resource_class
+        self.columns = columns
+        self.nulls = nulls
+
+    @staticmethod
+    def kinds(resource_class):
+        """Returns the (name, kind) of each column of resource_class, where kind is int, bool, float, datetime or object"""
+        return [(name, 'int' if name == 'id' else _kind(resource_class._VALIDATORS[name][3]))
+                for name in resource_class._FIELDS]
+
+    @classmethod
+    def from_records(cls, resource_class, records):
+        """Builds a frame from API records (e.g. the items of a page:  [{'data': {...}}, ...])"""
+        parent = resource_class.DATA_PARENT_KEY
+        records = [record[parent] for record in records]
+        columns = dict()
+        nulls = dict()
+        for name, kind in cls.kinds(resource_class):
+            column = [data.get(name) for data in records]
+            if kind == 'object':
+                columns[name] = cls._objects(column)
+                continue
+            nulls[name] = cls._array([value is None for value in column], 'bool')
+            if kind == 'datetime':
+                column = cls._timestamps(column)
+            elif kind == 'bool':
+                column = [False if value is None else value for value in column]
+            elif kind == 'int':
+                column = [0 if value is None else value for value in column]
+            columns[name] = cls._array(column, kind)
+        return cls(resource_class, columns, nulls)
+
+    @classmethod
+    def concat(cls, frames):
+        """Combines frames (e.g. one per page) of the same Resource class into a single frame"""
+        frames = list(frames)
+        if not frames:
+            raise ValueError("concat() requires at least one frame")
+        resource_class = frames[0].resource_class
+        columns = dict()
+        nulls = dict()
+        for name in frames[0].columns:
+            columns[name] = cls._join([frame.columns[name] for frame in frames])
+            if name in frames[0].nulls:
+                nulls[name] = cls._join([frame.nulls[name] for frame in frames])
+        return cls(resource_class, columns, nulls)
+
+    @staticmethod
+    def _array(values, kind):
+        if numpy is not None:
+            dtype = {'int': numpy.int64, 'bool': numpy.bool_, 'float': numpy.float64, 'datetime': 'datetime64[us]'}
+            if kind == 'float':
+                values = [numpy.nan if value is None else value for value in values]
+            return numpy.array(values, dtype=dtype[kind])
+        if kind == 'int':
+            return array('l', values)
+        return values
+
+    @staticmethod
+    def _timestamps(values):
+        """
+        Converts timestamps into naive UTC datetimes or, with numpy, into ISO-8601 text numpy parses itself.  Records
+        often share timestamps so each distinct value is only converted once.
+        """
+        converted = {None: None}
+        column = list()
+        for value in values:
+            if value not in converted:
+                if numpy is not None and isinstance(value, basestring) and value.endswith('Z') and \
+                        _ISO_8601.match(value):
+                    converted[value] = value[:-1]
+                elif numpy is not None:
+                    converted[value] = _utc(value).isoformat()
+                else:
+                    converted[value] = _utc(value)
+            column.append(converted[value])
+        return column
+
+    @staticmethod
+    def _objects(values):
+        if numpy is None:
+            return values
+        # Assigned one by one so lists (e.g. tags) are kept as values instead of becoming a second dimension
+        column = numpy.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            column[i] = value
+        return column
+
+    @staticmethod
+    def _join(columns):
+        if numpy is not None:
+            return numpy.concatenate(columns)
+        joined = columns[0][:]
+        for column in columns[1:]:
+            joined.extend(column)
+        return joined
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __repr__(self):
+        return "ResourceFrame(%s, %d rows)" % (self.resource_class.__name__, len(self))
+
+    def value(self, name, index):
+        """Returns the value of a column for one row, or None if it is missing"""
+        if name in self.nulls and self.nulls[name][index]:
+            return None
+        value = self.columns[name][index]
+        return value.item() if hasattr(value, 'item') else value
+
+    def mask(self, **conditions):
+        """
+        Returns a boolean sequence selecting the rows matching every condition.  Like the FILTERS of a Collection,
+        a condition matches a value or, if it is a list, any of its values (e.g. mask(stage_id=[1, 2], hot=True)).
+        """
+        selected = None
+        for name, expected in conditions.iteritems():
+            column = self.columns[name]
+            null = self.nulls.get(name)
+            if numpy is not None:
+                if isinstance(expected, (list, tuple, set)):
+                    matched = numpy.in1d(column, list(expected))
+                else:
+                    matched = column == expected
+                if null is not None:
+                    matched &= ~null
+                selected = matched if selected is None else selected & matched
+            else:
+                if isinstance(expected, (list, tuple, set)):
+                    expected = set(expected)
+                    matched = [value in expected for value in column]
+                else:
+                    matched = [value == expected for value in column]
+                if null is not None:
+                    matched = [m and not n for m, n in zip(matched, null)]
+                selected = matched if selected is None else [s and m for s, m in zip(selected, matched)]
+        if selected is None:
+            return numpy.ones(len(self), dtype=numpy.bool_) if numpy is not None else [True] * len(self)
+        return selected
+
+    def filter(self, mask=None, **conditions):
+        """Returns a new frame with the rows selected by mask (a boolean sequence) and/or conditions (see mask())"""
+        if conditions:
+            selected = self.mask(**conditions)
+            if mask is not None:
+                selected = selected & mask if numpy is not None else [s and m for s, m in zip(selected, mask)]
+            mask = selected
+        if mask is None:
+            return self
+        if numpy is not None:
+            mask = numpy.asarray(mask, dtype=numpy.bool_)
+            take = lambda column: column[mask]
+        else:
+            take = lambda column: type(column)(column.typecode, compress(column, mask)) if isinstance(column, array) \
+                else list(compress(column, mask))
+        return ResourceFrame(self.resource_class,
+                             dict((name, take(column)) for name, column in self.columns.iteritems()),
+                             dict((name, take(null)) for name, null in self.nulls.iteritems()))
+
+    def _codes(self, name):
+        """Returns the group code of each row for a column and the key of each code (None for missing values)"""
+        column = self.columns[name]
+        null = self.nulls.get(name)
+        keys, codes = numpy.unique(column, return_inverse=True)
+        keys = keys.tolist()
+        if null is not None and null.any():
+            codes = numpy.where(null, len(keys), codes)
+            keys.append(None)
+        return codes, keys
+
+    def group_by(self, keys, value=None, how='sum'):
+        """
+        Aggregates a column for each distinct value of the key column(s) and returns a dict of {key: result}.  keys is
+        a column name or a tuple of names (the dict is then keyed by tuples).  how is 'sum', 'mean' (both ignore missing
+        values) or 'count' (the number of rows, value is not needed).  For example, the pipeline value by stage:
+
+            frame.group_by('stage_id', 'value')
+        """
+        if how not in ['sum', 'mean', 'count']:
+            raise ValueError("how must be 'sum', 'mean' or 'count'")
+        if how != 'count' and value is None:
+            raise ValueError("a value column is required to %s" % how)
+        names = keys if isinstance(keys, tuple) else (keys,)
+        if numpy is not None:
+            results = self._group_by_numpy(names, value, how)
+        else:
+            results = self._group_by_python(names, value, how)
+        if isinstance(keys, tuple):
+            return results
+        return dict((key[0], result) for key, result in results.iteritems())
+
+    def _group_by_numpy(self, names, value, how):
+        combined = numpy.zeros(len(self), dtype=numpy.int64)
+        labels = list()
+        for name in names:
+            codes, keys = self._codes(name)
+            combined = combined * len(keys) + codes
+            labels.append(keys)
+        groups, inverse = numpy.unique(combined, return_inverse=True)
+        counts = numpy.bincount(inverse, minlength=len(groups))
+        if how == 'count':
+            totals = counts
+        else:
+            column = self.columns[value]
+            null = self.nulls.get(value)
+            present = ~null if null is not None else numpy.ones(len(self), dtype=numpy.bool_)
+            totals = numpy.zeros(len(groups), dtype=column.dtype)
+            numpy.add.at(totals, inverse[present], column[present])
+            if how == 'mean':
+                present_counts = numpy.bincount(inverse, weights=present, minlength=len(groups))
+                with numpy.errstate(invalid='ignore', divide='ignore'):
+                    totals = totals / present_counts
+        results = dict()
+        for group, total in zip(groups.tolist(), totals.tolist()):
+            key = list()
+            for keys in reversed(labels):
+                group, code = divmod(group, len(keys))
+                key.append(keys[code])
+            results[tuple(reversed(key))] = total
+        return results
+
+    def _group_by_python(self, names, value, how):
+        rows = zip(*[[self.value(name, i) for i in xrange(len(self))] for name in names])
+        totals = dict()
+        counts = dict()
+        for i, key in enumerate(rows):
+            if how == 'count':
+                totals[key] = totals.get(key, 0) + 1
+                continue
+            totals.setdefault(key, 0)
+            amount = self.value(value, i)
+            if amount is not None:
+                totals[key] += amount
+                counts[key] = counts.get(key, 0) + 1
+        if how == 'mean':
+            for key in totals:
+                totals[key] = totals[key] / float(counts[key]) if counts.get(key) else float('nan')
+        return totals
@@ -5,9 +5,14 @@ import logging
 logger = logging.getLogger(__name__)
 
 import abc
-from copy import deepcopy
+from calendar import timegm
+from collections import MutableMapping
 from datetime import datetime
-import dateutil
+import dateutil.parser
+import dateutil.tz
+from email.utils import formatdate
+import re
+from transport import Session
 
 __author__ = 'Clayton Daley III'
 __copyright__ = "Copyright 2015, Clayton Daley III"
@@ -28,13 +33,66 @@ def _key_coded_dict(d):
     return new_dict
 
 
+def snapshot(value):
+    """
+    Copies the containers (dicts and lists) of a value and shares everything else.  Payloads only nest dicts and lists
+    around immutable values (strings, numbers...) so, unlike deepcopy, this only allocates what a caller could mutate.
+    """
+    if isinstance(value, dict):
+        copy = dict(value)
+        for k, v in copy.iteritems():
+            if isinstance(v, _CONTAINERS):
+                copy[k] = snapshot(v)
+        return copy
+    if isinstance(value, list):
+        copy = list(value)
+        for i, v in enumerate(copy):
+            if isinstance(v, _CONTAINERS):
+                copy[i] = snapshot(v)
+        return copy
+    return value
+
+_CONTAINERS = (dict, list)
+
+# The API sends timestamps like 2014-08-27T16:32:56Z (optionally with fractional seconds or a numeric offset)
+_ISO_8601 = re.compile(r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?'
+                       r'(?:(Z)|([+-])(\d\d):?(\d\d))?$')
+_UTC = dateutil.tz.tzutc()
+
+
+def parse_datetime(value):
+    """
+    Converts a timestamp string from the API into a datetime.  ISO-8601 timestamps (the only format the API sends) are
+    parsed directly and anything else falls back to dateutil.parser.parse(), which returns the same datetimes but is
+    much slower.
+    """
+    match = _ISO_8601.match(value)
+    if match is None:
+        return dateutil.parser.parse(value)
+    year, month, day, hour, minute, second, fraction, utc, sign, offset_hour, offset_minute = match.groups()
+    if utc is not None:
+        tzinfo = _UTC
+    elif sign is not None:
+        offset = int(offset_hour) * 3600 + int(offset_minute) * 60
+        tzinfo = dateutil.tz.tzoffset(None, -offset if sign == '-' else offset)
+    else:
+        tzinfo = None
+    return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                    int(fraction.ljust(6, '0')) if fraction else 0, tzinfo)
+
+
 class AuthenticationError(Exception):
     pass
 
 
+class PageError(Exception):
+    """Raised when a page of a Collection could not be loaded"""
+    pass
+
+
 class IBaseCrmAuthentication(object):
     @abc.abstractmethod
-    def headers(self):
+    def headers(self, api_version=None):
         """
         Generate a string for
         """
@@ -46,14 +104,158 @@ class IBaseCrmAuthentication(object):
 
 
 class BaseCrmAuthentication(IBaseCrmAuthentication):
-    def __init__(self):
+    def __init__(self, session=None):
         self._access_token = None
+        # Authentication calls share the connection pool of the client using them (see transport.Session)
+        if session is None:
+            session = Session()
+        self.session = session
+
+
+def _compile_rule(rules):
+    """
+    Compiles a PROPERTIES (or FILTERS) value into (types, choices, type_):  the types accepted by isinstance() (None
+    to accept any type), the list of acceptable values (or None) and the declared type.
+    """
+    if isinstance(rules, dict):
+        type_ = rules.get('type')
+        choices = rules.get('in')
+    else:
+        type_ = rules
+        choices = None
+    # isinstance() accepts a tuple of types but not a list
+    types = tuple(type_) if isinstance(type_, list) else type_
+    if types is object:
+        # Everything is an object so there is nothing to check
+        types = None
+    return types, choices, type_
+
+
+def _check_rule(entity, key, value, types, choices, noun='value'):
+    """Raises TypeError or ValueError if value breaks the compiled rules for entity.key"""
+    if types is not None and not isinstance(value, types):
+        raise TypeError("%s is not a valid type for %s.%s" % (value, entity.__class__.__name__, key))
+    if choices is not None and value not in choices:
+        raise ValueError("%s is not a valid %s for %s.%s" % (value, noun, entity.__class__.__name__, key))
+
+
+def _compile_properties(properties):
+    """
+    Compiles PROPERTIES into a table mapping each attribute (without the readonly underscore) to (types, choices,
+    readonly, type_).  Like the v1 Resources, PROPERTIES may also be a plain list of attribute names that are not
+    type checked.
+    """
+    validators = dict()
+    if isinstance(properties, dict):
+        items = [(key, _compile_rule(rules)) for key, rules in properties.iteritems()]
+    else:
+        items = [(key, (None, None, None)) for key in properties or []]
+    for key, (types, choices, type_) in items:
+        if key.startswith('_'):
+            # An editable attribute wins over a readonly one with the same name
+            validators.setdefault(key[1:], (types, choices, True, type_))
+        else:
+            validators[key] = (types, choices, False, type_)
+    return validators
+
+
+def _compile_filters(filters):
+    """Compiles FILTERS into a table mapping each filter to (types, choices)"""
+    if isinstance(filters, dict):
+        return dict((key, _compile_rule(rules)[:2]) for key, rules in filters.iteritems())
+    return dict((key, (None, None)) for key in filters or [])
+
+
+class EntityMeta(type):
+    """
+    Compiles the PROPERTIES and FILTERS of every Entity class into validator tables when the class is created, so
+    assignments look up a ready-made check instead of interpreting the rules every time.  PROPERTIES and FILTERS must
+    therefore be complete when the class body ends.
+    """
+    def __init__(cls, name, bases, attrs):
+        super(EntityMeta, cls).__init__(name, bases, attrs)
+        # The source of _VALIDATORS, used to detect PROPERTIES overridden on an instance
+        cls._PROPERTIES = getattr(cls, 'PROPERTIES', None)
+        cls._VALIDATORS = _compile_properties(cls._PROPERTIES)
+        cls._FILTER_VALIDATORS = _compile_filters(getattr(cls, 'FILTERS', None))
+        # Fixed field layout of the compact Resource storage (see Resource)
+        cls._FIELDS = tuple(sorted(set(cls._VALIDATORS.keys() + ['id'])))
+        cls._LAYOUT = dict((field, index) for index, field in enumerate(cls._FIELDS))
+        # (index, types, choices) of the editable fields, for the fast path of Resource.__setattr__
+        cls._SETTERS = dict((key, (cls._LAYOUT[key], validator[0], validator[1]))
+                            for key, validator in cls._VALIDATORS.iteritems() if not validator[2])
+
+
+class _Unset(object):
+    """Marks a field of a Resource that holds no value (as opposed to a value of None)"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'UNSET'
+
+_UNSET = _Unset()
+
+
+class _FieldsView(MutableMapping):
+    """
+    A dict-like view of the values (or, if dirty is True, only the local changes) of a Resource.  It replaces the dicts
+    Resources used to keep in _data and _dirty, so code using them keeps working with the compact storage.
+    """
+    __slots__ = ('entity', 'dirty')
+
+    def __init__(self, entity, dirty=False):
+        self.entity = entity
+        self.dirty = dirty
+
+    def __getitem__(self, key):
+        entity = self.entity
+        index = entity._LAYOUT.get(key)
+        if index is not None:
+            value = entity._values[index]
+            if value is not _UNSET:
+                if entity._mask >> index & 1:
+                    return value
+                if not self.dirty:
+                    return entity._hydrate(index) if entity._pending >> index & 1 else value
+        elif entity._extra is not None and key in entity._extra:
+            if not self.dirty or key in (entity._extra_dirty or ()):
+                return entity._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.entity._store(key, value, self.dirty)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.entity._discard(key)
+
+    def __iter__(self):
+        entity = self.entity
+        mask = entity._mask
+        for index, value in enumerate(entity._values):
+            if value is not _UNSET and (not self.dirty or mask >> index & 1):
+                yield entity._FIELDS[index]
+        if entity._extra is not None:
+            extra_dirty = entity._extra_dirty or ()
+            for key in entity._extra:
+                if not self.dirty or key in extra_dirty:
+                    yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return repr(dict(self))
 
 
 class Entity(object):
     """
     Makes it easy to check if an object is a BaseCRM Entity
     """
+    __slots__ = ()
+    __metaclass__ = EntityMeta
+
     def URL(self, debug=False):
         if debug:
             url = 'https://api.sandbox.getbase.com'
@@ -95,137 +297,330 @@ class Resource(Entity):
     DATA_PARENT_KEY = 'data'
     # For import reasons, classes need to setup a local table
     RESOURCE_TYPES = {}
+    PROPERTIES = {}
+    """
+    Resources are stored compactly so hundreds of thousands of them fit in memory.  Instead of dicts, every Resource
+    keeps its values in a list laid out by the (per class) _FIELDS derived from PROPERTIES, with _UNSET marking the
+    fields that have no value, and an integer bitmask of the fields that were changed locally.  Keys that are not in
+    the layout (e.g. extra keys sent by the API) are kept in the _extra dict, which only exists when needed.
+
+    A local change replaces the loaded value of the field.  The _data and _dirty properties provide dict-like views
+    of the values and of the local changes.
+
+    In lazy mode, set_data() keeps the raw values of the response and marks them in the _pending bitmask.  Each field
+    is converted by format_field() the first time it is read and the result replaces the raw value.  LAZY sets the
+    default mode for a class (e.g. Contact.LAZY = True to list Contacts cheaply).
+
+    Every subclass must declare __slots__ = () as well, or its instances get a __dict__ after all (which is only
+    needed to override PROPERTIES on an instance).
+    """
+    LAZY = False
+    __slots__ = ('_values', '_mask', '_pending', '_extra', '_extra_dirty', '_loaded', '_etag', '_last_modified')
 
     def __init__(self, entity_id=None):
         if entity_id is not None and not isinstance(entity_id, int):
             raise TypeError("entity_id must be None or int")
         super(Resource, self).__init__()
-        self._data = dict()
-        self._dirty = dict()
-        self._loaded = False
+        self._fill(dict())
+        object.__setattr__(self, '_loaded', False)
+        # Validators sent by the server with the data, used to make conditional requests
+        object.__setattr__(self, '_etag', None)
+        object.__setattr__(self, '_last_modified', None)
         # This way, entity.id will never tell the user to call get()
-        self._data['id'] = entity_id
-        self.__initialized = True
+        self._values[self._LAYOUT['id']] = entity_id
 
     def __setattr__(self, key, value):
         """Enforce business rules on attributes and store them in a special location"""
-        if not '_Resource__initialized' in self.__dict__:
-            # If the __initialized flag isn't set yet, set the attribute normally
-            object.__setattr__(self, key, value)
+        setter = self._SETTERS.get(key)
+        if setter is not None and self.PROPERTIES is self._PROPERTIES:
+            # Fast path for editable fields (the general case follows)
+            index, types, choices = setter
+            values = self._values
+            if value is values[index]:
+                # Compare using 'is' to ensure mutability is preserved, in which case we don't need to update
+                return self
+            if (types is not None and not isinstance(value, types)) or choices is not None:
+                _check_rule(self, key, value, types, choices)
+            values[index] = value
+            _MASK.__set__(self, self._mask | 1 << index)
             return self
-        if key in self._dirty:
-            # Must nest because we don't want to check _data if a non-matching value is in _dirty
-            if value is self._dirty['key']:
+        index = self._LAYOUT.get(key)
+        if index is not None:
+            values = self._values
+            if value is values[index]:
                 # Compare using 'is' to ensure mutability is preserved, in which case we don't need to update
                 return self
-        elif key in self._data and value is self._data['key']:
-            # Compare using 'is' to ensure mutability is preserved, in which case we don't need to update
+        elif key in _STORAGE:
+            object.__setattr__(self, key, value)
             return self
-        if key in self.PROPERTIES:
-            # PROPERTIES contains a dict -- a list of key-value pairs describing an attributes (PROPERTIES key) and the
-            # business rules that apply to its value (PROPERTIES value)
-            if isinstance(self.PROPERTIES[key], dict):
-                rules = self.PROPERTIES[key]
-                # the 'type' key (optionally a list) contains all accepted types
-                if 'type' in rules:
-                    # Get acceptable types and make sure they're in a list
-                    type_ = rules['type']
-                    if not isinstance(type_, list):
-                        type_ = [type_]
-                    match = False
-                    for t in type_:
-                        if isinstance(value, t):
-                            match = True
-                            break
-                    if not match:
-                        raise TypeError("%s is not a valid type for %s.%s" % (value, self.__class__.__name__, key))
-                # the 'in' key is a list of all acceptable values
-                if 'in' in rules and value not in rules['in']:
-                    raise ValueError("%s is not a valid value for %s.%s" % (value, self.__class__.__name__, key))
-            # Otherwise, the PROPERTIES value is just the accepted type
-            elif not isinstance(value, self.PROPERTIES[key]):
-                raise TypeError("%s.%s must be of type %s" % (self.__class__.__name__, key, self.PROPERTIES[key].__name__))
-            self._dirty[key] = value
+        elif self._extra is not None and key in self._extra and value is self._extra[key]:
             return self
-        elif '_%s' % key in self.PROPERTIES:
-            raise KeyError("%s is readonly for %s" % (key, self.__class__.__name__))
+        # The business rules in PROPERTIES were compiled into a table when the class was created (see EntityMeta)
+        if self.PROPERTIES is self._PROPERTIES:
+            validator = self._VALIDATORS.get(key)
         else:
+            validator = self._validators().get(key)
+        if validator is None:
             raise AttributeError("%s is not a valid attribute for %s" % (key, self.__class__.__name__))
+        types, choices, readonly = validator[0], validator[1], validator[2]
+        if readonly:
+            raise KeyError("%s is readonly for %s" % (key, self.__class__.__name__))
+        if (types is not None and not isinstance(value, types)) or choices is not None:
+            _check_rule(self, key, value, types, choices)
+        if index is not None:
+            values[index] = value
+            _MASK.__set__(self, self._mask | 1 << index)
+        else:
+            self._store(key, value, True)
+        return self
 
     def __getattr__(self, key):
-        # If the value has been set locally, it will be found in dirty and may be returned
-        if key == '__deepcopy__':
-            return object.__deepcopy__
-        if key in self._dirty:
-            return self._dirty[key]
+        if key in _STORAGE or key.startswith('__'):
+            # Storage that is not set up yet (e.g. while copying) or special methods probed by copy and pickle
+            raise AttributeError(key)
+        # If the value has been set locally, it may be returned
+        index = self._LAYOUT.get(key)
+        if index is not None:
+            if self._mask >> index & 1:
+                return self._values[index]
+        elif self._extra_dirty is not None and key in self._extra_dirty:
+            return self._extra[key]
         # 'id' must always return, either from data (where it is usually set) or None (thanks to PROPERTIES checks)
         if key != 'id' and not self._loaded:
             raise ReferenceError("Object has not been loaded. Use get() to populate data before requesting %s." % key)
-        if key in self._data:
-            return self._data[key]
-        # Acknowledge property is valid by returning None
-        if key in self.PROPERTIES:
-            return None
-        # Acknowledge readonly property is valid by returning None
-        if "_%s" % key in self.PROPERTIES:
+        if index is not None:
+            value = self._values[index]
+            if value is not _UNSET:
+                if self._pending >> index & 1:
+                    return self._hydrate(index)
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        # Acknowledge (readonly) property is valid by returning None
+        if key in self._validators():
             return None
         raise AttributeError("%s not a valid attribute of %s" % (key, self.__class__.__name__))
 
-    def set_data(self, data):
+    def _validators(self):
+        """Returns the compiled PROPERTIES, compiling them on the fly if they were overridden on the instance"""
+        properties = self.PROPERTIES
+        if properties is self._PROPERTIES:
+            return self._VALIDATORS
+        return _compile_properties(properties)
+
+    @property
+    def _data(self):
+        return _FieldsView(self)
+
+    @property
+    def _dirty(self):
+        return _FieldsView(self, True)
+
+    def _fill(self, data):
+        """Replaces all values (and discards the local changes) with the ones in the data dict"""
+        layout = self._LAYOUT
+        values = [_UNSET] * len(self._FIELDS)
+        extra = None
+        for key, value in data.iteritems():
+            index = layout.get(key)
+            if index is None:
+                if extra is None:
+                    extra = dict()
+                extra[key] = value
+            else:
+                values[index] = value
+        # Storage is set directly since __setattr__ is built for fields
+        set_ = object.__setattr__
+        set_(self, '_values', values)
+        set_(self, '_mask', 0)
+        set_(self, '_pending', 0)
+        set_(self, '_extra', extra)
+        set_(self, '_extra_dirty', None)
+
+    def _hydrate(self, index):
+        """Converts the raw value of a field loaded in lazy mode (see format_field()) and keeps the result"""
+        key = self._FIELDS[index]
+        value = self.format_field(key, self._values[index], self._data)
+        self._values[index] = value
+        self._pending &= ~(1 << index)
+        if key == 'resource' and self._extra is not None and 'resource_id' in self._extra:
+            # Like format_data_set(), only keep the composite Resource
+            self._discard('resource_id')
+        return value
+
+    def _store(self, key, value, dirty=False):
+        """Stores a value without checking the business rules, marking it as a local change if dirty is True"""
+        index = self._LAYOUT.get(key)
+        if index is not None:
+            self._values[index] = value
+            if dirty:
+                self._mask |= 1 << index
+            return
+        if self._extra is None:
+            self._extra = dict()
+        self._extra[key] = value
+        if dirty:
+            if self._extra_dirty is None:
+                self._extra_dirty = set()
+            self._extra_dirty.add(key)
+
+    def _discard(self, key):
+        """Removes the value (loaded or changed locally) of a field"""
+        index = self._LAYOUT.get(key)
+        if index is not None:
+            self._values[index] = _UNSET
+            self._mask &= ~(1 << index)
+            self._pending &= ~(1 << index)
+        else:
+            del self._extra[key]
+            if self._extra_dirty is not None:
+                self._extra_dirty.discard(key)
+
+    def _set_class(self, class_):
+        """Changes the class of the Resource (e.g. a loaded Contact becomes a Person), moving values to its layout"""
+        if self.__class__ is class_:
+            return
+        fields, values = self._FIELDS, self._values
+        # Move the raw values so fields pending in lazy mode are not converted
+        data = dict((fields[i], value) for i, value in enumerate(values) if value is not _UNSET)
+        data.update(self._extra or {})
+        dirty = list(self._dirty)
+        pending = [fields[i] for i in range(0, len(fields)) if self._pending >> i & 1]
+        object.__setattr__(self, '__class__', class_)
+        self._fill(data)
+        for key in dirty:
+            self._store(key, data[key], True)
+        for key in pending:
+            if key in self._LAYOUT:
+                self._pending |= 1 << self._LAYOUT[key]
+
+    def set_data(self, data, lazy=None):
         """
         Sets the local object to the values indicated in the 'data' array. This function uses the helper
         format_data_set() to allow objects to, for example, convert elements of the response into more usable types.
         For more information on this process, see format_data_set().
+
+        As with API responses, the values are expected to be nested under DATA_PARENT_KEY (e.g. {'data': {...}}).
+        Since the data now reflects the server, any local changes are discarded.
+
+        If lazy is True (by default, the LAZY attribute of the class), format_data_set() is skipped and every field is
+        converted by format_field() when it is first read.  Both modes give the same values as long as conversions are
+        made in format_field(), so Resources should not overload format_data_set() to convert fields.
         """
-        # Assign actual data to self
-        self.__dict__['_data'] = self.format_data_set(data)
+        if lazy is None:
+            lazy = self.LAZY
+        if lazy:
+            record = data[self.DATA_PARENT_KEY]
+            self._fill(record)
+            # Only fields with a value are ever converted so every field may be marked
+            object.__setattr__(self, '_pending', (1 << len(self._FIELDS)) - 1)
+            if self._extra is not None:
+                # Keys outside of the layout are not tracked by _pending so they are converted now
+                for key, value in self._extra.iteritems():
+                    self._extra[key] = self.format_field(key, value, record)
+        else:
+            # Assign actual data to self
+            self._fill(self.format_data_set(data[self.DATA_PARENT_KEY]))
+        # Validators describe the previous data so they are discarded until the client sets new ones
+        object.__setattr__(self, '_etag', None)
+        object.__setattr__(self, '_last_modified', None)
         # Mark data as loaded
-        self.__dict__['loaded'] = True
+        object.__setattr__(self, '_loaded', True)
+        return self  # returned for setting and chaining convenience
+
+    def set_validators(self, etag=None, last_modified=None):
+        """
+        Records the ETag and Last-Modified headers that came with the data.  Must be called after set_data(), which
+        discards the validators of the previous data.
+        """
+        self._etag = etag
+        self._last_modified = last_modified
         return self  # returned for setting and chaining convenience
 
+    def conditional_headers(self):
+        """
+        Returns the headers asking the server to skip the body (304 Not Modified) if the data has not changed since it
+        was loaded.  If the server did not send validators, updated_at is used for If-Modified-Since.
+        """
+        headers = dict()
+        if not self._loaded:
+            return headers
+        if self._etag is not None:
+            headers['If-None-Match'] = self._etag
+        if self._last_modified is not None:
+            headers['If-Modified-Since'] = self._last_modified
+        elif self._etag is None and isinstance(self._data.get('updated_at'), datetime):
+            updated_at = self._data['updated_at']
+            if updated_at.utcoffset() is not None:
+                updated_at = updated_at - updated_at.utcoffset()
+            headers['If-Modified-Since'] = formatdate(timegm(updated_at.timetuple()), usegmt=True)
+        return headers
+
     def format_data_set(self, data):
         """
-        Objects should overload this function to adjust the input, including converting elements into custom types.
-        For example,
+        Converts every field of the input with format_field() and drops the resource_id of a composite `resource`.
+        Conversions into custom types (e.g. the v1 Contact's organisation) belong in format_field(), which lazy mode
+        uses as well (see set_data()).
 
-         - The v2 Contact object wraps the address up into an Address object
-         - In v1, tags are sent as comma-separated lists that should be exploded into real lists
+        By default, values of properties typed as a Resource (e.g. Address) are converted into that Resource and values
+        of properties typed as datetime are parsed.
         """
         for key, value in data.iteritems():
-            if isinstance(value, dict):
-                pass
-            elif key not in self.PROPERTIES:
-                # Assume this is a composite key to be used by another process like `resource`
-                pass
-            elif key == 'resource':
-                """
-                Input is:
-                ...
-                'resource_type': {
-                    'type': basestring,
-                    'in': RESOURCE_TYPES
-                },
-                'resource_id': int,
-                ...
-                """
-                class_ = self.RESOURCE_TYPES[data['resource']]
-                data['resource'] = class_(data['resource_id'])
-            elif issubclass(self.PROPERTIES[key], Resource):
-                instance = value()
-                instance.set_data(data[key])
-                data[key] = instance
-            elif issubclass(self.PROPERTIES[key], datetime.datetime):
-                data[key] = dateutil.parser.parse(data[key])
+            data[key] = self.format_field(key, value, data)
         # This could be adjusted to delete a dynamic list of keys if the resource_id logic was ever proved unreliable
         if 'resource_id' in data:
             del data['resource_id']
 
         return data  # returned for setting and chaining convenience
 
+    def format_field(self, key, value, data):
+        """
+        Converts the value of a single field received from the API (see format_data_set()) and returns it.  data holds
+        the other values of the record, for composite keys like `resource`.
+
+        format_data_set() uses it for every field and, in lazy mode, it converts each field when it is first read, so
+        Resources should overload this function (rather than format_data_set()) to convert their fields.
+        """
+        if value is None:
+            return value
+        validator = self._validators().get(key)
+        if validator is None:
+            # Assume this is a composite key to be used by another process like `resource`
+            return value
+        if key == 'resource':
+            """
+            Input is:
+            ...
+            'resource_type': {
+                'type': basestring,
+                'in': RESOURCE_TYPES
+            },
+            'resource_id': int,
+            ...
+            """
+            class_ = self.RESOURCE_TYPES[value]
+            return class_(data['resource_id'])
+        type_ = validator[3]
+        if not isinstance(type_, type):
+            # Lists of types are only used for composite keys
+            return value
+        if issubclass(type_, Resource) and isinstance(value, dict):
+            instance = type_(value['id']) if 'id' in value else type_()
+            return instance.set_data({instance.DATA_PARENT_KEY: value})
+        if issubclass(type_, datetime) and isinstance(value, basestring):
+            return parse_datetime(value)
+        return value
+
     def get_data(self):
-        data = self.format_data_get(deepcopy(self._dirty))
+        """
+        Returns the local changes formatted for the API.  The client wraps them in DATA_PARENT_KEY before sending.
+
+        The payload is a snapshot:  format_data_get() copies the dicts and lists it returns, so changing the payload
+        never changes the Resource.
+        """
+        data = self.format_data_get(dict(self._dirty))
         # If needed, ID is encoded in URL
-        return {self.DATA_PARENT_KEY: data}
+        return data
 
     def format_data_get(self, dirty):
         data = dict()
@@ -236,14 +631,48 @@ class Resource(Entity):
                 data['resource'] = dirty['resource'].__class__.__name__.lower()
             elif isinstance(value, Resource):
                 data[key] = value.get_data()
-            elif issubclass(value, datetime):
+            elif isinstance(value, datetime):
                 data[key] = value.isoformat()
             else:
-                data[key] = dirty[key]
+                data[key] = snapshot(value)
         return data
 
+    def get_record(self):
+        """
+        Returns the values of the Resource as a record in the format the API sends (the reverse of format_data_set()),
+        e.g. to cache data the server reported unchanged.  Local changes are included, so callers that need the
+        server's data should check _dirty first.
+        """
+        record = dict()
+        fields = self._FIELDS
+        for i, value in enumerate(self._values):
+            if value is _UNSET:
+                continue
+            key = fields[i]
+            if self._pending >> i & 1:
+                # Not converted yet (lazy mode)
+                record[key] = snapshot(value)
+            elif key == 'resource' and isinstance(value, Resource):
+                record['resource'] = value.__class__.__name__.lower()
+                record['resource_id'] = value.id
+            elif isinstance(value, Resource):
+                record[key] = value.get_record()
+            elif isinstance(value, datetime):
+                record[key] = value.isoformat()
+            else:
+                record[key] = snapshot(value)
+        for key, value in (self._extra or {}).iteritems():
+            record[key] = snapshot(value)
+        return record
+
+
+# Names of the compact storage and the descriptor setting the dirty bitmask without going through __setattr__
+_STORAGE = frozenset(Resource.__slots__)
+_MASK = Resource._mask
+
 
 class ResourceV1(Resource):
+    __slots__ = ()
     API_VERSION = 1
     # Needs a different URL builder
 
@@ -257,7 +686,7 @@ class ResourceV1(Resource):
         return url + '.json'
 
     def get_data(self):
-        dirty = self.format_data_get(deepcopy(self._dirty))
+        dirty = self.format_data_get(dict(self._dirty))
 
         data = {
             self.DATA_PARENT_KEY: dirty
@@ -280,34 +709,76 @@ class Collection(Entity):
 
     def __init__(self, **kwargs):
         self.__dict__['filters'] = dict()
-        for key, value in kwargs:
-            self.key = value
+        for key, value in kwargs.iteritems():
+            setattr(self, key, value)
 
     def __setattr__(self, key, value):
-        # If the __initialized flag isn't set yet, set the attribute normally
-        if key in self.FILTERS:
-            # Arrays list acceptable values
-            if isinstance(self.FILTERS[key], list) and value in self.FILTERS[key]:
-                raise ValueError("%s is not a valid filter value for #s" % value, key)
-            if not isinstance(value, self.PROPERTIES[key]):
-                raise TypeError("%s must be of type %s" % (key, self.FILTERS[key].__name__))
-            self.filters[key] = value
-        else:
+        # The business rules in FILTERS were compiled into a table when the class was created (see EntityMeta)
+        validator = self._FILTER_VALIDATORS.get(key)
+        if validator is None:
             raise AttributeError("%s is not a valid filter for %s" % (key, self.__class__.__name__))
+        _check_rule(self, key, value, validator[0], validator[1], 'filter value')
+        self.filters[key] = value
+
+    @classmethod
+    def for_item(cls, resource_class):
+        """
+        Finds the (already imported) Collection listing a Resource class.  Collections are matched on _ITEM or, for
+        Collections like ContactSet that return mixed types, on _PATH.
+        """
+        candidates = list()
+        pending = list(Collection.__subclasses__())
+        while pending:
+            candidate = pending.pop(0)
+            pending.extend(candidate.__subclasses__())
+            if getattr(candidate, '_ITEM', None) is resource_class:
+                return candidate
+            if getattr(candidate, '_ITEM', None) is None and getattr(candidate, '_PATH', None) == \
+                    getattr(resource_class, '_PATH', False):
+                candidates.append(candidate)
+        return candidates[0] if candidates else None
 
     def get_data(self):
-        data = deepcopy(self.filters)
+        # A snapshot, so changing the parameters never changes the filters
+        data = snapshot(self.filters)
         # If needed, ID is encoded in URL
         return data
 
+    def format_data_set(self):
+        """
+        Returns the query parameters for the filters.  Collections should overload this function to adjust the
+        parameters (e.g. to add a fixed filter or normalize a value).
+        """
+        return self.get_data()
+
     def format_page(self, data):
         # Return a page containing API data processed into Resources and Collections
-        page = list()
+        return list(self.iter_page(data))
+
+    def iter_page(self, data):
+        """
+        Yields the Resource for each record as it is read from data, which may be a generator (e.g. the records of a
+        page being streamed from the API) so a page never has to be held in memory.
+        """
         for record in data:
-            entity = self._ITEM()
-            entity.set_data(record)
-            page.append(entity)
-        return page
+            yield self.format_item(record)
+
+    def format_item(self, record):
+        """Returns the Resource for a single record of a page.  Collections should overload this function as needed."""
+        entity = self._ITEM()
+        entity.set_data(record)
+        return entity
+
+    def format_frame(self, data, resource_class=None):
+        """
+        Returns the records of a page as a frame.ResourceFrame (columns derived from the PROPERTIES of resource_class,
+        by default _ITEM) instead of a list of Resources, for reports that aggregate many records.
+        """
+        from frame import ResourceFrame
+        resource_class = resource_class or getattr(self, '_ITEM', None)
+        if resource_class is None:
+            raise ValueError("resource_class is required to format a frame for %s" % self.__class__.__name__)
+        return ResourceFrame.from_records(resource_class, data)
 
 
 class CollectionV1(Collection):
@@ -323,27 +794,9 @@ class CollectionV1(Collection):
 
     def format_data_set(self):
         data = {
-            self.RESPONSE_KEY: deepcopy(self.filters)
+            self.RESPONSE_KEY: self.get_data()
             # e.g. 'contact': {'name': ...}
         }
 
         # to generate ?contact[name]=...
         return _key_coded_dict(data)
-
-
-class SyncService(object):
-    def __init__(self):
-        self.auth = None
-        self.device_id = None
-
-    def headers(self):
-        headers = self.auth.headers()
-        headers['X-Basecrm-Device-UUID'] = self.device_id
-
-    @abc.abstractmethod
-    def acks(self):
-        pass
-
-    @abc.abstractmethod
-    def types(self):
-        pass
\ No newline at end of file
@@ -4,8 +4,13 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from copy import deepcopy
-from prototype import ResourceV1, CollectionV1, _key_coded_dict
+import abc
+import sqlite3
+from calendar import timegm
+from codec import default_codec
+from datetime import datetime
+from prototype import Collection, Resource, parse_datetime, snapshot
+from threading import RLock
 
 __author__ = 'Clayton Daley III'
 __copyright__ = "Copyright 2015, Clayton Daley III"
@@ -15,10 +20,536 @@ __maintainer__ = "Clayton Daley III"
 __status__ = "Development"
 
 
-class Store(object):
+class UnsupportedQuery(ValueError):
+    """Raised when a query filters on a field the store does not index, so it cannot be answered locally"""
     pass
 
 
+def _normalize_timestamp(value):
+    """Returns a timestamp as UTC ISO-8601 text, which sorts chronologically, or None"""
+    if value is None:
+        return None
+    if isinstance(value, basestring):
+        value = parse_datetime(value)
+    if value.tzinfo is not None:
+        value = datetime.utcfromtimestamp(timegm(value.utctimetuple())).replace(microsecond=value.microsecond)
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _collection_path(collection_class):
+    item = getattr(collection_class, '_ITEM', None)
+    path = item._PATH if item is not None else getattr(collection_class, '_PATH', None)
+    return path if isinstance(path, basestring) else None
+
+
+class Store(object):
+    """
+    A local mirror of API records.  Records (the `data` of each item, exactly as the API sends it) are stored for each
+    Resource type (its _PATH, so Person and Organization are both `contacts`) keyed by id, along with their updated_at
+    so an older copy of a record never replaces a newer one.
+
+    The filters of the Collections listing a type (their FILTERS) are indexed so query() answers Collection searches
+    locally:  `ids` matches the id, `q` is a case insensitive search of the name (or content), nested filters like
+    `address` match the fields of the nested record (ignoring case, like the API) and other filters match the field of
+    the same name.  Filters without a matching field (e.g. TaskSet's `remind`) cannot be answered locally and raise
+    UnsupportedQuery.
+
+    Fields in INDEXED_FIELDS are indexed as well (for every type whose records have them) so find() can look records
+    up by fields the Collections cannot filter on (e.g. the owner_id of a Contact).
+
+    Changes from the Sync API (or any other feed) are applied with apply(), which also stores deletions.
+
+    The store also keeps small values (e.g. the device_id of a Sync client) with get_meta() and set_meta().
+    """
+    # Fields searched by the `q` filter
+    SEARCHED_FIELDS = ['name', 'content']
+    # Fields indexed in addition to the filters
+    INDEXED_FIELDS = ['owner_id', 'stage_id', 'contact_id', 'email']
+    DELETED = 'deleted'
+
+    def __init__(self):
+        self.codec = default_codec()
+        self._filters = dict()
+        # Changes skipped by apply() (and put()) because a newer copy or a deletion was stored (see InMemory, SQLite)
+        self.conflicts = 0
+
+    @staticmethod
+    def type(resource_class):
+        return resource_class._PATH
+
+    def filters(self, resource_class):
+        """Returns the names of the filters indexed for a Resource class (nested filters are named like address.city)"""
+        key = (resource_class.API_VERSION, self.type(resource_class))
+        if key not in self._filters:
+            names = set()
+            pending = list(Collection.__subclasses__())
+            while pending:
+                collection_class = pending.pop(0)
+                pending.extend(collection_class.__subclasses__())
+                if collection_class.API_VERSION != key[0] or _collection_path(collection_class) != key[1]:
+                    continue
+                for name, rule in collection_class.FILTERS.iteritems():
+                    if name in ['ids', 'q']:
+                        continue
+                    if isinstance(rule, type) and issubclass(rule, Collection):
+                        names.update('%s.%s' % (name, nested) for nested in rule.FILTERS)
+                    else:
+                        names.add(name)
+            self._filters[key] = frozenset(names)
+        return self._filters[key]
+
+    def indexed(self, resource_class):
+        """Returns the names of every field indexed for a Resource class:  its filters and its INDEXED_FIELDS"""
+        key = (resource_class.API_VERSION, self.type(resource_class), 'indexed')
+        if key not in self._filters:
+            self._filters[key] = self.filters(resource_class) | \
+                frozenset(self.fields(resource_class).intersection(self.INDEXED_FIELDS))
+        return self._filters[key]
+
+    @staticmethod
+    def fields(resource_class):
+        """Returns the names of the fields found in the records of a Resource class"""
+        fields = set(resource_class._VALIDATORS)
+        if 'resource' in fields:
+            # The composite `resource` is sent as resource_type and resource_id
+            fields.update(['resource_type', 'resource_id'])
+        return fields
+
+    def index_values(self, resource_class, record):
+        """Returns the (name, value) pairs indexed for a record"""
+        values = list()
+        for name in self.indexed(resource_class):
+            if '.' in name:
+                parent, nested = name.split('.', 1)
+                value = (record.get(parent) or {}).get(nested)
+                if isinstance(value, basestring):
+                    value = value.lower()
+            else:
+                value = record.get(name)
+                if value is None and name == 'resource_type':
+                    # Records may name the type of the composite `resource` after the property itself
+                    value = record.get('resource')
+            if value is not None and not isinstance(value, (dict, list)):
+                values.append((name, value))
+        return values
+
+    def conditions(self, collection):
+        """
+        Translates the filters of a Collection into a list of (name, values) conditions, where name is `id` or an
+        indexed filter and values a set of accepted values, and the text of `q` (or None).
+        """
+        resource_class = self.resource_class(collection)
+        indexed = self.indexed(resource_class)
+        conditions = list()
+        q = None
+        for name, value in collection.filters.iteritems():
+            if name == 'ids':
+                conditions.append(('id', set(value)))
+            elif name == 'q':
+                q = value.lower()
+            elif isinstance(value, Collection):
+                for nested, nested_value in value.filters.iteritems():
+                    if isinstance(nested_value, basestring):
+                        nested_value = nested_value.lower()
+                    conditions.append(('%s.%s' % (name, nested), {nested_value}))
+            elif name in indexed and name in self.fields(resource_class):
+                conditions.append((name, set(value) if isinstance(value, list) else {value}))
+            else:
+                raise UnsupportedQuery("The %s filter of %s cannot be answered locally" %
+                                       (name, collection.__class__.__name__))
+        # Collections with a fixed filter (e.g. PersonSet) add it to their parameters
+        for name, value in collection.format_data_set().iteritems():
+            if name in indexed and name not in collection.filters and not isinstance(value, (dict, list)):
+                conditions.append((name, {value}))
+        return conditions, q
+
+    @staticmethod
+    def resource_class(collection):
+        """Returns the Resource class of a Collection's records (for mixed Collections, e.g. ContactSet, their parent)"""
+        resource_class = getattr(collection, '_ITEM', None)
+        if resource_class is not None:
+            return resource_class
+        path = _collection_path(collection.__class__)
+        pending = list(Resource.__subclasses__())
+        while pending:
+            candidate = pending.pop(0)
+            pending.extend(candidate.__subclasses__())
+            if candidate.API_VERSION == collection.API_VERSION and getattr(candidate, '_PATH', None) == path:
+                return candidate
+        raise ValueError("%s cannot be queried locally" % collection.__class__.__name__)
+
+    @staticmethod
+    def _stale(known, updated_at, version, deleted=False):
+        """Returns True if a change (updated_at, version) is older than the known (updated_at, version) of a record"""
+        known_updated_at, known_version = known
+        if version is not None and known_version is not None:
+            return version <= known_version if deleted else version < known_version
+        if updated_at is None or known_updated_at is None:
+            return False
+        # A record stored again with the updated_at it was deleted with is the same (deleted) copy
+        return updated_at <= known_updated_at if deleted else updated_at < known_updated_at
+
+    def put(self, resource_class, record):
+        """Stores a record (unless a newer copy is stored) and returns True if it was stored"""
+        return self.put_many(resource_class, [record]) == 1
+
+    def apply(self, resource_class, event_type, record, version=None):
+        """
+        Applies a change (e.g. from the Sync API) to the store and returns True if it was applied.  event_type is
+        'created', 'updated' or 'deleted' (deleted records only need an id) and version is the (optional) revision of
+        the record sent with the change.  Updates older than the stored copy are skipped like put().
+        """
+        if event_type == self.DELETED:
+            self.delete(resource_class, record['id'])
+            return True
+        return self.put(resource_class, record)
+
+    def put_items(self, resource_class, items):
+        """Stores the items of a page (e.g. [{'data': {...}}, ...]) and returns the number stored"""
+        return self.put_many(resource_class, [item[resource_class.DATA_PARENT_KEY] for item in items])
+
+    def load(self, rest, collection, per_page=100, order_by=None):
+        """
+        Mirrors every record of a Collection from the API (through rest) and returns the number stored.  If a page
+        fails, PageError is raised (the pages before it stay stored).
+        """
+        resource_class = self.resource_class(collection)
+        stored = 0
+        page = 1
+        while True:
+            items = rest._get_items(collection, page, per_page, order_by)
+            stored += self.put_items(resource_class, items)
+            if len(items) < per_page:
+                break
+            page += 1
+        return stored
+
+    def get(self, entity):
+        """Loads a Resource (with an id) from the store and returns it, or None if it is not stored"""
+        record = self.get_record(entity.__class__, entity.id)
+        if record is None:
+            return None
+        return entity.set_data({entity.DATA_PARENT_KEY: record})
+
+    def query(self, collection):
+        """Returns the Resources of a Collection found in the store (ordered by id), like a page from the API"""
+        resource_class = self.resource_class(collection)
+        return collection.format_page([{resource_class.DATA_PARENT_KEY: record}
+                                       for record in self.query_records(collection)])
+
+    def find(self, resource_class, **conditions):
+        """
+        Returns the Resources of resource_class (ordered by id) whose indexed fields (see indexed()) match every
+        condition, a value or a list of accepted values (e.g. find(Deal, owner_id=5, stage_id=[1, 2])).
+        """
+        indexed = self.indexed(resource_class)
+        selected = list()
+        for name, value in conditions.iteritems():
+            if name != 'id' and name not in indexed:
+                raise UnsupportedQuery("%s is not indexed for %s" % (name, resource_class.__name__))
+            selected.append((name, set(value) if isinstance(value, (list, tuple, set)) else {value}))
+        return [resource_class(record['id']).set_data({resource_class.DATA_PARENT_KEY: record})
+                for record in self.select(resource_class, selected)]
+
+    def query_records(self, collection):
+        """Returns the records of a Collection found in the store (ordered by id)"""
+        conditions, q = self.conditions(collection)
+        records = self.select(self.resource_class(collection), conditions)
+        if q is not None:
+            records = [record for record in records
+                       if any(q in (record.get(field) or '').lower() for field in self.SEARCHED_FIELDS)]
+        return records
+
+    @property
+    def device_id(self):
+        return self.get_meta('device_id')
+
+    @device_id.setter
+    def device_id(self, value):
+        self.set_meta('device_id', value)
+
+    @abc.abstractmethod
+    def put_many(self, resource_class, records):
+        """Stores records (skipping those older than the stored copy) and returns the number stored"""
+        pass
+
+    @abc.abstractmethod
+    def get_record(self, resource_class, id_):
+        """Returns a copy of the stored record or None"""
+        pass
+
+    @abc.abstractmethod
+    def delete(self, resource_class, id_):
+        pass
+
+    @abc.abstractmethod
+    def select(self, resource_class, conditions):
+        """Returns copies of the records matching every (name, values) condition (see conditions()), ordered by id"""
+        pass
+
+    @abc.abstractmethod
+    def get_meta(self, key, default=None):
+        pass
+
+    @abc.abstractmethod
+    def set_meta(self, key, value):
+        pass
+
+
 class InMemory(Store):
+    """
+    A Store kept in dicts (lost when the process ends), with an in-memory index of each indexed field.  It is meant as
+    the replication target of a feed of changes (see apply()):  besides updated_at, the revision of each record and a
+    tombstone for each deleted record are kept, so changes applied out of order never resurrect a deleted record or
+    replace a newer revision.  Changes skipped this way are counted in self.conflicts.
+    """
     def __init__(self):
-        self.device_id = None
\ No newline at end of file
+        super(InMemory, self).__init__()
+        # {type: {id: (updated_at, record)}}
+        self.records = dict()
+        # {(type, name): {value: set(ids)}}
+        self.indexes = dict()
+        # {(type, id): version} for the records stored by apply()
+        self.versions = dict()
+        # {(type, id): (updated_at, version)} of the deleted records
+        self.tombstones = dict()
+        self.meta = dict()
+        self.lock = RLock()
+
+    def _put(self, resource_class, record, version=None):
+        type_ = self.type(resource_class)
+        by_id = self.records.setdefault(type_, dict())
+        updated_at = _normalize_timestamp(record.get('updated_at'))
+        key = (type_, record['id'])
+        current = by_id.get(record['id'])
+        if current is not None and self._stale((current[0], self.versions.get(key)), updated_at, version) or \
+                key in self.tombstones and self._stale(self.tombstones[key], updated_at, version, deleted=True):
+            self.conflicts += 1
+            return False
+        if current is not None:
+            self._unindex(resource_class, current[1])
+        self.tombstones.pop(key, None)
+        if version is not None:
+            self.versions[key] = version
+        record = snapshot(record)
+        by_id[record['id']] = (updated_at, record)
+        for name, value in self.index_values(resource_class, record):
+            self.indexes.setdefault((type_, name), dict()).setdefault(value, set()).add(record['id'])
+        return True
+
+    def put_many(self, resource_class, records):
+        with self.lock:
+            return sum(1 for record in records if self._put(resource_class, record))
+
+    def apply(self, resource_class, event_type, record, version=None):
+        with self.lock:
+            if event_type != self.DELETED:
+                return self._put(resource_class, record, version)
+            type_ = self.type(resource_class)
+            key = (type_, record['id'])
+            current = self.records.get(type_, dict()).get(record['id'])
+            known = (current[0], self.versions.get(key)) if current is not None else self.tombstones.get(key)
+            if known is None:
+                known = (_normalize_timestamp(record.get('updated_at')), None)
+            elif version is not None and known[1] is not None and version < known[1]:
+                self.conflicts += 1
+                return False
+            self.delete(resource_class, record['id'])
+            # The tombstone keeps the last updated_at (and revision) so older copies of the record are not stored again
+            self.tombstones[key] = (known[0], version if version is not None else known[1])
+            return True
+
+    def _unindex(self, resource_class, record):
+        type_ = self.type(resource_class)
+        for name, value in self.index_values(resource_class, record):
+            ids = self.indexes[(type_, name)][value]
+            ids.discard(record['id'])
+            if not ids:
+                del self.indexes[(type_, name)][value]
+
+    def get_record(self, resource_class, id_):
+        with self.lock:
+            current = self.records.get(self.type(resource_class), dict()).get(id_)
+            return None if current is None else snapshot(current[1])
+
+    def delete(self, resource_class, id_):
+        with self.lock:
+            current = self.records.get(self.type(resource_class), dict()).pop(id_, None)
+            self.versions.pop((self.type(resource_class), id_), None)
+            if current is not None:
+                self._unindex(resource_class, current[1])
+
+    def select(self, resource_class, conditions):
+        type_ = self.type(resource_class)
+        with self.lock:
+            by_id = self.records.get(type_, dict())
+            candidates = list()
+            for name, values in conditions:
+                if name == 'id':
+                    candidates.append(set(id_ for id_ in values if id_ in by_id))
+                    continue
+                index = self.indexes.get((type_, name), dict())
+                matched = [index[value] for value in values if value in index]
+                candidates.append(matched[0] if len(matched) == 1 else set().union(*matched))
+            if candidates:
+                # Intersected from the smallest set of ids
+                candidates.sort(key=len)
+                ids = reduce(lambda ids_, other: ids_ & other, candidates[1:], set(candidates[0]))
+            else:
+                ids = by_id.keys()
+            return [snapshot(by_id[id_][1]) for id_ in sorted(ids)]
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            return snapshot(self.meta.get(key, default))
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.meta[key] = snapshot(value)
+
+
+class SQLite(Store):
+    """
+    A Store persisted in a SQLite database (path, or ':memory:').  Records are kept as JSON text and every indexed
+    filter value is kept in a `filters` table indexed on (type, name, value), so searches never scan the records.  Like
+    InMemory, the revision of each record applied with a version is kept in `versions` and a tombstone of each deleted
+    record in `tombstones`, so changes applied out of order never resurrect a deleted record or replace a newer
+    revision (even after the database is reopened).
+    """
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS resources (type TEXT NOT NULL, id INTEGER NOT NULL, updated_at TEXT, "
+        "data TEXT NOT NULL, PRIMARY KEY (type, id))",
+        "CREATE TABLE IF NOT EXISTS filters (type TEXT NOT NULL, name TEXT NOT NULL, value, id INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS filters_value ON filters (type, name, value)",
+        "CREATE INDEX IF NOT EXISTS filters_id ON filters (type, id, name, value)",
+        "CREATE TABLE IF NOT EXISTS versions (type TEXT NOT NULL, id INTEGER NOT NULL, version, "
+        "PRIMARY KEY (type, id))",
+        "CREATE TABLE IF NOT EXISTS tombstones (type TEXT NOT NULL, id INTEGER NOT NULL, updated_at TEXT, version, "
+        "PRIMARY KEY (type, id))",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    ]
+
+    def __init__(self, path):
+        super(SQLite, self).__init__()
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = RLock()
+        with self.lock, self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _known(self, type_, id_):
+        """Returns the (updated_at, version) of the stored copy of a record and of its tombstone (or None)"""
+        current = self.connection.execute("SELECT r.updated_at, v.version FROM resources r LEFT JOIN versions v "
+                                          "ON v.type = r.type AND v.id = r.id WHERE r.type = ? AND r.id = ?",
+                                          (type_, id_)).fetchone()
+        tombstone = self.connection.execute("SELECT updated_at, version FROM tombstones WHERE type = ? AND id = ?",
+                                            (type_, id_)).fetchone()
+        return current, tombstone
+
+    def _put(self, resource_class, record, version=None):
+        """Stores a record unless a newer copy (or deletion) is known.  Called in a transaction, with the lock held."""
+        type_ = self.type(resource_class)
+        updated_at = _normalize_timestamp(record.get('updated_at'))
+        current, tombstone = self._known(type_, record['id'])
+        if current is not None and self._stale(current, updated_at, version) or \
+                tombstone is not None and self._stale(tombstone, updated_at, version, deleted=True):
+            self.conflicts += 1
+            return False
+        self.connection.execute("DELETE FROM tombstones WHERE type = ? AND id = ?", (type_, record['id']))
+        if version is not None:
+            self.connection.execute("INSERT OR REPLACE INTO versions (type, id, version) VALUES (?, ?, ?)",
+                                    (type_, record['id'], version))
+        self.connection.execute("INSERT OR REPLACE INTO resources (type, id, updated_at, data) VALUES (?, ?, ?, ?)",
+                                (type_, record['id'], updated_at, self.codec.dumps(record)))
+        self.connection.execute("DELETE FROM filters WHERE type = ? AND id = ?", (type_, record['id']))
+        self.connection.executemany("INSERT INTO filters (type, name, value, id) VALUES (?, ?, ?, ?)",
+                                    [(type_, name, value, record['id'])
+                                     for name, value in self.index_values(resource_class, record)])
+        return True
+
+    def put_many(self, resource_class, records):
+        with self.lock, self.connection:
+            return sum(1 for record in records if self._put(resource_class, record))
+
+    def apply(self, resource_class, event_type, record, version=None):
+        with self.lock, self.connection:
+            if event_type != self.DELETED:
+                return self._put(resource_class, record, version)
+            type_ = self.type(resource_class)
+            current, tombstone = self._known(type_, record['id'])
+            known = current if current is not None else tombstone
+            if known is None:
+                known = (_normalize_timestamp(record.get('updated_at')), None)
+            elif version is not None and known[1] is not None and version < known[1]:
+                self.conflicts += 1
+                return False
+            self._delete(type_, record['id'])
+            # The tombstone keeps the last updated_at (and revision) so older copies of the record are not stored again
+            self.connection.execute("INSERT OR REPLACE INTO tombstones (type, id, updated_at, version) "
+                                    "VALUES (?, ?, ?, ?)",
+                                    (type_, record['id'], known[0], version if version is not None else known[1]))
+            return True
+
+    def get_record(self, resource_class, id_):
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM resources WHERE type = ? AND id = ?",
+                                          (self.type(resource_class), id_)).fetchone()
+        return None if row is None else self.codec.loads(row[0])
+
+    def delete(self, resource_class, id_):
+        with self.lock, self.connection:
+            self._delete(self.type(resource_class), id_)
+
+    def _delete(self, type_, id_):
+        for table in ['resources', 'filters', 'versions']:
+            self.connection.execute("DELETE FROM %s WHERE type = ? AND id = ?" % table, (type_, id_))
+
+    def select(self, resource_class, conditions):
+        type_ = self.type(resource_class)
+        ids = [values for name, values in conditions if name == 'id']
+        filters = [(name, list(values)) for name, values in conditions if name != 'id']
+        with self.lock:
+            if len(filters) > 1:
+                # Joined from the filter matching the fewest records (CROSS JOIN keeps this order)
+                filters.sort(key=lambda condition: self._count(type_, *condition))
+            tables = list()
+            where = list()
+            params = list()
+            for i, (name, values) in enumerate(filters):
+                tables.append('filters f%d' % i)
+                where.append("f%d.type = ? AND f%d.name = ? AND f%d.value IN (%s)" %
+                             (i, i, i, ', '.join(['?'] * len(values))))
+                params.extend([type_, name] + values)
+                if i > 0:
+                    where.append("f%d.id = f0.id" % i)
+            # An ids filter is the most selective so the records are read first
+            tables.insert(0 if ids else len(tables), 'resources r')
+            where.append("r.type = ?")
+            params.append(type_)
+            if filters:
+                where.append("r.id = f0.id")
+            for values in ids:
+                where.append("r.id IN (%s)" % ', '.join(['?'] * len(values)))
+                params.extend(values)
+            sql = "SELECT r.data FROM %s WHERE %s ORDER BY r.id" % (' CROSS JOIN '.join(tables), ' AND '.join(where))
+            rows = self.connection.execute(sql, params).fetchall()
+        return [self.codec.loads(row[0]) for row in rows]
+
+    def _count(self, type_, name, values):
+        return self.connection.execute("SELECT count(*) FROM filters WHERE type = ? AND name = ? AND value IN (%s)" %
+                                       ', '.join(['?'] * len(values)), [type_, name] + values).fetchone()[0]
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else self.codec.loads(row[0])
+
+    def set_meta(self, key, value):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                    (key, self.codec.dumps(value)))
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Test the functionality of AsyncRest against a local stub server"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import json
+import time
+from client import AsyncRest
+from nose.tools import assert_raises, eq_, with_setup
+from threading import Lock
+from tests.test_common import StubServer, stub_session
+from v2.authentication import Token
+from v2.collection import DealSet
+from v2.resource import Deal, Person, Source
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+server = None
+
+
+def setup_module():
+    global server
+    server = StubServer()
+
+
+def teardown_module():
+    server.stop()
+
+
+def reset_server():
+    server.routes.clear()
+    del server.requests[:]
+
+
+def async_rest(concurrency=4):
+    return AsyncRest(Token('token'), stub_session(server, pool_maxsize=concurrency), concurrency)
+
+
+def deal_record(id_, name):
+    return {'data': {'id': id_, 'name': name, 'value': 10 * id_}, 'meta': {'type': 'deal'}}
+
+
+@with_setup(reset_server)
+def test_get():
+    """get() should return a result that populates the entity from the stub"""
+    server.routes[('GET', '/v2/deals/1')] = (200, deal_record(1, 'First'))
+    with async_rest() as base:
+        deal = Deal(1)
+        result = base.get(deal)
+        assert result.get() is deal
+    eq_(deal.name, 'First')
+    eq_(deal.value, 10)
+    eq_(server.requests[0]['headers']['authorization'], 'Bearer token')
+
+
+@with_setup(reset_server)
+def test_get_concurrent():
+    """Many get() calls should run concurrently, but never more than the concurrency bound"""
+    lock = Lock()
+    state = {'active': 0, 'peak': 0}
+
+    def slow_route(id_):
+        def route(request):
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            time.sleep(0.05)
+            with lock:
+                state['active'] -= 1
+            return 200, deal_record(id_, 'Deal %d' % id_)
+        return route
+
+    for i in range(1, 13):
+        server.routes[('GET', '/v2/deals/%d' % i)] = slow_route(i)
+    with async_rest(concurrency=3) as base:
+        deals = [Deal(i) for i in range(1, 13)]
+        results = base.wait([base.get(deal) for deal in deals])
+    eq_(results, deals)
+    eq_([deal.name for deal in deals], ['Deal %d' % i for i in range(1, 13)])
+    eq_(state['peak'], 3)
+
+
+@with_setup(reset_server)
+def test_save():
+    """save() should PUT the dirty data wrapped in 'data' and load the response"""
+    server.routes[('PUT', '/v2/deals/3')] = (200, deal_record(3, 'Renamed'))
+    with async_rest() as base:
+        deal = Deal(3)
+        deal.name = 'Renamed'
+        base.save(deal).get()
+    eq_(json.loads(server.requests[0]['body']), {'data': {'name': 'Renamed'}})
+    eq_(deal.name, 'Renamed')
+
+
+@with_setup(reset_server)
+def test_create():
+    """create() should POST the new entity and pick up its id from the response"""
+    server.routes[('POST', '/v2/sources')] = (200, {'data': {'id': 8, 'name': 'Web'}})
+    with async_rest() as base:
+        source = Source()
+        source.name = 'Web'
+        base.create(source).get()
+    eq_(server.requests[0]['method'], 'POST')
+    eq_(source.id, 8)
+    eq_(source.name, 'Web')
+
+
+@with_setup(reset_server)
+def test_delete():
+    """delete() should send a DELETE to the entity's URL"""
+    server.routes[('DELETE', '/v2/deals/5')] = (200, None)
+    with async_rest() as base:
+        base.delete(Deal(5)).get()
+    eq_(server.requests[0]['method'], 'DELETE')
+    eq_(server.requests[0]['path'], '/v2/deals/5')
+
+
+@with_setup(reset_server)
+def test_get_page():
+    """get_page() should send the filters and paging as parameters and return a list of Resources"""
+    server.routes[('GET', '/v2/deals')] = (200, {'items': [deal_record(1, 'A'), deal_record(2, 'B')]})
+    with async_rest() as base:
+        page = base.get_page(DealSet(hot=True), 2, per_page=2).get()
+    eq_([deal.id for deal in page], [1, 2])
+    assert all(isinstance(deal, Deal) for deal in page)
+    eq_(server.requests[0]['params'], {'hot': 'true', 'page': '2', 'per_page': '2'})
+
+
+@with_setup(reset_server)
+def test_errors_raised_on_get():
+    """Errors raised by Rest should be raised when the result is collected"""
+    with async_rest() as base:
+        assert_raises(TypeError, base.get(DealSet()).get)
+        assert_raises(ValueError, base.save(Person()).get)
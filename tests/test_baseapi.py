@@ -4,10 +4,18 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from client import Rest, UnchangedError
-from mock import Mock
-from nose.tools import assert_raises
+import json
+import time
+from client import PageError, Rest, RateLimitError, UnchangedError, WriteResult
+from mock import Mock, patch
+from nose.tools import assert_raises, eq_
 from prototype import Resource, BaseCrmAuthentication, Collection
+from tests.test_common import StubServer, stub_session
+from threading import Lock, Thread
+from transport import RetryPolicy
+from v2.authentication import Token
+from v2.collection import DealSet
+from v2.resource import Contact, Deal, Organization, Source
 
 __author__ = 'Clayton Daley III'
 __copyright__ = "Copyright 2015, Clayton Daley III"
@@ -117,3 +125,306 @@ def test_delete_without_resource_typeerror():
     assert_raises(TypeError, base.delete, resource)
 
 
+def paged_rest(sizes, requested=None):
+    """Builds a Rest whose get_page() returns pages of the given sizes (and empty pages after that)"""
+    base = Rest(mock_auth())
+
+    def get_page(entity, page, per_page=20, order_by=None):
+        if requested is not None:
+            requested.append(page)
+        if page > len(sizes):
+            return []
+        return [(page, i) for i in range(0, sizes[page - 1])]
+
+    base.get_page = Mock(side_effect=get_page)
+    return base
+
+
+def test_iter_collection_without_collection_typeerror():
+    """If entity= is not a Collection, iter_collection() should raise TypeError"""
+    base = paged_rest([])
+    assert_raises(TypeError, list, base.iter_collection(Mock(Resource)))
+
+
+def test_iter_collection_stops_on_short_page():
+    """iter_collection() should yield every item in page order and stop after the first short page"""
+    base = paged_rest([2, 2, 1, 2])
+    eq_(list(base.iter_collection(Mock(Collection), per_page=2)), [(1, 0), (1, 1), (2, 0), (2, 1), (3, 0)])
+    eq_(base.get_page.call_count, 3)
+
+
+def test_iter_collection_stops_on_empty_page():
+    """If the last page is full, iter_collection() should stop on the empty page that follows it"""
+    base = paged_rest([2, 2])
+    eq_(len(list(base.iter_collection(Mock(Collection), per_page=2, order_by='name'))), 4)
+    eq_([c[0][1:] for c in base.get_page.call_args_list], [(1, 2, 'name'), (2, 2, 'name'), (3, 2, 'name')])
+
+
+def test_iter_collection_error_page():
+    """A page that fails should raise PageError instead of ending the iteration like the last page"""
+    server = StubServer()
+    try:
+        pages = {'1': (200, {'items': [{'data': {'id': 1}}, {'data': {'id': 2}}]}), '2': (500, None)}
+        server.routes[('GET', '/v2/deals')] = lambda request: pages[request['params']['page']]
+        session = stub_session(server, retry_policy=RetryPolicy(max_attempts=1))
+        items = Rest(Token('token'), session).iter_collection(DealSet(), per_page=2)
+        eq_([next(items).id for i in range(0, 2)], [1, 2])
+        assert_raises(PageError, next, items)
+    finally:
+        server.stop()
+
+
+def test_iter_collection_prefetches():
+    """While the first page is consumed, the second page should already be requested"""
+    requested = []
+    base = paged_rest([2, 2, 2], requested)
+    items = base.iter_collection(Mock(Collection), per_page=2)
+    next(items)
+    for i in range(0, 100):
+        if 2 in requested:
+            break
+        time.sleep(0.01)
+    eq_(requested, [1, 2])
+    items.close()
+
+
+def test_iter_collection_parallel_ordered():
+    """Pages fetched in parallel should be yielded in page order, even when they complete out of order"""
+    base = paged_rest([3] * 10 + [1])
+    original = base.get_page.side_effect
+
+    def get_page(entity, page, per_page=20, order_by=None):
+        # Later pages return first
+        time.sleep(0.002 * (12 - page))
+        return original(entity, page, per_page, order_by)
+
+    base.get_page.side_effect = get_page
+    items = list(base.iter_collection(Mock(Collection), per_page=3, concurrency=4))
+    eq_(items, [(page, i) for page in range(1, 11) for i in range(0, 3)] + [(11, 0)])
+
+
+def test_iter_collection_parallel_rate_limited():
+    """A 429 should shrink the number of pages in flight and the page should be retried"""
+    base = Rest(mock_auth())
+    lock = Lock()
+    state = {'active': 0, 'retry_peak': 0}
+    attempts = dict()
+
+    def get_page(entity, page, per_page=20, order_by=None):
+        with lock:
+            state['active'] += 1
+            attempts[page] = attempts.get(page, 0) + 1
+            if attempts[page] > 1:
+                state['retry_peak'] = max(state['retry_peak'], state['active'])
+        try:
+            time.sleep(0.01)
+            if attempts[page] == 1 and page <= 4:
+                raise RateLimitError("Too many requests", retry_after=0)
+            return [page] * 2 if page < 8 else []
+        finally:
+            with lock:
+                state['active'] -= 1
+
+    base.get_page = Mock(side_effect=get_page)
+    pages = list(base.iter_collection_parallel(Mock(Collection), per_page=2, concurrency=4))
+    eq_(pages, [page for page in range(1, 8) for i in range(0, 2)])
+    # Every rate limited page was retried exactly once
+    eq_([attempts[page] for page in range(1, 5)], [2, 2, 2, 2])
+    assert state['retry_peak'] <= 2
+
+
+def test_iter_collection_parallel_retry_first_page():
+    """A rate limited first page should be retried even when the pages after it fill the window"""
+    base = Rest(mock_auth())
+    attempts = dict()
+
+    def get_page(entity, page, per_page=20, order_by=None):
+        attempts[page] = attempts.get(page, 0) + 1
+        if page == 1 and attempts[page] == 1:
+            # Lets the other pages arrive first
+            time.sleep(0.05)
+            raise RateLimitError("Too many requests", retry_after=0)
+        return [page] * 2 if page < 6 else []
+
+    base.get_page = Mock(side_effect=get_page)
+    result = []
+    thread = Thread(target=lambda: result.extend(base.iter_collection_parallel(Mock(Collection), per_page=2,
+                                                                               concurrency=4)))
+    thread.daemon = True
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    eq_(result, [page for page in range(1, 6) for i in range(0, 2)])
+    eq_(attempts[1], 2)
+
+
+def test_iter_collection_parallel_error_page():
+    """A page that fails should raise PageError after the pages before it, not end the iteration like a short page"""
+    base = paged_rest([2, 2, 2, 2, 1])
+    original = base.get_page.side_effect
+
+    def get_page(entity, page, per_page=20, order_by=None):
+        if page == 3:
+            raise PageError("Page 3 could not be loaded")
+        return original(entity, page, per_page, order_by)
+
+    base.get_page.side_effect = get_page
+    items = base.iter_collection_parallel(Mock(Collection), per_page=2, concurrency=2)
+    eq_([next(items) for i in range(0, 4)], [(1, 0), (1, 1), (2, 0), (2, 1)])
+    assert_raises(PageError, next, items)
+
+
+def test_get_many():
+    """get_many() should load Resources in chunks through the ids filter and report the missing ones"""
+    server = StubServer()
+    try:
+        def deals(request):
+            ids = [int(i) for i in request['params']['ids'].split(',')]
+            return 200, {'items': [{'data': {'id': i, 'name': 'Deal %d' % i}} for i in ids if i != 4]}
+        server.routes[('GET', '/v2/deals')] = deals
+        server.routes[('GET', '/v2/contacts')] = (200, {'items': [{'data': {'id': 7, 'is_organization': True}}]})
+        base = Rest(Token('token'), stub_session(server))
+        base.MAX_PER_PAGE = 2
+        requested = [Deal(3), Deal(1), Deal(4), Deal(2), Deal(1)]
+        contact = Contact(7)
+        missing = base.get_many(requested + [contact])
+        eq_(missing, [requested[2]])
+        eq_([deal.name for deal in requested if deal.id != 4], ['Deal 3', 'Deal 1', 'Deal 2', 'Deal 1'])
+        assert isinstance(contact, Organization)
+        eq_(sorted(r['params']['ids'] for r in server.requests), ['1,2', '3,4', '7'])
+    finally:
+        server.stop()
+
+
+def test_errors_logged():
+    """Failed requests should be logged (not printed) and a failed page should raise PageError"""
+    server = StubServer()
+    try:
+        server.routes[('GET', '/v2/deals')] = (500, {'errors': ['broken']})
+        server.routes[('DELETE', '/v2/deals/1')] = (500, {'errors': ['broken']})
+        base = Rest(Token('token'), stub_session(server, retry_policy=RetryPolicy(max_attempts=1)))
+        deal = Deal(1)
+        with patch('client.logger') as logger_, patch('sys.stdout') as stdout:
+            assert_raises(PageError, base.get_page, DealSet(), 1)
+            assert base.get_many([deal])[0] is deal
+            base.delete(deal)
+        eq_([call[0][0].split(':')[0] for call in logger_.error.call_args_list],
+            ['GET ERROR', 'GET ERROR', 'DELETE ERROR'])
+        eq_(stdout.write.call_count, 0)
+    finally:
+        server.stop()
+
+
+def test_get_conditional_etag():
+    """A reloaded entity should send its ETag and a 304 should leave the data (and local changes) untouched"""
+    server = StubServer()
+    try:
+        def deal(request):
+            if request['headers'].get('if-none-match') == '"v1"':
+                return 304, None
+            return 200, {'data': {'id': 1, 'name': 'Deal'}}, {'ETag': '"v1"'}
+        server.routes[('GET', '/v2/deals/1')] = deal
+        base = Rest(Token('token'), stub_session(server))
+        entity = base.get(Deal(1))
+        assert 'if-none-match' not in server.requests[0]['headers']
+        values = entity._values
+        entity.name = 'Local'
+        base.get(entity)
+        eq_(server.requests[1]['headers']['if-none-match'], '"v1"')
+        assert entity._values is values
+        eq_(entity.name, 'Local')
+        eq_(entity.get_data(), {'name': 'Local'})
+    finally:
+        server.stop()
+
+
+def test_get_conditional_last_modified():
+    """Last-Modified (or, without validators, updated_at) should be sent as If-Modified-Since"""
+    server = StubServer()
+    try:
+        server.routes[('GET', '/v2/deals/1')] = (200, {'data': {'id': 1, 'updated_at': '2015-06-01T12:00:00-04:00'}})
+        server.routes[('GET', '/v2/deals/2')] = (200, {'data': {'id': 2}},
+                                                 {'Last-Modified': 'Mon, 01 Jun 2015 10:00:00 GMT'})
+        base = Rest(Token('token'), stub_session(server))
+        deal_1 = base.get(Deal(1))
+        base.get(deal_1)
+        deal_2 = base.get(Deal(2))
+        base.get(deal_2)
+        eq_(server.requests[-3]['headers']['if-modified-since'], 'Mon, 01 Jun 2015 16:00:00 GMT')
+        eq_(server.requests[-1]['headers']['if-modified-since'], 'Mon, 01 Jun 2015 10:00:00 GMT')
+        # Only reloads are conditional
+        eq_(len([r for r in server.requests if 'if-modified-since' in r['headers']]), 2)
+    finally:
+        server.stop()
+
+
+def test_get_many_without_resource_typeerror():
+    """If any entity is not a Resource, get_many() should raise TypeError"""
+    base = Rest(mock_auth())
+    assert_raises(TypeError, base.get_many, [Deal(1), Mock(Collection)])
+
+
+def test_create_many():
+    """create_many() should report each entity's outcome without aborting the batch"""
+    server = StubServer()
+    try:
+        def sources(request):
+            name = json.loads(request['body'])['data']['name']
+            if name == 'invalid':
+                return 422, {'errors': [{'error': {'code': 'invalid'}}]}
+            elif name == 'broken':
+                return 500, {'errors': []}
+            return 201, {'data': {'id': len(name), 'name': name}}
+        server.routes[('POST', '/v2/sources')] = sources
+        base = Rest(Token('token'), stub_session(server))
+        entities = list()
+        for name in ['web', 'invalid', 'broken', None, 'phone']:
+            source = Source()
+            if name is not None:
+                source.name = name
+            entities.append(source)
+        results = base.create_many(entities, concurrency=3)
+        eq_([r.entity for r in results], entities)
+        eq_([r.status for r in results], [WriteResult.SUCCESS, WriteResult.VALIDATION_ERROR, WriteResult.SERVER_ERROR,
+                                          WriteResult.VALIDATION_ERROR, WriteResult.SUCCESS])
+        eq_([r.response.status_code for r in results if r.response is not None], [201, 422, 500, 201])
+        assert isinstance(results[3].error, UnchangedError)
+        eq_([entities[0].id, entities[4].id], [3, 5])
+    finally:
+        server.stop()
+
+
+def test_create_many_unreadable_response():
+    """A write the server accepted should be reported as a SUCCESS even if its response cannot be loaded"""
+    server = StubServer()
+    try:
+        server.routes[('POST', '/v2/sources')] = lambda request: (201, None)
+        base = Rest(Token('token'), stub_session(server))
+        source = Source()
+        source.name = 'web'
+        result = base.create_many([source])[0]
+        eq_(result.status, WriteResult.SUCCESS)
+        eq_(result.response.status_code, 201)
+        assert isinstance(result.error, ValueError)
+        eq_(len(server.requests), 1)
+    finally:
+        server.stop()
+
+
+def test_save_many():
+    """save_many() should PUT every entity and classify local errors as validation errors"""
+    server = StubServer()
+    try:
+        for i in range(1, 4):
+            server.routes[('PUT', '/v2/deals/%d' % i)] = (200, {'data': {'id': i, 'name': 'Saved'}})
+        base = Rest(Token('token'), stub_session(server))
+        entities = [Deal(i) for i in range(1, 5)]
+        for deal in entities[:3]:
+            deal.name = 'Saved'
+        results = base.save_many(iter(entities))
+        eq_([r.success for r in results], [True, True, True, False])
+        eq_(results[3].status, WriteResult.VALIDATION_ERROR)
+        eq_(len(server.requests), 3)
+        eq_(entities[0].name, 'Saved')
+    finally:
+        server.stop()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""Test the functionality of the read-through Resource cache"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from cache import ResourceCache
+from client import Rest
+from nose.tools import eq_
+from tests.test_common import StubServer, stub_session
+from tests.test_transport import FakeClock
+from v2.authentication import Token
+from v2.resource import Contact, Deal, Person, Stage, User
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+def fake_cache(**kwargs):
+    cache = ResourceCache(**kwargs)
+    cache.clock = FakeClock()
+    return cache
+
+
+def test_cache_ttl_expiry():
+    """Entries should be served until their TTL expires"""
+    cache = fake_cache(ttls={User: 60})
+    cache.put(User(1), {'data': {'id': 1, 'name': 'Jane'}})
+    eq_(cache.get(User(1)), {'data': {'id': 1, 'name': 'Jane'}})
+    cache.clock.now += 61
+    eq_(cache.get(User(1)), None)
+    stats = cache.stats()
+    eq_(stats['hits'], 1)
+    eq_(stats['misses'], 1)
+    eq_(stats['expirations'], 1)
+    eq_(stats['hit_rate'], 0.5)
+
+
+def test_cache_only_configured_classes():
+    """Classes without a TTL should not be cached unless there is a default_ttl"""
+    cache = fake_cache(ttls={User: 60})
+    cache.put(Deal(1), {'data': {'id': 1}})
+    eq_(cache.get(Deal(1)), None)
+    cache = fake_cache(default_ttl=60)
+    cache.put(Deal(1), {'data': {'id': 1}})
+    eq_(cache.get(Deal(1)), {'data': {'id': 1}})
+
+
+def test_cache_inherited_ttl():
+    """Subclasses should inherit the TTL of their parent"""
+    cache = fake_cache(ttls={Contact: 60})
+    eq_(cache.ttl(Person), 60)
+    eq_(cache.ttl(Stage), None)
+
+
+def test_cache_lru_eviction():
+    """The least recently used entry should be evicted first"""
+    cache = fake_cache(max_size=2, default_ttl=60)
+    cache.put(Stage(1), {'data': {'id': 1}})
+    cache.put(Stage(2), {'data': {'id': 2}})
+    cache.get(Stage(1))
+    cache.put(Stage(3), {'data': {'id': 3}})
+    eq_(cache.get(Stage(2)), None)
+    assert cache.get(Stage(1)) is not None
+    assert cache.get(Stage(3)) is not None
+    eq_(cache.stats()['evictions'], 1)
+    eq_(cache.stats()['size'], 2)
+
+
+def test_cache_returns_copies():
+    """Modifying a response must not modify the cached entry"""
+    cache = fake_cache(default_ttl=60)
+    data = {'data': {'id': 1, 'name': 'Won'}}
+    cache.put(Stage(1), data)
+    data['data']['name'] = 'Lost'
+    cache.get(Stage(1))['data']['name'] = 'Lost'
+    eq_(cache.get(Stage(1)), {'data': {'id': 1, 'name': 'Won'}})
+
+
+def test_cache_read_through():
+    """Rest.get() should only go to the network on a miss and save()/delete() should invalidate the entry"""
+    server = StubServer()
+    try:
+        server.routes[('GET', '/v2/users/1')] = (200, {'data': {'id': 1, 'name': 'Jane'}})
+        server.routes[('GET', '/v2/deals/1')] = (200, {'data': {'id': 1, 'name': 'Deal'}})
+        server.routes[('PUT', '/v2/deals/1')] = (200, {'data': {'id': 1, 'name': 'New'}})
+        cache = fake_cache(ttls={User: 60, Deal: 60})
+        base = Rest(Token('token'), stub_session(server), cache=cache)
+        for i in range(0, 3):
+            eq_(base.get(User(1)).name, 'Jane')
+        eq_(len(server.requests), 1)
+
+        base.get(Deal(1))
+        deal = base.get(Deal(1))
+        eq_(len(server.requests), 2)
+        deal.name = 'New'
+        base.save(deal)
+        base.get(Deal(1))
+        eq_(len(server.requests), 4)
+        eq_(cache.stats()['hits'], 3)
+    finally:
+        server.stop()
+
+
+def test_cache_refreshed_on_not_modified():
+    """A 304 should cache the entity's data again so an expired entry does not send every get() to the network"""
+    server = StubServer()
+    try:
+        record = {'id': 1, 'name': 'Acme', 'is_organization': True, 'updated_at': '2015-06-01T12:00:00Z',
+                  'address': {'line1': '1 Main St', 'city': 'Boston', 'postal_code': None, 'state': None,
+                              'country': 'US'}}
+
+        def contact(request):
+            if request['headers'].get('if-none-match') == '"v1"':
+                return 304, None
+            return 200, {'data': record}, {'ETag': '"v1"'}
+        server.routes[('GET', '/v2/contacts/1')] = contact
+        cache = fake_cache(ttls={Contact: 60})
+        base = Rest(Token('token'), stub_session(server), cache=cache)
+        organization = base.get(Contact(1))
+        cache.clock.now += 61
+        base.get(organization)
+        eq_(server.requests[-1]['headers']['if-none-match'], '"v1"')
+        eq_(len(server.requests), 2)
+        # Served from the refreshed entry
+        cached = base.get(Contact(1))
+        eq_(len(server.requests), 2)
+        eq_(cached.__class__, organization.__class__)
+        eq_(cached.updated_at, organization.updated_at)
+        eq_(cached.address.city, 'Boston')
+    finally:
+        server.stop()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Test the functionality of the JSON codec"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import json
+from client import Rest
+from codec import JsonCodec, default_codec, find_backend, iter_array
+from mock import Mock, patch
+from nose.tools import assert_raises, eq_
+from tests.test_common import StubServer, stub_session
+from v2.authentication import Token
+from v2.collection import DealSet
+from v2.resource import Deal
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+def test_find_backend():
+    """Missing backends should be skipped and the standard library used as a last resort"""
+    assert find_backend(['no_such_json_module', 'json']) is json
+    assert_raises(ImportError, find_backend, ['no_such_json_module'])
+    eq_(JsonCodec('json').name, 'json')
+    assert Rest(Token('token')).codec is default_codec()
+
+
+def test_codec_decode():
+    """Responses should be decoded from their bytes"""
+    server = StubServer()
+    try:
+        server.routes[('GET', '/v2/deals')] = (200, {'items': [{'data': {'id': 1, 'name': u'D\xe9al'}}]})
+        session = stub_session(server)
+        codec = JsonCodec('json')
+        expected = {'items': [{'data': {'id': 1, 'name': u'D\xe9al'}}]}
+        eq_(codec.decode(session.get('https://api.getbase.com/v2/deals')), expected)
+    finally:
+        server.stop()
+
+
+def test_rest_uses_codec():
+    """Request bodies should be encoded and responses decoded by the client's codec"""
+    server = StubServer()
+    try:
+        server.routes[('PUT', '/v2/deals/1')] = (200, {'data': {'id': 1, 'name': 'New'}})
+        codec = JsonCodec('json')
+        codec.dumps = Mock(wraps=codec.dumps)
+        codec.decode = Mock(wraps=codec.decode)
+        deal = Deal(1)
+        deal.name = 'New'
+        Rest(Token('token'), stub_session(server), codec=codec).save(deal)
+        eq_(json.loads(server.requests[0]['body']), {'data': {'name': 'New'}})
+        eq_(codec.dumps.call_count, 1)
+        eq_(codec.decode.call_count, 1)
+        eq_(deal.name, 'New')
+    finally:
+        server.stop()
+
+
+def chunked(document, size):
+    return [document[i:i + size] for i in range(0, len(document), size)]
+
+
+def eq_iter_array(document, size, expected):
+    eq_(list(iter_array(chunked(document, size))), expected)
+
+
+def test_generator_iter_array():
+    """Items should be parsed identically whatever the chunk boundaries"""
+    items = [{'data': {'id': 1234567, 'name': u'D\xe9al', 'tags': ['a', 'b']}}, 12, None, 'x', 3.5,
+             {'data': {'name': 'a "quoted" \\ name with [brackets] and {braces}', 'escaped\\': ['\\"]']}}]
+    document = json.dumps({'meta': {'type': 'collection', 'links': [1, 2]}, 'items': items, 'count': 5},
+                          sort_keys=True, indent=1)
+    for size in [1, 2, 3, 7, 64, len(document)]:
+        yield eq_iter_array, document, size, items
+    yield eq_iter_array, '{"items": []}', 1, []
+    yield eq_iter_array, ' {"items" : [ 100 ] } ', 1, [100]
+
+
+def test_iter_array_decodes_once():
+    """A record spanning many chunks should be decoded once instead of again after every chunk"""
+    record = {'data': {'id': 1, 'notes': ['note %d' % i for i in range(1000)]}}
+    chunks = chunked(json.dumps({'items': [record, record]}), 16)
+    decode = Mock(wraps=json.JSONDecoder().raw_decode)
+    with patch('codec.json.JSONDecoder') as decoder:
+        decoder.return_value.raw_decode = decode
+        eq_(list(iter_array(chunks)), [record, record])
+    # The "items" key and the two records
+    eq_(decode.call_count, 3)
+
+
+def test_iter_array_errors():
+    """A document without the key or cut short should raise like a full decode would"""
+    assert_raises(KeyError, list, iter_array(['{}']))
+    assert_raises(KeyError, list, iter_array(['{"data": [1, 2]}']))
+    assert_raises(ValueError, list, iter_array(['{"items": [{"id": 1}, {"id"']))
+    assert_raises(ValueError, list, iter_array(['["items"]']))
+
+
+def test_rest_get_page_stream():
+    """A streamed page should yield the same Resources as a buffered one"""
+    server = StubServer()
+    try:
+        items = [{'data': {'id': i, 'name': 'Deal %d' % i}} for i in range(1, 6)]
+        server.routes[('GET', '/v2/deals')] = (200, {'items': items, 'meta': {'type': 'collection'}})
+        base = Rest(Token('token'), stub_session(server))
+        page = base.get_page(DealSet(), 1, per_page=5, stream=True)
+        assert not isinstance(page, list)
+        eq_([(deal.id, deal.name) for deal in page], [(i, 'Deal %d' % i) for i in range(1, 6)])
+        eq_([deal.id for deal in base.get_page(DealSet(), 1, per_page=5)], range(1, 6))
+        eq_(len(server.requests), 2)
+    finally:
+        server.stop()
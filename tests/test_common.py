@@ -4,7 +4,14 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import json
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from SocketServer import ThreadingMixIn
+from threading import Lock, Thread
+from transport import Session
+from urlparse import parse_qs
 from v2.resource import Person, Contact, Organization, Deal, Lead, Note, Tag, Account, Address, LossReason, Task, \
     DealContact, Pipeline, Source, Stage, User
 from v2.collection import ContactSet, PersonSet, OrganizationSet, DealSet, LeadSet, LossReasonSet, NoteSet, PipelineSet, \
@@ -48,4 +55,97 @@ SAMPLES = {
 # Required for positive tests on constraints that match Resources
 SAMPLES.update({r: [mock_resource(r)] for r in RESOURCES})
 # Provides helpful negative tests
-SAMPLES.update({c: [mock_collection(c)] for c in COLLECTIONS})
\ No newline at end of file
+SAMPLES.update({c: [mock_collection(c)] for c in COLLECTIONS})
+
+"""
+STUB SERVER
+
+A local HTTP/1.1 (keep-alive) server that stands in for BaseCRM.  stub_session() returns a transport.Session that sends
+every request to the stub, whatever host the Resource or Collection URL() names.
+"""
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def respond(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        path, _, query = self.path.partition('?')
+        request = {
+            'method': self.command,
+            'path': path,
+            'params': dict((k, v[0]) for k, v in parse_qs(query).iteritems()),
+            'headers': dict(self.headers.items()),
+            'body': body,
+        }
+        with self.server.lock:
+            self.server.requests.append(request)
+        route = self.server.routes.get((self.command, path), (404, {'errors': []}))
+        if callable(route):
+            route = route(request)
+        status, payload = route[0], route[1]
+        headers = route[2] if len(route) > 2 else dict()
+        content = '' if payload is None else json.dumps(payload)
+        self.send_response(status)
+        for k, v in headers.iteritems():
+            self.send_header(k, v)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_PUT = do_POST = do_DELETE = respond
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    Routes are keyed by (method, path) and map to (status, payload[, headers]) or to a callable receiving the request
+    dict and returning the same.  Every request is recorded in self.requests.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.lock = Lock()
+        self.routes = dict()
+        self.requests = list()
+        self.connections = 0
+        self.thread = Thread(target=self.serve_forever, kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubAdapter(HTTPAdapter):
+    def __init__(self, server, **kwargs):
+        super(StubAdapter, self).__init__(**kwargs)
+        self.server = server
+
+    def send(self, request, **kwargs):
+        request.url = self.server.url + request.path_url
+        return super(StubAdapter, self).send(request, **kwargs)
+
+
+def stub_session(server, **kwargs):
+    session = Session(**kwargs)
+    session.adapter = StubAdapter(server, pool_connections=session.pool_connections, pool_maxsize=session.pool_maxsize,
+                                  pool_block=session.pool_block)
+    session.mount('https://', session.adapter)
+    session.mount('http://', session.adapter)
+    return session
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""Test the functionality of the columnar exporter"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import shutil
+import tempfile
+from client import PageError, Rest
+from export import columns, export, pyarrow, read_batches
+from mock import patch
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_raises, eq_
+from prototype import parse_datetime
+from tests.test_common import StubServer, stub_session
+from transport import RetryPolicy
+from v2.authentication import Token
+from v2.collection import ContactSet, DealSet
+from v2.resource import Contact, DealContact, Note
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+def test_export_columns():
+    """Columns should be typed from PROPERTIES with nested Resources and custom fields flattened"""
+    contact = dict((column.name, column.type) for column in columns(Contact, custom_fields=['known_via']))
+    eq_(contact['id'], 'int64')
+    eq_(contact['is_organization'], 'bool')
+    eq_(contact['created_at'], 'timestamp')
+    eq_(contact['address.city'], 'string')
+    eq_(contact['custom_fields.known_via'], 'string')
+    eq_(contact['tags'], 'list')
+    assert 'address' not in contact
+    eq_(columns(Contact)[0].name, 'id')
+    eq_([column.name for column in columns(Contact) if column.name.startswith('custom_fields')],
+        ['custom_fields'])
+    names = [column.name for column in columns(Note)]
+    assert 'resource_type' in names and 'resource_id' in names
+    names = [column.name for column in columns(DealContact)]
+    assert 'deal.id' in names and 'contact.id' in names
+
+
+def deal(i):
+    return {'data': {'id': i, 'name': 'Deal %d' % i, 'hot': i % 2 == 0, 'value': 100 * i,
+                     'custom_fields': {'known_via': 'tom', 'score': i}, 'tags': ['a'],
+                     'created_at': '2015-03-0%dT09:00:00Z' % i, 'updated_at': None}}
+
+
+def test_export_jsonl():
+    """Every Resource should be written, in batches of chunk_size rows"""
+    server = StubServer()
+    directory = tempfile.mkdtemp()
+    try:
+        pages = {'1': [deal(1), deal(2)], '2': [deal(3), deal(4)], '3': [deal(5)]}
+        server.routes[('GET', '/v2/deals')] = lambda request: (200, {'items': pages[request['params']['page']]})
+        path = os.path.join(directory, 'deals.jsonl')
+        rows = export(Rest(Token('token'), stub_session(server)), DealSet(), path, format='jsonl',
+                      custom_fields=['known_via', 'score'], chunk_size=3, per_page=2)
+        eq_(rows, 5)
+        batches = list(read_batches(path))
+        eq_([len(batch['id']) for batch in batches], [3, 2])
+        eq_(batches[0]['id'] + batches[1]['id'], [1, 2, 3, 4, 5])
+        eq_(batches[0]['hot'], [False, True, False])
+        eq_(batches[0]['custom_fields.score'], ['1', '2', '3'])
+        eq_(batches[1]['created_at'], [parse_datetime('2015-03-04T09:00:00Z'), parse_datetime('2015-03-05T09:00:00Z')])
+        eq_(batches[1]['updated_at'], [None, None])
+        eq_(batches[1]['tags'], [['a'], ['a']])
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+
+def deal_pages(server):
+    pages = {'1': [deal(1), deal(2)], '2': [deal(3), deal(4)], '3': [deal(5)]}
+    server.routes[('GET', '/v2/deals')] = lambda request: (200, {'items': pages[request['params']['page']]})
+    return Rest(Token('token'), stub_session(server))
+
+
+def test_export_parquet():
+    """With pyarrow, each batch should be written as a row group of a typed Parquet file"""
+    if pyarrow is None:
+        raise SkipTest("pyarrow is not installed")
+    server = StubServer()
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'deals.parquet')
+        rows = export(deal_pages(server), DealSet(), path, custom_fields=['score'], chunk_size=3, per_page=2)
+        eq_(rows, 5)
+        parquet = pyarrow.parquet.ParquetFile(path)
+        eq_(parquet.num_row_groups, 2)
+        schema = parquet.schema.to_arrow_schema()
+        eq_(str(schema.types[schema.names.index('created_at')]), 'timestamp[us, tz=UTC]')
+        data = parquet.read(columns=['id', 'hot', 'custom_fields.score', 'tags']).to_pydict()
+        eq_(data['id'], [1, 2, 3, 4, 5])
+        eq_(data['hot'], [False, True, False, True, False])
+        eq_(data['custom_fields.score'], ['1', '2', '3', '4', '5'])
+        eq_(data['tags'], [['a']] * 5)
+        timestamps = parquet.read(columns=['created_at', 'updated_at'])
+        # Microseconds since the epoch (UTC)
+        eq_(timestamps.column(0).cast(pyarrow.int64()).to_pylist()[0], 1425200400 * 10 ** 6)
+        eq_(timestamps.column(1).null_count, 5)
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+
+def test_export_default_format():
+    """Without pyarrow, the default format should fall back to jsonl and say so"""
+    server = StubServer()
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'deals')
+        with patch('export.pyarrow', None), patch('export.logger') as logger_:
+            eq_(export(deal_pages(server), DealSet(), path, per_page=2), 5)
+        eq_(len(list(read_batches(path))), 1)
+        eq_(logger_.warning.call_args[0][0], "pyarrow is not installed, exporting %s as jsonl instead of parquet" % path)
+        assert logger_.info.call_args[0][0].endswith('(jsonl)')
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+
+def test_export_error_page():
+    """A page that fails should raise PageError and leave no partial file behind"""
+    server = StubServer()
+    directory = tempfile.mkdtemp()
+    try:
+        pages = {'1': (200, {'items': [deal(1), deal(2)]}), '2': (500, None)}
+        server.routes[('GET', '/v2/deals')] = lambda request: pages[request['params']['page']]
+        rest = Rest(Token('token'), stub_session(server, retry_policy=RetryPolicy(max_attempts=1)))
+        path = os.path.join(directory, 'deals.jsonl')
+        assert_raises(PageError, export, rest, DealSet(), path, format='jsonl', per_page=2)
+        assert not os.path.exists(path)
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+
+def test_export_errors():
+    """Mixed Collections need a resource_class and formats are checked"""
+    assert_raises(ValueError, export, None, ContactSet(), 'contacts', format='jsonl')
+    assert_raises(ValueError, export, None, DealSet(), 'deals', format='csv')
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""Test the functionality of the columnar ResourceFrame"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from client import PageError, Rest
+from datetime import datetime
+from frame import ResourceFrame, numpy
+from mock import patch
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_raises, eq_
+from tests.test_common import StubServer, stub_session
+from transport import RetryPolicy
+from v2.authentication import Token
+from v2.collection import ContactSet, DealSet
+from v2.resource import Deal
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+DEALS = [
+    {'data': {'id': 1, 'stage_id': 1, 'owner_id': 10, 'value': 100, 'hot': True, 'name': 'A',
+              'created_at': '2015-03-01T09:00:00Z', 'tags': ['x']}},
+    {'data': {'id': 2, 'stage_id': 1, 'owner_id': 11, 'value': 250, 'hot': False, 'name': 'B',
+              'created_at': '2015-03-01T10:00:00+01:00', 'tags': []}},
+    {'data': {'id': 3, 'stage_id': 2, 'owner_id': 10, 'value': None, 'hot': None, 'name': None,
+              'created_at': None, 'tags': ['x', 'y']}},
+    {'data': {'id': 4, 'stage_id': None, 'owner_id': 10, 'value': 50, 'hot': True, 'name': 'D',
+              'created_at': '2015-03-02T09:00:00Z', 'tags': ['y']}},
+]
+
+
+# The frame is tested with and without numpy (when it is installed)
+BACKENDS = ['python', 'numpy']
+
+
+def with_backend(backend, check):
+    """Runs check with the frame storing columns in numpy arrays or in arrays and lists"""
+    if backend == 'numpy' and numpy is None:
+        raise SkipTest("numpy is not installed")
+    with patch('frame.numpy', numpy if backend == 'numpy' else None):
+        check()
+
+
+def frame_columns():
+    frame = DealSet().format_frame(DEALS)
+    eq_(len(frame), 4)
+    eq_(list(frame['id']), [1, 2, 3, 4])
+    eq_([frame.value('value', i) for i in range(0, 4)], [100, 250, None, 50])
+    eq_([frame.value('hot', i) for i in range(0, 4)], [True, False, None, True])
+    eq_([frame.value('created_at', i) for i in range(0, 4)],
+        [datetime(2015, 3, 1, 9), datetime(2015, 3, 1, 9), None, datetime(2015, 3, 2, 9)])
+    eq_(frame.value('tags', 2), ['x', 'y'])
+    eq_(frame.value('name', 2), None)
+    eq_(dict(ResourceFrame.kinds(Deal))['custom_fields'], 'object')
+
+
+def test_frame_columns():
+    """Columns should hold the raw values with missing values flagged"""
+    for backend in BACKENDS:
+        yield with_backend, backend, frame_columns
+
+
+def frame_filter():
+    frame = DealSet().format_frame(DEALS)
+    eq_(list(frame.filter(hot=True)['id']), [1, 4])
+    eq_(list(frame.filter(stage_id=[1, 2], owner_id=10)['id']), [1, 3])
+    eq_(list(frame.filter(value=0)['id']), [])
+    eq_(list(frame.filter([True, False, False, True])['id']), [1, 4])
+    eq_(frame.filter(name='B').value('value', 0), 250)
+
+
+def test_frame_filter():
+    """Conditions should match values or lists of values and never match missing values"""
+    for backend in BACKENDS:
+        yield with_backend, backend, frame_filter
+
+
+def frame_group_by():
+    frame = DealSet().format_frame(DEALS)
+    eq_(frame.group_by('stage_id', 'value'), {1: 350, 2: 0, None: 50})
+    eq_(frame.group_by('stage_id', how='count'), {1: 2, 2: 1, None: 1})
+    eq_(frame.group_by(('stage_id', 'owner_id'), 'value'), {(1, 10): 100, (1, 11): 250, (2, 10): 0, (None, 10): 50})
+    eq_(frame.group_by('owner_id', 'value', how='mean'), {10: 75.0, 11: 250.0})
+    assert_raises(ValueError, frame.group_by, 'stage_id')
+    assert_raises(ValueError, frame.group_by, 'stage_id', 'value', how='max')
+
+
+def test_frame_group_by():
+    """Aggregates should skip missing values and group missing keys under None"""
+    for backend in BACKENDS:
+        yield with_backend, backend, frame_group_by
+
+
+def frame_concat():
+    frame = ResourceFrame.concat([DealSet().format_frame(DEALS[:2]), DealSet().format_frame(DEALS[2:])])
+    eq_(list(frame['id']), [1, 2, 3, 4])
+    eq_(frame.group_by('stage_id', 'value'), {1: 350, 2: 0, None: 50})
+    eq_(ContactSet().format_frame([]).resource_class.__name__, 'Contact')
+
+
+def test_frame_concat():
+    """Frames of several pages should combine into one"""
+    for backend in BACKENDS:
+        yield with_backend, backend, frame_concat
+
+
+def test_frame_numpy_dtypes():
+    """With numpy, typed fields should be stored in typed arrays and other fields in object arrays"""
+    if numpy is None:
+        raise SkipTest("numpy is not installed")
+    frame = DealSet().format_frame(DEALS)
+    eq_(frame['id'].dtype, numpy.int64)
+    eq_(frame['hot'].dtype, numpy.bool_)
+    eq_(frame['created_at'].dtype, numpy.dtype('datetime64[us]'))
+    eq_(frame['tags'].dtype, object)
+    eq_(list(frame.nulls['value']), [False, False, True, False])
+    eq_(frame['tags'][1], [])
+
+
+def test_rest_iter_frames():
+    """iter_frames() should yield a frame per page until the first short page"""
+    server = StubServer()
+    try:
+        pages = {'1': DEALS[:2], '2': DEALS[2:], '3': []}
+        server.routes[('GET', '/v2/deals')] = lambda request: (200, {'items': pages[request['params']['page']]})
+        frames = list(Rest(Token('token'), stub_session(server)).iter_frames(DealSet(), per_page=2))
+        eq_([len(frame) for frame in frames], [2, 2, 0])
+        eq_(ResourceFrame.concat(frames).group_by('owner_id', how='count'), {10: 3, 11: 1})
+    finally:
+        server.stop()
+
+
+def test_rest_iter_frames_error_page():
+    """A page that fails should raise PageError instead of ending the frames like the last page"""
+    server = StubServer()
+    try:
+        pages = {'1': (200, {'items': DEALS[:2]}), '2': (500, None)}
+        server.routes[('GET', '/v2/deals')] = lambda request: pages[request['params']['page']]
+        session = stub_session(server, retry_policy=RetryPolicy(max_attempts=1))
+        frames = Rest(Token('token'), session).iter_frames(DealSet(), per_page=2)
+        eq_(len(next(frames)), 2)
+        assert_raises(PageError, next, frames)
+    finally:
+        server.stop()
@@ -4,9 +4,13 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import dateutil.parser
+import gc
+from copy import deepcopy
+from datetime import datetime
 from mock import Mock
 from nose.tools import assert_raises, eq_
-from prototype import Resource
+from prototype import Resource, parse_datetime, snapshot
 from tests.test_common import SAMPLES
 
 __author__ = 'Clayton Daley III'
@@ -123,12 +127,16 @@ EQ_NOT_IS = [
 ]
 
 
+class OverrideStub(Resource):
+    """Declares no __slots__, so its instances have a __dict__ to override PROPERTIES in"""
+
+
 def eq_attribute_changed_data(value, compare):
     # sample values are equal
     assert value == compare
     # sample values are not the same
     assert value is not compare
-    mock = Resource()
+    mock = OverrideStub()
     object.__setattr__(mock, 'PROPERTIES', {'key': object})
     mock.key = compare
     assert 'key' in mock._dirty
@@ -142,4 +150,158 @@ def test_generator_equal_attribute_replace():
     If an attribute is equal but not "is", we need to update it to preserve mutability.
     """
     for values in EQ_NOT_IS:
-        yield eq_attribute_changed_data, values[0], values[1]
\ No newline at end of file
+        yield eq_attribute_changed_data, values[0], values[1]
+
+
+class RulesStub(Resource):
+    PROPERTIES = {
+        '_id': int,
+        'amount': [int, float],
+        'stage': {
+            'type': basestring,
+            'in': ['won', 'lost'],
+        },
+    }
+
+
+def test_resource_compiled_validators():
+    """PROPERTIES should be compiled once per class into (types, choices, readonly, type) without the underscore"""
+    validators = RulesStub._VALIDATORS
+    eq_(sorted(validators.keys()), ['amount', 'id', 'stage'])
+    eq_(validators['id'], (int, None, True, int))
+    eq_(validators['amount'], ((int, float), None, False, [int, float]))
+    eq_(validators['stage'], (basestring, ['won', 'lost'], False, basestring))
+    assert PropertiesStub._VALIDATORS is not RulesStub._VALIDATORS
+
+
+def test_resource_setattr_rules():
+    """Lists of types and lists of acceptable values should be enforced"""
+    stub = RulesStub()
+    stub.amount = 1.5
+    stub.amount = 2
+    stub.stage = 'won'
+    eq_(stub._dirty, {'amount': 2, 'stage': 'won'})
+    assert_raises(TypeError, setattr, stub, 'amount', '2')
+    assert_raises(TypeError, setattr, stub, 'stage', 1)
+    assert_raises(ValueError, setattr, stub, 'stage', 'open')
+    assert_raises(KeyError, setattr, stub, 'id', 1)
+
+
+def test_resource_compact_storage():
+    """Values should be kept in the per-class layout with a dirty bitmask and no instance __dict__"""
+    stub = RulesStub(1)
+    stub.set_data({'data': {'id': 1, 'amount': 5, 'extra': 'value'}})
+    eq_(RulesStub._FIELDS, ('amount', 'id', 'stage'))
+    eq_(stub._mask, 0)
+    stub.stage = 'won'
+    eq_(stub._mask, 1 << RulesStub._LAYOUT['stage'])
+    eq_(stub._extra, {'extra': 'value'})
+    eq_(stub._data, {'id': 1, 'amount': 5, 'stage': 'won', 'extra': 'value'})
+    eq_(stub._dirty, {'stage': 'won'})
+    eq_(stub.extra, 'value')
+    # The instance __dict__ is never allocated
+    assert not [referent for referent in gc.get_referents(stub) if referent is not stub._extra and
+                isinstance(referent, dict)]
+
+
+def test_resource_views():
+    """_data and _dirty should behave like the dicts they replace"""
+    stub = RulesStub()
+    stub._dirty['amount'] = 2
+    stub._dirty['unknown'] = 'value'
+    eq_(stub.get_data(), {'amount': 2, 'unknown': 'value'})
+    assert 'amount' in stub._data
+    del stub._dirty['unknown']
+    eq_(dict(stub._dirty), {'amount': 2})
+    assert_raises(KeyError, stub._dirty.__getitem__, 'stage')
+    eq_(len(stub._data), 2)
+
+
+def test_resource_set_data_discards_changes():
+    """set_data() should replace every value and clear the dirty bitmask"""
+    stub = RulesStub()
+    stub.amount = 2
+    stub.set_data({'data': {'id': 3}})
+    eq_(stub._mask, 0)
+    eq_(stub.amount, None)
+    eq_(stub.get_data(), {})
+
+
+def test_resource_deepcopy():
+    """Copies should not share storage"""
+    stub = RulesStub(1)
+    stub.amount = 2
+    copy_ = deepcopy(stub)
+    copy_.amount = 3
+    eq_(stub.amount, 2)
+    eq_(copy_.id, 1)
+    assert copy_._values is not stub._values
+
+
+class PayloadStub(Resource):
+    PROPERTIES = {
+        'tags': list,
+        'custom_fields': dict,
+    }
+
+
+def test_resource_get_data_snapshot():
+    """Changing the payload of get_data() must not change the Resource"""
+    stub = PayloadStub()
+    tags = ['important']
+    stub.tags = tags
+    stub.custom_fields = {'known_via': {'name': 'tom'}}
+    data = stub.get_data()
+    data['tags'].append('new')
+    data['custom_fields']['known_via']['name'] = 'jerry'
+    data['custom_fields']['source'] = 'web'
+    eq_(stub.tags, ['important'])
+    assert stub.tags is tags
+    eq_(stub.custom_fields, {'known_via': {'name': 'tom'}})
+    eq_(stub.get_data(), {'tags': ['important'], 'custom_fields': {'known_via': {'name': 'tom'}}})
+
+
+def test_snapshot():
+    """snapshot() should copy nested dicts and lists and share every other value"""
+    when = datetime(2015, 3, 1)
+    value = {'items': [{'name': 'a', 'tags': ['x']}], 'when': when, 'count': 1}
+    copy = snapshot(value)
+    eq_(copy, value)
+    assert copy is not value and copy['items'] is not value['items']
+    assert copy['items'][0]['tags'] is not value['items'][0]['tags']
+    assert copy['when'] is when
+    eq_(snapshot('text'), 'text')
+
+
+def eq_dateutil(value):
+    parsed = parse_datetime(value)
+    expected = dateutil.parser.parse(value)
+    eq_(parsed, expected)
+    eq_(parsed.utcoffset(), expected.utcoffset())
+
+
+def test_generator_parse_datetime():
+    """The ISO-8601 fast path and the fallback should return the same datetimes as dateutil"""
+    for value in ['2014-08-27T16:32:56Z', '2014-08-27T16:32:56.5Z', '2014-08-27T16:32:56.1234567Z',
+                  '2014-08-27T16:32:56+02:00', '2014-08-27T16:32:56-0530', '2014-08-27T16:32:56',
+                  '2014-08-27', 'Aug 27 2014 4:32PM']:
+        yield eq_dateutil, value
+
+
+def test_parse_datetime_invalid():
+    """Text that is not a timestamp should raise like dateutil"""
+    assert_raises(ValueError, parse_datetime, 'not a timestamp')
+
+
+class TimestampStub(Resource):
+    PROPERTIES = {
+        '_id': int,
+        '_created_at': datetime,
+    }
+
+
+def test_resource_set_data_timestamps():
+    """datetime properties should be converted when data is set"""
+    stub = TimestampStub(1)
+    stub.set_data({'data': {'id': 1, 'created_at': '2014-08-27T16:32:56Z'}})
+    eq_(stub.created_at, dateutil.parser.parse('2014-08-27T16:32:56Z'))
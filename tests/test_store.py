@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""Test the functionality of the local mirror stores"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import shutil
+import tempfile
+from client import PageError, Rest
+from nose.tools import assert_raises, eq_
+from store import InMemory, SQLite, UnsupportedQuery
+from tests.test_common import StubServer, stub_session
+from transport import RetryPolicy
+from v2.authentication import Token
+from v2.collection import AddressFilter, ContactSet, DealSet, NoteSet, OrganizationSet, PersonSet, TaskSet
+from v2.resource import Contact, Deal, Note, Person
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+def contact(id_, name, is_organization, city, updated_at='2015-03-01T09:00:00Z'):
+    return {'id': id_, 'name': name, 'is_organization': is_organization, 'owner_id': 10, 'tags': ['x'],
+            'address': {'line1': None, 'city': city, 'postal_code': None, 'state': None, 'country': 'US'},
+            'created_at': '2015-01-01T09:00:00Z', 'updated_at': updated_at}
+
+
+CONTACTS = [contact(1, 'Acme', True, 'Boston'), contact(2, 'Mark Johnson', False, 'Hyannis'),
+            contact(3, 'Jane Acme', False, 'boston')]
+
+
+def check_store_query(store):
+    store.put_many(Contact, CONTACTS)
+    eq_([c.id for c in store.query(ContactSet())], [1, 2, 3])
+    eq_([c.id for c in store.query(ContactSet(ids=[3, 1, 9]))], [1, 3])
+    eq_([c.id for c in store.query(PersonSet())], [2, 3])
+    eq_([c.__class__.__name__ for c in store.query(ContactSet())], ['Organization', 'Person', 'Person'])
+    eq_([c.id for c in store.query(OrganizationSet(name='Acme'))], [1])
+    eq_([c.id for c in store.query(ContactSet(address=AddressFilter(city='BOSTON')))], [1, 3])
+    eq_([c.id for c in store.query(ContactSet(name='Acme', is_organization=True))], [1])
+    eq_(store.query(ContactSet(contact_id=11)), [])
+    eq_(store.query(DealSet()), [])
+    assert_raises(UnsupportedQuery, store.query, TaskSet(remind=True))
+
+
+def check_store_updates(store):
+    store.put_many(Contact, CONTACTS)
+    # An older copy never replaces a newer one
+    eq_(store.put(Contact, contact(2, 'Old', False, 'Hyannis', '2015-02-01T09:00:00Z')), False)
+    eq_(store.put(Contact, contact(2, 'New', False, 'Boston', '2015-03-01T10:00:00+00:00')), True)
+    eq_(store.get(Person(2)).name, 'New')
+    eq_([c.id for c in store.query(ContactSet(address=AddressFilter(city='boston')))], [1, 2, 3])
+    eq_([c.id for c in store.query(ContactSet(address=AddressFilter(city='hyannis')))], [])
+    store.delete(Contact, 1)
+    eq_(store.get(Contact(1)), None)
+    eq_([c.id for c in store.query(ContactSet())], [2, 3])
+    # Records are copied in and out of the store
+    record = store.get_record(Contact, 2)
+    record['name'] = 'Changed'
+    eq_(store.get_record(Contact, 2)['name'], 'New')
+
+
+def check_store_meta(store):
+    eq_(store.device_id, None)
+    store.device_id = 'device'
+    eq_(store.device_id, 'device')
+    store.set_meta('cursor', {'deals': 5})
+    eq_(store.get_meta('cursor'), {'deals': 5})
+    eq_(store.get_meta('missing', 1), 1)
+
+
+def check_store_notes(store):
+    store.put_items(Note, [{'data': {'id': 1, 'resource': 'deal', 'resource_id': 7, 'content': 'Hi'}},
+                           {'data': {'id': 2, 'resource': 'lead', 'resource_id': 7, 'content': 'Yo'}}])
+    notes = store.query(NoteSet(resource_type='deal', resource_id=7))
+    eq_([n.id for n in notes], [1])
+    eq_(notes[0].resource.__class__, Deal)
+    eq_([n.id for n in store.query(NoteSet(q='yo'))], [2])
+
+
+def check_store_find(store):
+    store.put_many(Contact, CONTACTS + [dict(contact(4, 'Jim', False, None), owner_id=11, email='jim@example.com')])
+    store.put_many(Deal, [{'id': 1, 'owner_id': 10, 'stage_id': 5}, {'id': 2, 'owner_id': 11, 'stage_id': 6}])
+    # ContactSet has no owner_id filter but owner_id is indexed
+    eq_([c.id for c in store.find(Contact, owner_id=10)], [1, 2, 3])
+    eq_([(c.__class__, c.email) for c in store.find(Contact, email='jim@example.com')], [(Person, 'jim@example.com')])
+    eq_([d.id for d in store.find(Deal, owner_id=[10, 11], stage_id=6)], [2])
+    eq_([d.id for d in store.find(Deal, id=[1, 2], owner_id=10)], [1])
+    eq_(store.find(Deal, stage_id=7), [])
+    assert_raises(UnsupportedQuery, store.find, Deal, name='Big')
+
+
+def check_store_apply(store):
+    eq_(store.apply(Deal, 'created', {'id': 1, 'name': 'New', 'updated_at': '2015-03-01T09:00:00Z'}), True)
+    eq_(store.apply(Deal, 'updated', {'id': 1, 'name': 'Old', 'updated_at': '2015-02-01T09:00:00Z'}), False)
+    eq_(store.get(Deal(1)).name, 'New')
+    eq_(store.apply(Deal, 'deleted', {'id': 1}), True)
+    eq_(store.get(Deal(1)), None)
+
+
+def check_store_replication(store):
+    eq_(store.apply(Deal, 'created', {'id': 1, 'name': 'v1', 'owner_id': 10}, 1), True)
+    eq_(store.apply(Deal, 'updated', {'id': 1, 'name': 'v3', 'owner_id': 11}, 3), True)
+    # Revisions win over updated_at
+    eq_(store.apply(Deal, 'updated', {'id': 1, 'name': 'v2', 'updated_at': '2016-01-01T00:00:00Z'}, 2), False)
+    eq_(store.get(Deal(1)).name, 'v3')
+    eq_([d.id for d in store.find(Deal, owner_id=11)], [1])
+    eq_(store.apply(Deal, 'deleted', {'id': 1}, 2), False)
+    eq_(store.apply(Deal, 'deleted', {'id': 1}, 4), True)
+    eq_(store.find(Deal, owner_id=11), [])
+    eq_(store.apply(Deal, 'updated', {'id': 1, 'name': 'v3'}, 3), False)
+    eq_(store.get(Deal(1)), None)
+    eq_(store.apply(Deal, 'created', {'id': 1, 'name': 'v5'}, 5), True)
+    eq_(store.get(Deal(1)).name, 'v5')
+    eq_(store.conflicts, 3)
+
+    # Without revisions, a deleted record is only stored again by a newer copy (e.g. from a page read before the delete)
+    store.put(Deal, {'id': 2, 'name': 'Old', 'updated_at': '2015-03-01T09:00:00Z'})
+    store.apply(Deal, 'deleted', {'id': 2})
+    store.apply(Deal, 'deleted', {'id': 2})
+    eq_(store.put(Deal, {'id': 2, 'name': 'Old', 'updated_at': '2015-03-01T09:00:00Z'}), False)
+    eq_(store.get(Deal(2)), None)
+    eq_(store.put(Deal, {'id': 2, 'name': 'New', 'updated_at': '2015-03-02T09:00:00Z'}), True)
+    eq_(store.get(Deal(2)).name, 'New')
+
+
+def test_generator_stores():
+    """Both stores should answer Collection queries from their indexes"""
+    for check in [check_store_query, check_store_updates, check_store_meta, check_store_notes, check_store_find,
+                  check_store_apply]:
+        yield check, InMemory()
+        yield check, SQLite(':memory:')
+
+
+def test_store_replication():
+    """Changes applied out of order should never replace a newer revision or resurrect a deleted record"""
+    for store in [InMemory(), SQLite(':memory:')]:
+        yield check_store_replication, store
+
+
+def test_sqlite_persistent():
+    """Records, meta values, revisions and tombstones should survive reopening the database"""
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'mirror.db')
+        store = SQLite(path)
+        store.put_many(Contact, CONTACTS)
+        store.device_id = 'device'
+        store.apply(Deal, 'updated', {'id': 1, 'name': 'v2'}, 2)
+        store.apply(Deal, 'deleted', {'id': 2, 'updated_at': '2015-03-01T09:00:00Z'})
+        store.close()
+        store = SQLite(path)
+        eq_([c.id for c in store.query(PersonSet(address=AddressFilter(city='Boston')))], [3])
+        eq_(store.device_id, 'device')
+        eq_(store.apply(Deal, 'updated', {'id': 1, 'name': 'v1'}, 1), False)
+        eq_(store.put(Deal, {'id': 2, 'name': 'Old', 'updated_at': '2015-03-01T09:00:00Z'}), False)
+        eq_(store.conflicts, 2)
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_store_load():
+    """load() should mirror every page of a Collection"""
+    server = StubServer()
+    try:
+        pages = {'1': [{'data': record} for record in CONTACTS[:2]], '2': [{'data': CONTACTS[2]}]}
+        server.routes[('GET', '/v2/contacts')] = lambda request: (200, {'items': pages[request['params']['page']]})
+        store = InMemory()
+        eq_(store.load(Rest(Token('token'), stub_session(server)), ContactSet(), per_page=2), 3)
+        eq_(len(server.requests), 2)
+        eq_([c.name for c in store.query(ContactSet(is_organization=False))], ['Mark Johnson', 'Jane Acme'])
+    finally:
+        server.stop()
+
+
+def test_store_load_error_page():
+    """A page that fails should raise PageError instead of leaving the mirror looking complete"""
+    server = StubServer()
+    try:
+        pages = {'1': (200, {'items': [{'data': record} for record in CONTACTS[:2]]}), '2': (500, None)}
+        server.routes[('GET', '/v2/contacts')] = lambda request: pages[request['params']['page']]
+        store = InMemory()
+        session = stub_session(server, retry_policy=RetryPolicy(max_attempts=1))
+        assert_raises(PageError, store.load, Rest(Token('token'), session), ContactSet(), per_page=2)
+        eq_(len(store.query(ContactSet())), 2)
+    finally:
+        server.stop()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""Test the functionality of the Sync API consumer"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import json
+from client import Sync, SyncError
+from nose.tools import assert_raises, eq_
+from store import InMemory
+from tests.test_common import StubServer, stub_session
+from tests.test_transport import FakeClock
+from v2.authentication import Token
+from v2.collection import DealSet
+from v2.resource import Deal, Organization
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+def change(type_, data, event_type='updated', ack_key=None):
+    return {'data': data, 'meta': {'type': type_, 'sync': {'event_type': event_type,
+                                                          'ack_key': ack_key or '%s-%s' % (type_, data['id'])}}}
+
+
+def sync_server(pages):
+    """A stub server with a Sync session serving `pages` (lists of changes) and then 204"""
+    server = StubServer()
+    server.routes[('POST', '/v2/sync/start')] = (201, {'data': {'id': 'session', 'queues': [{'data': {'name': 'main'}}]}})
+    server.routes[('GET', '/v2/sync/session/queues/main')] = \
+        lambda request: (200, {'items': pages.pop(0)}) if pages else (204, None)
+    server.acks = list()
+
+    def ack(request):
+        server.acks.append(json.loads(request['body'])['data']['ack_keys'])
+        return 202, None
+    server.routes[('POST', '/v2/sync/ack')] = ack
+    return server
+
+
+def test_sync_run():
+    """Changes should be yielded as Resources, applied to the store and acknowledged in batches"""
+    server = sync_server([
+        [change('deal', {'id': 1, 'name': 'New', 'updated_at': '2015-03-01T09:00:00Z'}, 'created'),
+         change('contact', {'id': 2, 'name': 'Acme', 'is_organization': True}),
+         change('unknown_type', {'id': 3})],
+        [change('deal', {'id': 1}, 'deleted', 'deal-1-deleted'), change('deal', {'id': 4, 'name': 'Other'})],
+    ])
+    try:
+        store = InMemory()
+        sync = Sync(Token('token'), store, stub_session(server), ack_batch_size=2)
+        changes = list(sync.run())
+        eq_([(event, resource.__class__, resource.id) for event, resource in changes],
+            [('created', Deal, 1), ('updated', Organization, 2), ('deleted', Deal, 1), ('updated', Deal, 4)])
+        eq_(changes[0][1].name, 'New')
+        # Batches are full at 2 keys and the end of each page sends what is left
+        eq_(server.acks, [['deal-1', 'contact-2'], ['unknown_type-3'], ['deal-1-deleted', 'deal-4']])
+        eq_([deal.id for deal in store.query(DealSet())], [4])
+        eq_(store.get_record(Organization, 2)['name'], 'Acme')
+        # Every request identifies the device
+        device_ids = set(request['headers']['x-basecrm-device-uuid'] for request in server.requests)
+        eq_(device_ids, {store.device_id})
+        eq_(store.get_meta(Sync.PENDING_ACKS_KEY), [])
+    finally:
+        server.stop()
+
+
+def test_sync_resume():
+    """A new consumer should reuse the device UUID and first send the acknowledgements left behind"""
+    server = sync_server([[change('deal', {'id': i}) for i in range(1, 4)]])
+    try:
+        store = InMemory()
+        sync = Sync(Token('token'), store, stub_session(server), ack_batch_size=10)
+        changes = sync.run()
+        next(changes)
+        next(changes)
+        # Abandoned after consuming the first change
+        changes.close()
+        eq_(server.acks, [])
+        eq_(store.get_meta(Sync.PENDING_ACKS_KEY), ['deal-1'])
+        device_id = store.device_id
+
+        server.routes[('POST', '/v2/sync/start')] = (204, None)
+        eq_(list(Sync(Token('token'), store, stub_session(server)).run()), [])
+        eq_(server.acks, [['deal-1']])
+        eq_(server.requests[-1]['headers']['x-basecrm-device-uuid'], device_id)
+    finally:
+        server.stop()
+
+
+def test_sync_ack_interval():
+    """Acknowledgements waiting longer than ack_interval should be sent without waiting for a full batch"""
+    server = sync_server([[change('deal', {'id': i}) for i in range(1, 4)]])
+    try:
+        sync = Sync(Token('token'), session=stub_session(server), ack_batch_size=10, ack_interval=5)
+        sync.clock = FakeClock()
+        changes = sync.run()
+        next(changes)
+        next(changes)
+        sync.clock.now += 5
+        next(changes)
+        sync.wait()
+        eq_(server.acks, [['deal-1', 'deal-2']])
+        eq_(list(changes), [])
+        eq_(server.acks, [['deal-1', 'deal-2'], ['deal-3']])
+    finally:
+        server.stop()
+
+
+def test_sync_ack_failure():
+    """Rejected acknowledgements should stay pending and be sent by the next run (of the same consumer)"""
+    server = sync_server([[change('deal', {'id': 1}), change('deal', {'id': 2})]])
+    try:
+        server.routes[('POST', '/v2/sync/ack')] = (500, {'errors': []})
+        store = InMemory()
+        sync = Sync(Token('token'), store, stub_session(server))
+        eq_(len(list(sync.run())), 2)
+        eq_(store.get_meta(Sync.PENDING_ACKS_KEY), ['deal-1', 'deal-2'])
+        stats = sync.stats()
+        eq_((stats['acks'], stats['ack_requests'], stats['ack_failures'], stats['pending']), (0, 1, 1, 2))
+
+        server.routes[('POST', '/v2/sync/start')] = (204, None)
+        server.acks = list()
+        server.routes[('POST', '/v2/sync/ack')] = lambda request: server.acks.append(
+            json.loads(request['body'])['data']['ack_keys']) or (202, None)
+        eq_(list(sync.run()), [])
+        eq_(server.acks, [['deal-1', 'deal-2']])
+        eq_(store.get_meta(Sync.PENDING_ACKS_KEY), [])
+        eq_(sync.stats()['pending'], 0)
+    finally:
+        server.stop()
+
+
+def test_sync_stats():
+    """stats() should count the changes, pages and confirmed acknowledgements"""
+    server = sync_server([[change('deal', {'id': i}) for i in range(1, 4)], [change('deal', {'id': 4})]])
+    try:
+        sync = Sync(Token('token'), session=stub_session(server), ack_batch_size=2)
+        clock = sync.clock = FakeClock()
+        changes = sync.run()
+        for event in changes:
+            clock.now += 1
+        stats = sync.stats()
+        eq_((stats['changes'], stats['pages'], stats['acks'], stats['ack_requests'], stats['pending']),
+            (4, 2, 4, 3, 0))
+        eq_(stats['elapsed'], 4)
+        eq_(stats['changes_per_second'], 1.0)
+        eq_(stats['acks_per_second'], 1.0)
+    finally:
+        server.stop()
+
+
+def test_sync_out_of_order():
+    """A change older than the stored copy should be acknowledged but neither applied nor yielded"""
+    server = sync_server([
+        [change('deal', {'id': 1, 'name': 'Newer', 'updated_at': '2015-03-01T10:00:00Z'}, ack_key='deal-1-newer'),
+         change('deal', {'id': 1, 'name': 'Older', 'updated_at': '2015-03-01T09:00:00Z'}, ack_key='deal-1-older')],
+    ])
+    try:
+        store = InMemory()
+        sync = Sync(Token('token'), store, stub_session(server))
+        changes = list(sync.run())
+        eq_([(event, resource.name) for event, resource in changes], [('updated', 'Newer')])
+        eq_(store.get_record(Deal, 1)['name'], 'Newer')
+        eq_(server.acks, [['deal-1-newer', 'deal-1-older']])
+        stats = sync.stats()
+        eq_((stats['changes'], stats['stale'], stats['pending']), (2, 1, 0))
+    finally:
+        server.stop()
+
+
+def test_sync_errors():
+    """Rejected requests should raise SyncError"""
+    server = StubServer()
+    try:
+        server.routes[('POST', '/v2/sync/start')] = (401, {'errors': []})
+        sync = Sync(Token('token'), session=stub_session(server))
+        assert_raises(SyncError, list, sync.run())
+    finally:
+        server.stop()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""Test the functionality of the pooled transport"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from client import Rest
+from mock import patch
+from nose.tools import assert_raises, eq_
+from requests import Response
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
+from tests.test_common import StubServer, stub_session
+from transport import RateLimiter, RetryPolicy, Session, TokenBucket
+from v2.authentication import Token
+from v2.resource import Deal, Source
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+def test_session_pool_config():
+    """Session should mount a single pooled adapter for http and https using the configured sizes"""
+    session = Session(pool_connections=3, pool_maxsize=7, pool_block=True)
+    assert session.get_adapter('https://api.getbase.com') is session.adapter
+    assert session.get_adapter('http://api.getbase.com') is session.adapter
+    eq_(session.adapter._pool_connections, 3)
+    eq_(session.adapter._pool_maxsize, 7)
+    eq_(session.adapter._pool_block, True)
+
+
+def test_rest_shares_auth_session():
+    """By default, Rest should reuse the Session of its auth object"""
+    auth = Token('token')
+    base = Rest(auth)
+    assert base.session is auth.session
+
+
+def test_rest_session_shared_with_auth():
+    """If Rest is given a Session, the auth object should be switched to the same Session"""
+    auth = Token('token')
+    session = Session()
+    base = Rest(auth, session)
+    assert base.session is session
+    assert auth.session is session
+
+
+def test_keep_alive_reuses_connection():
+    """Every verb should reuse the pooled connection instead of opening a new one"""
+    server = StubServer()
+    try:
+        server.routes[('DELETE', '/v2/deals/1')] = (200, None)
+        base = Rest(Token('token'), stub_session(server))
+        for i in range(0, 3):
+            base.delete(Deal(1))
+        eq_(len(server.requests), 3)
+        eq_(server.connections, 1)
+        stats = base.pool_stats()
+        eq_(len(stats), 1)
+        host_stats = stats.values()[0]
+        eq_(host_stats['requests'], 3)
+        eq_(host_stats['connections'], 1)
+    finally:
+        server.stop()
+
+
+def test_keep_alive_disabled():
+    """If keep_alive is False, every request should use a fresh connection"""
+    server = StubServer()
+    try:
+        server.routes[('DELETE', '/v2/deals/1')] = (200, None)
+        base = Rest(Token('token'), stub_session(server, keep_alive=False))
+        for i in range(0, 3):
+            base.delete(Deal(1))
+        eq_(server.connections, 3)
+    finally:
+        server.stop()
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_burst_then_rate():
+    """A bucket should allow a burst, then space requests by 1/rate"""
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock)
+    eq_([bucket.reserve() for i in range(0, 4)], [0, 0, 0.5, 1.0])
+    # Time refills the bucket
+    clock.now += 10
+    eq_(bucket.reserve(), 0)
+
+
+def test_token_bucket_unlimited_block():
+    """An unlimited bucket should only wait when blocked"""
+    clock = FakeClock()
+    bucket = TokenBucket(clock=clock)
+    eq_(bucket.reserve(), 0)
+    bucket.block(3)
+    eq_(bucket.reserve(), 3)
+
+
+def test_token_bucket_adapt():
+    """The remaining budget should be spread until the reset, capped by the configured rate"""
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, clock=clock)
+    bucket.adapt(30, 60)
+    eq_(bucket.rate, 0.5)
+    bucket.adapt(6000, 60)
+    eq_(bucket.rate, 10)
+    bucket.adapt(0, 5)
+    eq_(bucket.blocked_until, clock.now + 5)
+
+
+def test_rate_limiter_hosts():
+    """Host specific limits should override the default"""
+    limiter = RateLimiter(rate=5, hosts={'api.getbase.com': (1, 3), 'app.futuresimple.com': 2})
+    eq_(limiter.bucket('api.getbase.com').rate, 1)
+    eq_(limiter.bucket('api.getbase.com').burst, 3)
+    eq_(limiter.bucket('app.futuresimple.com').rate, 2)
+    eq_(limiter.bucket('sync.futuresimple.com').rate, 5)
+
+
+def test_rate_limiter_headers():
+    """The session should honor Retry-After and the rate limit headers on every verb"""
+    server = StubServer()
+    try:
+        responses = [(429, None, {'Retry-After': '7'}), (200, None)]
+        server.routes[('DELETE', '/v2/deals/1')] = lambda request: responses.pop(0)
+        server.routes[('DELETE', '/v2/deals/2')] = (200, None, {'X-RateLimit-Remaining': '20',
+                                                                'X-RateLimit-Reset': '10'})
+        limiter = RateLimiter()
+        clock = FakeClock()
+        limiter.clock = clock
+        waits = list()
+
+        def sleep(seconds):
+            waits.append(seconds)
+            clock.now += seconds
+        limiter.sleep = sleep
+        base = Rest(Token('token'), stub_session(server, rate_limiter=limiter))
+        base.delete(Deal(1))
+        base.delete(Deal(2))
+        # The 429 was retried after Retry-After
+        eq_(len(server.requests), 3)
+        eq_(waits, [7])
+        eq_(limiter.bucket('api.getbase.com').rate, 2)
+        stats = limiter.stats()
+        eq_(stats['waits'], 1)
+        eq_(stats['hosts']['api.getbase.com']['rate'], 2)
+    finally:
+        server.stop()
+
+
+def retry_session(server, **kwargs):
+    """A stub session whose RetryPolicy records its delays instead of sleeping"""
+    policy = RetryPolicy(**kwargs)
+    policy.random = lambda: 1.0
+    policy.delays = list()
+    policy.sleep = policy.delays.append
+    return stub_session(server, retry_policy=policy)
+
+
+def test_retry_idempotent_backoff():
+    """GET should be retried on 5xx with exponential backoff until it succeeds"""
+    server = StubServer()
+    try:
+        responses = [(503, None), (502, None), (200, {'data': {'id': 1, 'name': 'Deal'}})]
+        server.routes[('GET', '/v2/deals/1')] = lambda request: responses.pop(0)
+        session = retry_session(server, base_delay=0.5)
+        deal = Rest(Token('token'), session).get(Deal(1))
+        eq_(deal.name, 'Deal')
+        eq_(session.retry_policy.delays, [0.5, 1.0])
+        eq_(session.retry_policy.stats()['GET'], {'attempts': 3, 'retries': 2, 'failures': 0, 'amplification': 3.0})
+    finally:
+        server.stop()
+
+
+def test_retry_closes_response():
+    """A response that is retried should be closed so a streamed body does not hold its connection"""
+    server = StubServer()
+    try:
+        responses = [(503, None), (503, None), (200, {'items': []})]
+        server.routes[('GET', '/v2/deals')] = lambda request: responses.pop(0)
+        session = retry_session(server, base_delay=0.5)
+        with patch.object(Response, 'close', autospec=True) as close:
+            response = session.get('https://api.getbase.com/v2/deals', stream=True)
+            eq_(response.status_code, 200)
+            eq_([call[0][0].status_code for call in close.call_args_list], [503, 503])
+        response.close()
+    finally:
+        server.stop()
+
+
+def test_retry_gives_up():
+    """Retries should stop after max_attempts"""
+    server = StubServer()
+    try:
+        server.routes[('PUT', '/v2/deals/1')] = (500, None)
+        session = retry_session(server, max_attempts=3, base_delay=1, max_delay=1.5)
+        deal = Deal(1)
+        deal.name = 'Deal'
+        Rest(Token('token'), session).save(deal)
+        eq_(len(server.requests), 3)
+        eq_(session.retry_policy.delays, [1, 1.5])
+        eq_(session.retry_policy.stats()['PUT']['failures'], 1)
+    finally:
+        server.stop()
+
+
+def test_retry_post_only_when_safe():
+    """POST should not be retried on a 5xx (it may have been processed) but should be retried on a 429"""
+    server = StubServer()
+    try:
+        server.routes[('POST', '/v2/sources')] = (500, None)
+        session = retry_session(server)
+        source = Source()
+        source.name = 'Web'
+        Rest(Token('token'), session).create(source)
+        eq_(len(server.requests), 1)
+
+        responses = [(429, None, {'Retry-After': '0'}), (201, {'data': {'id': 1, 'name': 'Web'}})]
+        server.routes[('POST', '/v2/sources')] = lambda request: responses.pop(0)
+        Rest(Token('token'), session).create(source)
+        eq_(source.id, 1)
+        eq_(session.retry_policy.stats()['POST']['retries'], 1)
+    finally:
+        server.stop()
+
+
+def test_retry_post_connection_refused():
+    """A POST whose connection was refused never reached the server and may be retried"""
+    server = StubServer()
+    server.stop()
+    session = retry_session(server, max_attempts=2)
+    assert_raises(ConnectionError, session.post, 'https://api.getbase.com/v2/sources')
+    eq_(session.retry_policy.stats()['POST']['attempts'], 2)
+
+
+def test_retry_is_safe():
+    """Read timeouts are only retried for idempotent methods"""
+    policy = RetryPolicy()
+    eq_(policy.is_safe('GET', error=ReadTimeout()), True)
+    eq_(policy.is_safe('POST', error=ReadTimeout()), False)
+    eq_(policy.is_safe('POST', error=ConnectTimeout()), True)
+
+
+def test_retry_refresh():
+    """Token refresh should go through the retry policy"""
+    server = StubServer()
+    try:
+        responses = [(429, None, {'Retry-After': '0'}), (200, {'access_token': 'new', 'refresh_token': 'next'})]
+        server.routes[('POST', '/oauth2/token')] = lambda request: responses.pop(0)
+        auth = Token('old', retry_session(server))
+        auth._refresh_token = 'refresh'
+        auth.refresh()
+        eq_(auth.headers(), {'Authorization': 'Bearer new'})
+        eq_(len(server.requests), 2)
+    finally:
+        server.stop()
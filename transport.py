@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""Implements the pooled HTTP transport shared by BaseCRM API clients"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from requests.packages.urllib3.exceptions import NewConnectionError
+from threading import Lock
+from urlparse import urlparse
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+class TokenBucket(object):
+    """
+    A token bucket refilled at `rate` tokens per second and holding at most `burst` tokens.  A rate of None means the
+    bucket never runs dry (but can still be blocked, e.g. after a Retry-After).
+    """
+    def __init__(self, rate=None, burst=None, clock=time.time):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate or 1)
+        self.tokens = float(self.burst)
+        self.clock = clock
+        self.updated = clock()
+        self.blocked_until = 0
+        self.lock = Lock()
+
+    def reserve(self):
+        """Takes a token and returns the number of seconds the caller must wait before using it"""
+        with self.lock:
+            now = self.clock()
+            wait = max(0, self.blocked_until - now)
+            if self.rate is None:
+                return wait
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Tokens may go negative so waiting callers queue up fairly instead of polling
+            self.tokens -= 1
+            if self.tokens < 0:
+                wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+    def block(self, seconds):
+        """Stops handing out usable tokens for `seconds`"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+
+    def adapt(self, remaining, reset):
+        """
+        Spreads the `remaining` requests the server will accept evenly over the `reset` seconds before its window
+        resets, never exceeding the configured rate.
+        """
+        with self.lock:
+            if remaining <= 0:
+                self.blocked_until = max(self.blocked_until, self.clock() + reset)
+                return
+            rate = remaining / float(max(reset, 1))
+            if self.max_rate is not None:
+                rate = min(rate, self.max_rate)
+            self.rate = rate
+            self.tokens = min(self.tokens, remaining)
+
+
+class RateLimiter(object):
+    """
+    Limits the requests sent to each host with a token bucket.  Limits may be configured for every host (rate, burst)
+    or for specific hosts (hosts={'api.getbase.com': (rate, burst)}).  Rates are requests per second.
+
+    The limiter also adapts to the server:  after a 429 it waits for Retry-After (or `default_retry_after`) seconds and,
+    when responses carry X-RateLimit-Remaining and X-RateLimit-Reset, it paces requests so the remaining budget lasts
+    until the window resets.
+    """
+    REMAINING_HEADER = 'X-RateLimit-Remaining'
+    RESET_HEADER = 'X-RateLimit-Reset'
+    # X-RateLimit-Reset values larger than this are timestamps rather than a number of seconds
+    RESET_EPOCH_THRESHOLD = 10 ** 9
+
+    def __init__(self, rate=None, burst=None, hosts=None, default_retry_after=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.hosts = hosts or dict()
+        self.default_retry_after = default_retry_after
+        self.buckets = dict()
+        self.clock = time.time
+        self.sleep = time.sleep
+        self.waits = 0
+        self.waited = 0.0
+        self.lock = Lock()
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                config = self.hosts.get(host, (self.rate, self.burst))
+                if not isinstance(config, tuple):
+                    config = (config, None)
+                self.buckets[host] = TokenBucket(config[0], config[1], self.clock)
+            return self.buckets[host]
+
+    def acquire(self, host):
+        """Blocks until a request may be sent to `host`"""
+        wait = self.bucket(host).reserve()
+        if wait > 0:
+            with self.lock:
+                self.waits += 1
+                self.waited += wait
+            logger.debug("Rate limiting %s for %.3fs" % (host, wait))
+            self.sleep(wait)
+
+    def update(self, host, response):
+        """Adapts the limits for `host` to the rate limit headers of a response"""
+        bucket = self.bucket(host)
+        if response.status_code == requests.codes.too_many_requests:
+            bucket.block(_seconds(response.headers.get('Retry-After'), self.default_retry_after))
+            return
+        remaining = _seconds(response.headers.get(self.REMAINING_HEADER))
+        reset = _seconds(response.headers.get(self.RESET_HEADER))
+        if remaining is None or reset is None:
+            return
+        if reset > self.RESET_EPOCH_THRESHOLD:
+            reset -= self.clock()
+        bucket.adapt(remaining, max(reset, 0))
+
+    def stats(self):
+        """Returns the current rate for each host and how often (and how long) callers were made to wait"""
+        with self.lock:
+            return {
+                'hosts': dict((host, {'rate': bucket.rate}) for host, bucket in self.buckets.iteritems()),
+                'waits': self.waits,
+                'waited': self.waited,
+            }
+
+
+class RetryPolicy(object):
+    """
+    Decides whether a failed request is sent again and how long to wait first (exponential backoff with full jitter:
+    a random delay between 0 and min(max_delay, base_delay * 2 ** retries)).
+
+    Only failures that are likely to be transient are retried:  timeouts, connection errors, 429 and the statuses in
+    `statuses`.  Idempotent methods (GET, PUT, DELETE...) are retried for all of them.  Other methods (e.g. POST) are
+    only retried when the server certainly did not act on the request:  a failed connection or a 429.
+
+    Counters are kept per method so retry amplification (attempts / requests) can be watched under load.
+    """
+    IDEMPOTENT_METHODS = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']
+    STATUSES = [500, 502, 503, 504]
+
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=30.0, methods=None, statuses=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.methods = self.IDEMPOTENT_METHODS if methods is None else methods
+        self.statuses = self.STATUSES if statuses is None else statuses
+        self.random = random.random
+        self.sleep = time.sleep
+        self.counters = dict()
+        self.lock = Lock()
+
+    def is_safe(self, method, response=None, error=None):
+        """Returns True if the failure is transient and resending `method` cannot repeat an action"""
+        if error is not None:
+            if isinstance(error, ConnectTimeout) or \
+                    isinstance(getattr(error.args[0] if error.args else None, 'reason', None), NewConnectionError):
+                # The connection was never established so the request never reached the server
+                return True
+            return method.upper() in self.methods
+        if response.status_code == requests.codes.too_many_requests:
+            return True
+        return response.status_code in self.statuses and method.upper() in self.methods
+
+    def retry(self, method, attempt, response=None, error=None):
+        """
+        Called after each attempt.  Returns True (after waiting) if the request should be sent again, False if the
+        response (or error) should be returned to the caller.
+        """
+        failed = error is not None or response.status_code == requests.codes.too_many_requests or \
+            response.status_code in self.statuses
+        self.count(method, 'attempts')
+        if not failed:
+            return False
+        if attempt >= self.max_attempts or not self.is_safe(method, response, error):
+            self.count(method, 'failures')
+            return False
+        self.count(method, 'retries')
+        if response is not None and response.status_code == requests.codes.too_many_requests:
+            # The RateLimiter already waits out Retry-After
+            return True
+        delay = self.random() * min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if response is not None:
+            delay = max(delay, _seconds(response.headers.get('Retry-After'), 0))
+        logger.info("Retrying %s after %s (attempt %d) in %.3fs" %
+                    (method, error or response.status_code, attempt, delay))
+        self.sleep(delay)
+        return True
+
+    def count(self, method, counter):
+        with self.lock:
+            counters = self.counters.setdefault(method.upper(), {'attempts': 0, 'retries': 0, 'failures': 0})
+            counters[counter] += 1
+
+    def stats(self):
+        """
+        Returns counters for each method:
+
+            {'GET': {
+                'attempts': ...  # requests sent, including retries
+                'retries': ...  # attempts that were retries
+                'failures': ...  # requests that still failed when retries ended (or were not allowed)
+                'amplification': ...  # attempts per request
+                }
+            }
+        """
+        with self.lock:
+            stats = dict()
+            for method, counters in self.counters.iteritems():
+                stats[method] = dict(counters)
+                requests_ = counters['attempts'] - counters['retries']
+                stats[method]['amplification'] = counters['attempts'] / float(requests_) if requests_ else 0.0
+            return stats
+
+
+def _seconds(value, default=None):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class Session(requests.Session):
+    """
+    A requests.Session that keeps a pool of open (keep-alive) connections for every host it talks to.  A single Session
+    is meant to be shared by a Rest client and its authentication object so every verb (and token refresh) reuses the
+    same TCP/TLS connections instead of paying a fresh handshake per call.
+
+    The connection pools are provided by urllib3 and are thread-safe, so one Session may be used by many threads.
+
+    Keyword arguments:
+    pool_connections -- number of hosts (pools) to keep open at once
+    pool_maxsize -- maximum number of connections kept open to each host
+    max_retries -- number of times urllib3 retries a failed connection (not a failed response)
+    pool_block -- if True, a thread waits for a free connection instead of opening a throw-away one
+    keep_alive -- if False, ask the server to close each connection after the response
+    rate_limiter -- a RateLimiter applied to every request; the default has no fixed rate but honors the server's rate
+                    limit headers
+    retry_policy -- a RetryPolicy deciding which failed requests are sent again (see RetryPolicy for the defaults)
+    timeout -- default timeout (in seconds) for each attempt, so a stalled connection fails and can be retried
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=0, pool_block=False, keep_alive=True,
+                 rate_limiter=None, retry_policy=None, timeout=60):
+        super(Session, self).__init__()
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
+        self.rate_limiter = rate_limiter
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        self.timeout = timeout
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.pool_block = pool_block
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                   max_retries=max_retries, pool_block=pool_block)
+        self.mount('https://', self.adapter)
+        self.mount('http://', self.adapter)
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+
+    def request(self, method, url, *args, **kwargs):
+        host = urlparse(url).netloc
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            attempt += 1
+            self.rate_limiter.acquire(host)
+            try:
+                response = super(Session, self).request(method, url, *args, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                if self.retry_policy.retry(method, attempt, error=e):
+                    continue
+                raise
+            self.rate_limiter.update(host, response)
+            if not self.retry_policy.retry(method, attempt, response=response):
+                return response
+            # Hand the connection back to the pool (a streamed body would hold it until garbage collection)
+            response.close()
+
+    def stats(self):
+        """
+        Returns a dict describing the pool for each host, keyed by host (including the port when it was explicit):
+
+            {'api.getbase.com': {
+                'requests': ...  # requests sent through the pool
+                'connections': ...  # connections opened (i.e. handshakes paid) by the pool
+                'pool_maxsize': ...  # connections the pool will keep open
+                }
+            }
+
+        A healthy pool shows many more requests than connections.  If connections keeps growing with requests, the pool
+        is too small for the number of threads using it.
+        """
+        stats = dict()
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                # Evicted between keys() and get()
+                continue
+            if pool.port in [None, 80, 443]:
+                host = pool.host
+            else:
+                host = '%s:%d' % (pool.host, pool.port)
+            stats[host] = {
+                'requests': pool.num_requests,
+                'connections': pool.num_connections,
+                'pool_maxsize': self.pool_maxsize,
+            }
+        return stats
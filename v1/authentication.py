@@ -4,7 +4,6 @@
 import logging
 logger = logging.getLogger(__name__)
 
-import requests
 from prototype import BaseCrmAuthentication, AuthenticationError
 
 __author__ = 'Clayton Daley III'
@@ -16,7 +15,7 @@ __status__ = "Development"
 
 
 class Authentication(BaseCrmAuthentication):
-    def headers(self):
+    def headers(self, api_version=None):
         return {
             'X-Pipejump-Auth': self._access_token,
             'X-Futuresimple-Token': self._access_token
@@ -27,15 +26,16 @@ class Authentication(BaseCrmAuthentication):
 
 
 class Password(Authentication):
-    def __init__(self, username, password):
+    def __init__(self, username, password, session=None):
         """
         Authenticate with an email and password
 
         Keyword arguments;
         email -- user's BaseCRM email
         password -- user's BaseCRM password
+        session -- (optional) a transport.Session to share with the client
         """
-        super(Password, self).__init__()
+        super(Password, self).__init__(session)
 
         data = {
             'username': username,
@@ -46,7 +46,7 @@ class Password(Authentication):
         logger.debug("Preparing POST with:")
         logger.debug("url:  %s" % url)
         logger.debug("format_data_get:  %s" % data)
-        response = requests.post(url=url, data=data)
+        response = self.session.post(url=url, data=data)
         logger.debug("APIv1 password response:\n%s" % response.text)
         if 'token' not in response.json()['authentication']:
             raise AuthenticationError("The username or password was not correct.")
@@ -54,6 +54,6 @@ class Password(Authentication):
 
 
 class Token(Authentication):
-    def __init__(self, token):
-        super(Token, self).__init__()
+    def __init__(self, token, session=None):
+        super(Token, self).__init__(session)
         self._access_token = token
\ No newline at end of file
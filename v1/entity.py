@@ -4,7 +4,6 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from copy import deepcopy
 from prototype import ResourceV1, CollectionV1, _key_coded_dict
 
 __author__ = 'Clayton Daley III'
@@ -53,6 +52,7 @@ included in the metadata of the previous page.
 
 
 class Contact(ResourceV1):
+    __slots__ = ()
     RESOURCE = 'crm'
     API_VERSION = 1
     _PATH = 'contacts'
@@ -106,17 +106,15 @@ class Contact(ResourceV1):
         '_version': int,
     }
 
-    def set_data(self, data):
-        super(Contact, self).set_data(data)
+    def set_data(self, data, lazy=None):
+        return super(Contact, self).set_data(data, lazy)
 
-    def format_data_set(self, data):
-        # Return a page containing API data processed into Resources and Collections
-        if 'organisation' in data:
+    def format_field(self, key, value, data):
+        if key == 'organisation' and value is not None:
             organisation = Contact()
-            organisation.set_data(data['organisation'])
-            data['organisation'] = organisation
-        # Object is mutable, but return for simple chaining and setting
-        return data
+            organisation.set_data(value)
+            return organisation
+        return super(Contact, self).format_field(key, value, data)
 
 
 class ContactSet(CollectionV1):
@@ -155,7 +153,7 @@ class ContactSet(CollectionV1):
     ]
 
     def format_data_set(self):
-        data = deepcopy(self.filters)
+        data = self.get_data()
         if 'city' in data:
             data['city'] = str(data['city']).lower()
         if 'region' in data:
@@ -168,6 +166,7 @@ class ContactSet(CollectionV1):
 
 
 class Lead(ResourceV1):
+    __slots__ = ()
     API_VERSION = 1
     PATH = "lead"
     PROPERTIES = [
@@ -229,7 +228,7 @@ class LeadSet(CollectionV1):
     ]
 
     def format_data_set(self):
-        data = deepcopy(self.filters)
+        data = self.get_data()
         if 'city' in data:
             data['city'] = str(data['city']).lower()
         if 'region' in data:
@@ -239,6 +238,7 @@ class LeadSet(CollectionV1):
 
 
 class Deal(ResourceV1):
+    __slots__ = ()
     API_VERSION = 1
     PATH = "deal"
     PROPERTIES = [
@@ -289,7 +289,7 @@ class DealSet(CollectionV1):
     ]
 
     def format_data_set(self):
-        data = deepcopy(self.filters)
+        data = self.get_data()
         if 'city' in data:
             data['city'] = str(data['city']).lower()
         if 'region' in data:
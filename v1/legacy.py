@@ -4,6 +4,10 @@
 import logging
 logger = logging.getLogger(__name__)
 
+from codec import default_codec
+from multiprocessing.pool import ThreadPool
+from Queue import Full, Queue
+from threading import Event
 from prototype import _key_coded_dict
 
 __author__ = 'Nathan Pinger, Clayton C. Daley III'
@@ -15,6 +19,73 @@ __status__ = "Development"
 
 
 class LegacyService(object):
+    format = 'json'
+    debug = False
+    FEED_TYPES = ['Email', 'Note', 'Call', 'Task']
+
+    def __init__(self, auth, session=None, codec=None):
+        """
+        Keyword arguments:
+        auth -- an APIv1 authentication object (see v1.authentication)
+        session -- (optional) a transport.Session; by default, the Session of the auth object so the connection pool and
+                   rate limiter are shared with any other client using it
+        codec -- (optional) a codec.JsonCodec used to decode JSON responses; by default, the fastest backend installed
+        """
+        self.auth = auth
+        self.codec = codec or default_codec()
+        if session is not None:
+            auth.session = session
+        self.session = auth.session
+
+    ##########################
+    # Transport
+    ##########################
+    def _apply_format(self, url, format=None):
+        """
+        Appends the response format (default self.format) to a URL.  Accepted values are 'json', 'xml' or None (to
+        leave the URL unchanged).
+        """
+        if format is None:
+            format = self.format
+        if format is None or url.endswith('.%s' % format):
+            return url
+        if format not in ['json', 'xml']:
+            raise ValueError("format must be None, 'json' or 'xml'")
+        return '%s.%s' % (url, format)
+
+    def _get_data(self, url, params=None):
+        return self._send_data('GET', url, params)
+
+    def _post_data(self, url, params=None):
+        return self._send_data('POST', url, params)
+
+    def _put_data(self, url, params=None):
+        return self._send_data('PUT', url, params)
+
+    def _delete_data(self, url, params=None):
+        return self._send_data('DELETE', url, params)
+
+    def _send_data(self, method, url, params=None):
+        """
+        Sends a request through the shared Session and returns the decoded response (or None if the API reported an
+        error).  Parameters are sent in the query string for GET and in the form body otherwise.
+        """
+        headers = self.auth.headers(1)
+        logger.debug("Preparing %s with:" % method)
+        logger.debug("url:  %s" % url)
+        logger.debug("params:  %s" % params)
+        if method == 'GET':
+            response = self.session.request(method, url, params=params, headers=headers)
+        else:
+            response = self.session.request(method, url, data=params, headers=headers)
+
+        if 300 > response.status_code >= 200:
+            if url.endswith('.json'):
+                return self.codec.decode(response)
+            return response.text
+        else:
+            logger.error("%s ERROR:  %s" % (method, response.text))
+
     ##########################
     # Resource Builders
     #
@@ -22,7 +93,7 @@ class LegacyService(object):
     # response, URL builder functions (returning just a url string) are being replaced with "resource" functions
     # returning a tuple of URL string (excluding parameters) and parameter dict.
     ##########################
-    def _build_resource_url(self, resource, version, path=''):
+    def _build_resource_url(self, resource, version, path='', format=None):
         """
         Builds a URL for a resource using the not-officially-documented format:
             https://app.futuresimple.com/apis/<resource>/api/v<version>/<path>.<format>
@@ -34,7 +105,7 @@ class LegacyService(object):
                 url = 'https://api.getbase.com/v%d%s' % (version, path)
         else:
             url = 'https://app.futuresimple.com/apis/%s/api/v%d%s' % (resource, version, path)
-        return self._apply_format(url, self.format)
+        return self._apply_format(url, format)
 
     def _build_search_url(self, type):
         if type == 'contact':
@@ -94,7 +165,7 @@ class LegacyService(object):
             path += "/deal/%d" % deal_id
 
         if type is not None:
-            if type in ['Email', 'Note', 'Call', 'Task']:
+            if type in self.FEED_TYPES:
                 url_params['only'] = type
             else:
                 raise ValueError(
@@ -242,6 +313,187 @@ class LegacyService(object):
     def get_lead_feed_tasks_completed(self, lead_id, timestamp=None):
         return self._get_feed(lead_id=lead_id, type='Task', timestamp=timestamp)
 
+    @staticmethod
+    def _feed_key(feed_item):
+        """Identifies a feed item by its type and the id of its object (e.g. 'note-12')"""
+        return '%s-%s' % (feed_item.get('type'), (feed_item.get('attributes') or {}).get('id'))
+
+    def iter_feed(self, contact_id=None, lead_id=None, deal_id=None, type=None, store=None, key=None):
+        """
+        Yields every activity (the 'feed_item' of each item, newest first) that meets the filter conditions, requesting
+        the next page with the `timestamp` metadata of the previous one until the feed is exhausted.
+
+        ARGUMENTS
+
+        Parent Objects (optional, include only one) and Activity Types:
+            see _get_feed()
+        High-water mark (optional):
+            store (default None) - a store.Store keeping the newest activity seen by the last run, so the feed is only
+                read until it reaches activities that were already returned
+            key (default None) - the meta key of the high-water mark in store; by default, one per combination of
+                filters (e.g. 'legacy_feed/contact/12/Email')
+
+        The high-water mark is only saved once the feed has been read to the end (or to the previous mark), so an
+        abandoned or failed run returns the same activities again on the next run instead of skipping them.
+        """
+        if store is not None and key is None:
+            key = self._feed_mark_key(contact_id, lead_id, deal_id, type)
+        mark = store.get_meta(key) if store is not None else None
+        state = dict()
+        for feed_item in self._read_feed(contact_id, lead_id, deal_id, type, mark, state):
+            yield feed_item
+        if store is not None and state['complete']:
+            self._save_feed_mark(store, key, mark, state['newest'])
+
+    @staticmethod
+    def _feed_mark_key(contact_id=None, lead_id=None, deal_id=None, type=None):
+        """Returns the default meta key of the high-water mark of a feed (e.g. 'legacy_feed/contact/12/Email')"""
+        key = 'legacy_feed'
+        for name, value in [('contact', contact_id), ('lead', lead_id), ('deal', deal_id)]:
+            if value is not None:
+                key += '/%s/%d' % (name, value)
+                break
+        if type is not None:
+            key += '/%s' % type
+        return key
+
+    def _read_feed(self, contact_id, lead_id, deal_id, type, mark, state):
+        """
+        Yields the activities of a feed newer than mark (or all of them if mark is None).  state (a dict) receives the
+        newest activity read (see _save_feed_mark()) and whether the feed was read to the end without an error.
+        """
+        state['newest'] = newest = None
+        state['complete'] = False
+        timestamp = None
+        while True:
+            response = self._get_feed(contact_id=contact_id, lead_id=lead_id, deal_id=deal_id, type=type,
+                                      timestamp=timestamp)
+            if response is None:
+                logger.error("Stopped reading the feed after an error (timestamp %s)" % timestamp)
+                return
+            items = response.get('items') or []
+            for item in items:
+                feed_item = item['feed_item']
+                sorted_by = feed_item.get('sorted_by')
+                if newest is None:
+                    state['newest'] = newest = {'sorted_by': sorted_by, 'keys': list()}
+                if sorted_by == newest['sorted_by']:
+                    newest['keys'].append(self._feed_key(feed_item))
+                if mark is not None:
+                    if sorted_by < mark['sorted_by']:
+                        items = None
+                        break
+                    if sorted_by == mark['sorted_by'] and self._feed_key(feed_item) in mark['keys']:
+                        continue
+                yield feed_item
+            next_timestamp = (response.get('metadata') or {}).get('timestamp')
+            if not items or next_timestamp is None or next_timestamp == timestamp:
+                break
+            timestamp = next_timestamp
+        state['complete'] = True
+
+    @staticmethod
+    def _save_feed_mark(store, key, mark, newest):
+        """
+        Saves the newest activity read from a feed as its high-water mark.  The mark never moves backwards:  if the
+        newest activity is older than the mark (e.g. the activity the mark was taken from was deleted), the mark stays.
+        """
+        if newest is None or mark is not None and newest['sorted_by'] < mark['sorted_by']:
+            return
+        if mark is not None and newest['sorted_by'] == mark['sorted_by']:
+            newest = {'sorted_by': newest['sorted_by'], 'keys': sorted(set(newest['keys']) | set(mark['keys']))}
+        store.set_meta(key, newest)
+
+    def iter_feeds(self, contact_ids=None, deal_ids=None, lead_ids=None, types=None, concurrency=10, store=None,
+                   buffer_size=100):
+        """
+        Reads the feeds of many contacts, deals and leads concurrently and yields (parent, parent_id, feed_item) for
+        every activity, where parent is 'contact', 'deal' or 'lead'.  Each feed (one per parent and type) is read with
+        iter_feed() on a pool of `concurrency` threads sharing the Session (and its connection pool and rate limiter).
+        Activities are yielded as they arrive, so feeds are interleaved while the activities of a feed stay newest
+        first.  At most `buffer_size` activities wait for the caller:  once the buffer is full, the threads stop reading
+        until the caller takes more.  With a store, the high-water mark of a feed is only saved once all of its
+        activities have been taken by the caller.
+
+        ARGUMENTS
+
+        Parent Objects (include at least one):
+            contact_ids, deal_ids, lead_ids (default None) - the ids of the parents whose feeds are read
+        Activity Types:
+            types=None (default) - read one feed of all types per parent
+            types=['Email', 'Note'...] - read one feed per parent and type (see FEED_TYPES)
+        High-water marks:
+            store (default None) - see iter_feed(); each feed keeps its own mark
+        Memory:
+            buffer_size (default 100) - the number of activities read ahead of the caller
+        """
+        for type in types or []:
+            if type not in self.FEED_TYPES:
+                raise ValueError("'%s' is not a valid type, must be one of %s" % (type, ', '.join(self.FEED_TYPES)))
+        pool_maxsize = getattr(self.session, 'pool_maxsize', concurrency)
+        if pool_maxsize < concurrency:
+            logger.warning("Session pool_maxsize (%d) is smaller than concurrency (%d), extra connections will not be "
+                           "reused" % (pool_maxsize, concurrency))
+        feeds = [(parent, parent_id, type)
+                 for parent, parent_ids in [('contact', contact_ids), ('deal', deal_ids), ('lead', lead_ids)]
+                 for parent_id in parent_ids or []
+                 for type in types or [None]]
+
+        # Each thread sends (feed, ITEM, feed_item) for the activities of a feed, then (feed, DONE, (key, mark, state))
+        # or (feed, ERROR, exception) once it ends
+        ITEM, DONE, ERROR = range(3)
+        buffer = Queue(maxsize=buffer_size)
+        stopped = Event()
+
+        def put(message):
+            """Waits for room in the buffer, returns False if the generator was closed in the meantime"""
+            while not stopped.is_set():
+                try:
+                    buffer.put(message, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def read(feed):
+            parent, parent_id, type = feed
+            filters = {'%s_id' % parent: parent_id}
+            key = self._feed_mark_key(type=type, **filters)
+            state = dict()
+            try:
+                mark = store.get_meta(key) if store is not None else None
+                for feed_item in self._read_feed(filters.get('contact_id'), filters.get('lead_id'),
+                                                 filters.get('deal_id'), type, mark, state):
+                    if not put((feed, ITEM, feed_item)):
+                        return
+            except Exception as e:
+                put((feed, ERROR, e))
+                return
+            put((feed, DONE, (key, mark, state)))
+
+        pool = ThreadPool(concurrency)
+        try:
+            for feed in feeds:
+                pool.apply_async(read, (feed,))
+            remaining = len(feeds)
+            while remaining:
+                (parent, parent_id, type), kind, value = buffer.get()
+                if kind == ITEM:
+                    yield parent, parent_id, value
+                elif kind == ERROR:
+                    raise value
+                else:
+                    # Every activity of the feed was taken by the caller
+                    key, mark, state = value
+                    if store is not None and state['complete']:
+                        self._save_feed_mark(store, key, mark, state['newest'])
+                    remaining -= 1
+        finally:
+            # Stops the remaining feeds if the generator is abandoned (or a feed fails)
+            stopped.set()
+            pool.terminate()
+            pool.join()
+
     ##########################
     # Tags Functions
     ##########################
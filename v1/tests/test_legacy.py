@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""Test the transport of the legacy (APIv1) service"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+from mock import patch
+from nose.tools import assert_raises, eq_
+from store import InMemory
+from tests.test_common import StubServer, stub_session
+from threading import Lock
+from v1.authentication import Token
+from v1.legacy import LegacyService
+
+__author__ = 'Clayton Daley III'
+__copyright__ = "Copyright 2015, Clayton Daley III"
+__license__ = "Apache License 2.0"
+__version__ = "2.0.0"
+__maintainer__ = "Clayton Daley III"
+__status__ = "Development"
+
+
+def test_legacy_shares_auth_session():
+    """By default, LegacyService should use the Session (and rate limiter) of its auth object"""
+    auth = Token('token')
+    service = LegacyService(auth)
+    assert service.session is auth.session
+
+
+def test_legacy_get_feed():
+    """get_feed() should be sent through the shared Session with v1 headers"""
+    server = StubServer()
+    try:
+        server.routes[('GET', '/apis/feeder/api/v1/feed.json')] = (200, {'items': [], 'success': True})
+        service = LegacyService(Token('token'), stub_session(server))
+        eq_(service.get_feed(type='Note'), {'items': [], 'success': True})
+        request = server.requests[0]
+        eq_(request['params'], {'api_mailman': 'v2', 'only': 'Note'})
+        eq_(request['headers']['x-pipejump-auth'], 'token')
+        eq_(service.session.rate_limiter.stats()['hosts'].keys(), ['app.futuresimple.com'])
+    finally:
+        server.stop()
+
+
+def test_legacy_error_logged():
+    """A failed request should be logged (not printed) and return None"""
+    server = StubServer()
+    try:
+        server.routes[('GET', '/apis/feeder/api/v1/feed.json')] = (400, {'success': False})
+        service = LegacyService(Token('token'), stub_session(server))
+        with patch('v1.legacy.logger') as logger_, patch('sys.stdout') as stdout:
+            eq_(service.get_feed(type='Note'), None)
+        eq_(logger_.error.call_args[0][0], 'GET ERROR:  {"success": false}')
+        eq_(stdout.write.call_count, 0)
+    finally:
+        server.stop()
+
+
+def feed_item(type_, id_, sorted_by):
+    return {'feed_item': {'type': type_, 'attributes': {'id': id_}, 'sorted_by': sorted_by}, 'success': True}
+
+
+def feed_server(pages):
+    """A stub server serving the global feed from pages ({timestamp: (items, next timestamp)})"""
+    server = StubServer()
+
+    def feed(request):
+        items, timestamp = pages[request['params'].get('timestamp')]
+        return 200, {'items': items, 'success': True, 'metadata': {'timestamp': timestamp}}
+    server.routes[('GET', '/apis/feeder/api/v1/feed.json')] = feed
+    return server
+
+
+def test_legacy_iter_feed():
+    """iter_feed() should follow the timestamp of each page and stop once the feed is exhausted"""
+    server = feed_server({
+        None: ([feed_item('note', 3, 30), feed_item('deal', 2, 20)], 'page2'),
+        'page2': ([feed_item('lead', 1, 10)], 'page3'),
+        'page3': ([], 'page4'),
+    })
+    try:
+        service = LegacyService(Token('token'), stub_session(server))
+        eq_([item['attributes']['id'] for item in service.iter_feed(type='Note')], [3, 2, 1])
+        eq_([request['params'].get('timestamp') for request in server.requests], [None, 'page2', 'page3'])
+        eq_(server.requests[1]['params']['only'], 'Note')
+    finally:
+        server.stop()
+
+
+def test_legacy_iter_feed_high_water_mark():
+    """With a store, iter_feed() should only return the activities added since the last complete run"""
+    pages = {
+        None: ([feed_item('note', 3, 30), feed_item('deal', 2, 20)], 'page2'),
+        'page2': ([feed_item('lead', 1, 10)], 'page3'),
+        'page3': ([], 'page4'),
+    }
+    server = feed_server(pages)
+    try:
+        store = InMemory()
+        service = LegacyService(Token('token'), stub_session(server))
+        # An abandoned run does not move the mark
+        next(service.iter_feed(store=store))
+        eq_(store.get_meta('legacy_feed'), None)
+        eq_(len(list(service.iter_feed(store=store))), 3)
+        eq_(store.get_meta('legacy_feed'), {'sorted_by': 30, 'keys': ['note-3']})
+
+        pages[None] = ([feed_item('email', 5, 40), feed_item('note', 4, 30), feed_item('note', 3, 30),
+                        feed_item('deal', 2, 20)], 'page2')
+        del server.requests[:]
+        eq_([item['attributes']['id'] for item in service.iter_feed(store=store)], [5, 4])
+        # The older pages are not requested
+        eq_(len(server.requests), 1)
+        eq_(list(service.iter_feed(store=store)), [])
+        eq_(store.get_meta('legacy_feed'), {'sorted_by': 40, 'keys': ['email-5']})
+        # Each combination of filters has its own mark
+        eq_(len(list(service.iter_feed(type='Note', store=store))), 5)
+        eq_(store.get_meta('legacy_feed/Note')['sorted_by'], 40)
+
+        # The newest activities were deleted, the mark does not move back
+        pages[None] = ([feed_item('note', 4, 30), feed_item('note', 3, 30), feed_item('deal', 2, 20)], 'page2')
+        eq_(list(service.iter_feed(store=store)), [])
+        eq_(store.get_meta('legacy_feed'), {'sorted_by': 40, 'keys': ['email-5']})
+        eq_(list(service.iter_feed(store=store)), [])
+    finally:
+        server.stop()
+
+
+def test_legacy_iter_feeds():
+    """iter_feeds() should read many feeds concurrently (within the bound) and tag activities by parent"""
+    server = StubServer()
+    lock = Lock()
+    state = {'active': 0, 'peak': 0}
+
+    def slow_feed(parent, id_):
+        def route(request):
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            time.sleep(0.05)
+            with lock:
+                state['active'] -= 1
+            only = request['params'].get('only', 'all')
+            items = [feed_item('%s-%s' % (parent, only), i, 10 - i) for i in range(1, 3)]
+            return 200, {'items': items, 'success': True, 'metadata': {'timestamp': None}}
+        return route
+
+    try:
+        for i in range(1, 5):
+            server.routes[('GET', '/apis/feeder/api/v1/feed/contact/%d.json' % i)] = slow_feed('contact', i)
+        server.routes[('GET', '/apis/feeder/api/v1/feed/deal/7.json')] = slow_feed('deal', 7)
+        service = LegacyService(Token('token'), stub_session(server, pool_maxsize=3))
+        activities = list(service.iter_feeds(contact_ids=range(1, 5), deal_ids=[7], types=['Email', 'Note'],
+                                             concurrency=3))
+        eq_(len(server.requests), 10)
+        eq_(state['peak'], 3)
+        eq_(sorted(set((parent, parent_id, item['type']) for parent, parent_id, item in activities)),
+            sorted([('contact', i, 'contact-%s' % type_) for i in range(1, 5) for type_ in ['Email', 'Note']] +
+                   [('deal', 7, 'deal-Email'), ('deal', 7, 'deal-Note')]))
+        # The activities of each feed stay in order
+        eq_([item['attributes']['id'] for parent, parent_id, item in activities
+             if parent == 'deal' and item['type'] == 'deal-Note'], [1, 2])
+        assert_raises(ValueError, list, service.iter_feeds(contact_ids=[1], types=['Meeting']))
+    finally:
+        server.stop()
+
+
+def test_legacy_iter_feeds_buffer():
+    """iter_feeds() should stop reading once buffer_size activities are waiting for the caller"""
+    pages = {
+        None: ([feed_item('note', i, 30 - i) for i in range(1, 4)], 'page2'),
+        'page2': ([feed_item('note', i, 30 - i) for i in range(4, 7)], 'page3'),
+        'page3': ([], 'page4'),
+    }
+    server = StubServer()
+
+    def feed(request):
+        items, timestamp = pages[request['params'].get('timestamp')]
+        return 200, {'items': items, 'success': True, 'metadata': {'timestamp': timestamp}}
+    server.routes[('GET', '/apis/feeder/api/v1/feed/deal/1.json')] = feed
+    try:
+        service = LegacyService(Token('token'), stub_session(server))
+        activities = service.iter_feeds(deal_ids=[1], buffer_size=1)
+        eq_(next(activities)[2]['attributes']['id'], 1)
+        time.sleep(0.2)
+        # The reader is waiting to hand over the last activity of the first page
+        eq_(len(server.requests), 1)
+        eq_([item['attributes']['id'] for parent, parent_id, item in activities], range(2, 7))
+        eq_(len(server.requests), 3)
+    finally:
+        server.stop()
+
+
+def test_legacy_iter_feeds_error():
+    """An error raised while reading a feed should be raised by iter_feeds()"""
+    server = StubServer()
+    try:
+        server.routes[('GET', '/apis/feeder/api/v1/feed/deal/1.json')] = \
+            (200, {'items': [{'feed_item': None}], 'success': True, 'metadata': {'timestamp': None}})
+        service = LegacyService(Token('token'), stub_session(server))
+        assert_raises(AttributeError, list, service.iter_feeds(deal_ids=[1]))
+    finally:
+        server.stop()
+
+
+def test_legacy_iter_feeds_high_water_marks():
+    """iter_feeds() should only save the mark of a feed once the caller has taken all of its activities"""
+    server = StubServer()
+    try:
+        for id_ in [1, 2]:
+            server.routes[('GET', '/apis/feeder/api/v1/feed/deal/%d.json' % id_)] = \
+                (200, {'items': [feed_item('note', 10 * id_ + 2, 2), feed_item('note', 10 * id_ + 1, 1)],
+                       'success': True, 'metadata': {'timestamp': None}})
+        store = InMemory()
+        service = LegacyService(Token('token'), stub_session(server))
+        activities = service.iter_feeds(deal_ids=[1, 2], concurrency=1, store=store)
+        parent, parent_id, first = next(activities)
+        # Abandoned after the first activity
+        activities.close()
+        eq_(store.get_meta('legacy_feed/deal/%d' % parent_id), None)
+
+        activities = service.iter_feeds(deal_ids=[1, 2], concurrency=1, store=store)
+        eq_(next(activities)[2], first)
+        next(activities)
+        next(activities)
+        eq_(store.get_meta('legacy_feed/deal/%d' % parent_id),
+            {'sorted_by': 2, 'keys': ['note-%d' % first['attributes']['id']]})
+        eq_(len(list(activities)), 1)
+        eq_(list(service.iter_feeds(deal_ids=[1, 2], store=store)), [])
+    finally:
+        server.stop()
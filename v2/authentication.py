@@ -4,7 +4,6 @@
 import logging
 logger = logging.getLogger(__name__)
 
-import requests
 from prototype import BaseCrmAuthentication
 
 __author__ = 'Clayton Daley III'
@@ -16,11 +15,11 @@ __status__ = "Development"
 
 
 class Authentication(BaseCrmAuthentication):
-    def __init__(self):
-        super(Authentication, self).__init__()
+    def __init__(self, session=None):
+        super(Authentication, self).__init__(session)
         self._refresh_token = None
 
-    def headers(self):
+    def headers(self, api_version=None):
         return {
             'Authorization': 'Bearer %s' % self._access_token,
         }
@@ -42,22 +41,23 @@ class Authentication(BaseCrmAuthentication):
         logger.debug("url:  %s" % url)
         logger.debug("format_data_get:  %s" % data)
         logger.debug("headers:  %s" % headers)
-        response = requests.post(url=url, params=data, headers=headers)
+        response = self.session.post(url=url, params=data, headers=headers)
         logger.debug("Password response:\n%s" % response.text)
         self._access_token = response.json()['access_token']
         self._refresh_token = response.json()['refresh_token']
 
 
 class Password(Authentication):
-    def __init__(self, username, password):
+    def __init__(self, username, password, session=None):
         """
         Authenticate with an email and password
 
         Keyword arguments;
         email -- user's BaseCRM email
         password -- user's BaseCRM password
+        session -- (optional) a transport.Session to share with the client
         """
-        super(Password, self).__init__()
+        super(Password, self).__init__(session)
 
         data = {
             'grant_type': 'password',
@@ -73,13 +73,13 @@ class Password(Authentication):
         logger.debug("url:  %s" % url)
         logger.debug("format_data_get:  %s" % data)
         logger.debug("headers:  %s" % headers)
-        response = requests.post(url=url, data=data, headers=headers)
+        response = self.session.post(url=url, data=data, headers=headers)
         logger.debug("Password response:\n%s" % response.text)
         self._access_token = "%s" % response.json()['access_token']
         self._refresh_token = response.json()['refresh_token']
 
 
 class Token(Authentication):
-    def __init__(self, token):
-        super(Token, self).__init__()
+    def __init__(self, token, session=None):
+        super(Token, self).__init__(session)
         self._access_token = token
\ No newline at end of file
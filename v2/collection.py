@@ -54,20 +54,21 @@ class ContactSet(Collection):
         'created_at'
     ]
 
-    def format_page(self, data):
+    def format_item(self, record):
         # This tweak is unique to Contact since it doesn't have a valid _ITEM
         if self.__class__.__name__ != "ContactSet":
-            return super(ContactSet, self).set_data(data)
+            return super(ContactSet, self).format_item(record)
 
-        page = list()
-        for record in data:
-            if record['data']['is_organization']:
-                entity = Organization()
-            else:
-                entity = Person()
-            entity.set_data(record['data'])
-            page.append(entity)
-        return page
+        if record['data']['is_organization']:
+            entity = Organization()
+        else:
+            entity = Person()
+        entity.set_data(record)
+        return entity
+
+    def format_frame(self, data, resource_class=None):
+        # Person and Organization share the columns of Contact
+        return super(ContactSet, self).format_frame(data, resource_class or Contact)
 
 
 class PersonSet(ContactSet):
@@ -120,6 +121,7 @@ class DealSet(Collection):
             data['region'] = str(data['region']).lower()
         if 'country' in data:
             data['country'] = str(data['country']).lower()
+        return data
 
 
 class DealContactSet(Collection):
@@ -143,14 +145,10 @@ class DealContactSet(Collection):
         self.deal = deal
         super(DealContactSet, self).__init__()
 
-    def format_page(self, data):
-        # Reset local data
-        page = list()
-        for record in data:
-            item = DealContact(self.deal, Contact(record['data']['contact_id']))
-            item.role = record['data']['role']
-            page.append(item)
-        return page
+    def format_item(self, record):
+        item = DealContact(self.deal, Contact(record['data']['contact_id']))
+        item.role = record['data']['role']
+        return item
 
     def format_data_set(self):
         if self.id is None:
@@ -185,6 +183,7 @@ class LeadSet(Collection):
             data['region'] = str(data['region']).lower()
         if 'country' in data:
             data['country'] = str(data['country']).lower()
+        return data
 
 
 class LossReasonSet(Collection):
@@ -16,6 +16,7 @@ __status__ = "Development"
 
 
 class Account(Resource):
+    __slots__ = ()
     _PATH = "accounts"
     """
     Read-only attributes are preceded by an underscore
@@ -34,13 +35,14 @@ class Account(Resource):
     def __init__(self):
         super(Account, self).__init__()
         # Account only works to load the "ID" /self
-        self.__dict__['_data']['id'] = 'self'
+        self._data['id'] = 'self'
 
 
 class Address(Resource):
     """
     Read-only attributes are preceded by an underscore
     """
+    __slots__ = ()
     PROPERTIES = {
         'line1': basestring,
         'city': basestring,
@@ -54,6 +56,7 @@ class Address(Resource):
 
 
 class Contact(Resource):
+    __slots__ = ()
     _PATH = "contacts"
     """
     Read-only attributes are preceded by an underscore
@@ -95,28 +98,21 @@ class Contact(Resource):
         # If a user has an ambiguous contact, it must be possible to load that contact by ID
         super(Contact, self).__init__(entity_id)
 
-    def set_data(self, data):
-        super(Contact, self).set_data(data)
+    def set_data(self, data, lazy=None):
+        super(Contact, self).set_data(data, lazy)
         # Mutate last
         if data['data']['is_organization']:
-            object.__setattr__(self, '__class__', Organization)
+            self._set_class(Organization)
         else:
-            object.__setattr__(self, '__class__', Person)
+            self._set_class(Person)
         return self  # returned for setting and chaining convenience
 
-    def format_data_set(self, data):
-        for k, v in data.iteritems():
-            if k == 'address':
-                address = Address()
-                address.set_data({'data': v})  # Nest back in a 'data' key to use default processor
-                data[k] = address
-        return data  # data is mutable, but this simplifies chaining and inline assignment
-
 
 class Person(Contact):
     """
     A specialization of the Contact object that assumes is_organization=False and enforces related business rules.
     """
+    __slots__ = ()
     """
     Read-only attributes are preceded by an underscore
     """
@@ -154,8 +150,8 @@ class Person(Contact):
         super(Person, self).__init__(entity_id)
         self._dirty['is_organization'] = False
 
-    def format_data_get(self):
-        data = super(Person, self).format_data_get()
+    def format_data_get(self, dirty):
+        data = super(Person, self).format_data_get(dirty)
         # Check business rules
         # If ID is not None, assume an update
         if self.id is None:
@@ -166,16 +162,23 @@ class Person(Contact):
         # Other checks for the type of action (get, post, put, delete) are made in client
         return data
 
+    def set_data(self, data, lazy=None):
+        # Lazy mode skips format_data_set() so the data is checked here as well
+        if data[self.DATA_PARENT_KEY]['is_organization']:
+            raise ValueError('Data for Organization provided to Person')
+        return super(Person, self).set_data(data, lazy)
+
     def format_data_set(self, data):
         if data['is_organization']:
             raise ValueError('Data for Organization provided to Person')
-        super(Person, self).format_data_set(data)
+        return super(Person, self).format_data_set(data)
 
 
 class Organization(Contact):
     """
     A specialization of the Contact object that assumes is_organization=True and enforces related business rules.
     """
+    __slots__ = ()
     """
     Read-only attributes are preceded by an underscore
     """
@@ -214,7 +217,7 @@ class Organization(Contact):
         self._dirty['is_organization'] = True
 
     def format_data_get(self, dirty):
-        data = super(Person, self).format_data_get(dirty)
+        data = super(Organization, self).format_data_get(dirty)
         # Check business rules
         # If ID is not None, assume an update
         if self.id is None:
@@ -224,13 +227,20 @@ class Organization(Contact):
         # Other checks for the type of action (get, post, put, delete) are made in client
         return data
 
+    def set_data(self, data, lazy=None):
+        # Lazy mode skips format_data_set() so the data is checked here as well
+        if not data[self.DATA_PARENT_KEY]['is_organization']:
+            raise ValueError('Data for Person provided to Organization')
+        return super(Organization, self).set_data(data, lazy)
+
     def format_data_set(self, data):
         if not data['is_organization']:
             raise ValueError('Data for Person provided to Organization')
-        super(Organization, self).format_data_set(data)
+        return super(Organization, self).format_data_set(data)
 
 
 class Deal(Resource):
+    __slots__ = ()
     _PATH = "deals"
     """
     Read-only attributes are preceded by an underscore
@@ -257,6 +267,7 @@ class Deal(Resource):
 
 
 class DealContact(Resource):
+    __slots__ = ()
     _PATH = "associated_contacts"
     ROLES = [
         'involved'
@@ -291,6 +302,7 @@ class DealContact(Resource):
 
 
 class Lead(Resource):
+    __slots__ = ()
     _PATH = "leads"
     """
     Read-only attributes are preceded by an underscore
@@ -322,15 +334,9 @@ class Lead(Resource):
         '_updated_at': datetime,
     }
 
-    def format_data_set(self, data):
-        for k, v in data.iteritems():
-            if k == 'address':
-                address = Address()
-                address.set_data({'data': v})
-                data[k] = address
-
 
 class LossReason(Resource):
+    __slots__ = ()
     _PATH = "loss_reasons"
     PROPERTIES = {
         """
@@ -345,6 +351,7 @@ class LossReason(Resource):
 
 
 class Note(Resource):
+    __slots__ = ()
     _PATH = "notes"
     RESOURCE_TYPES = {
         'lead': Lead,
@@ -369,24 +376,9 @@ class Note(Resource):
         '_updated_at': datetime,
     }
 
-    def format_data_set(self, data):
-        """
-        Input is:
-        ...
-        'resource_type': {
-            'type': basestring,
-            'in': RESOURCE_TYPES
-        },
-        'resource_id': int,
-        ...
-        """
-        class_ = self.RESOURCE_TYPES[data['resource']]
-        data['resource'] = class_(data['resource_id'])
-        del data['resource_id']
-        return data
-
 
 class Pipeline(Resource):
+    __slots__ = ()
     _PATH = "pipelines"
     """
     Read-only attributes are preceded by an underscore
@@ -400,6 +392,7 @@ class Pipeline(Resource):
 
 
 class Source(Resource):
+    __slots__ = ()
     _PATH = "sources"
     """
     Read-only attributes are preceded by an underscore
@@ -414,6 +407,7 @@ class Source(Resource):
 
 
 class Stage(Resource):
+    __slots__ = ()
     _PATH = "stages"
     """
     Read-only attributes are preceded by an underscore
@@ -432,6 +426,7 @@ class Stage(Resource):
 
 
 class Tag(Resource):
+    __slots__ = ()
     _PATH = "tags"
     RESOURCE_TYPES = [
         'lead',
@@ -455,6 +450,7 @@ class Tag(Resource):
 
 
 class Task(Resource):
+    __slots__ = ()
     _PATH = "tasks"
     RESOURCE_TYPES = {
         'lead': Lead,
@@ -487,6 +483,7 @@ class Task(Resource):
 
 
 class User(Resource):
+    __slots__ = ()
     _PATH = "users"
     STATUS = [
         'active',
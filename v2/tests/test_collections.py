@@ -4,8 +4,12 @@
 import logging
 logger = logging.getLogger(__name__)
 
+from nose.tools import assert_raises, eq_
+from prototype import Collection
+from tests.test_common import COLLECTIONS
 from v2.collection import ContactSet, PersonSet, OrganizationSet, DealSet, LeadSet, LossReasonSet, NoteSet, PipelineSet, \
     SourceSet, StageSet, TagSet, TaskSet, UserSet
+from v2.resource import Contact
 
 
 __author__ = 'Clayton Daley III'
@@ -16,3 +20,32 @@ __maintainer__ = "Clayton Daley III"
 __status__ = "Development"
 
 
+def for_item_eq(resource_class, collection_class):
+    eq_(Collection.for_item(resource_class), collection_class)
+
+
+def test_generator_for_item():
+    """Every Collection should be found from the Resource it lists"""
+    for collection_class in COLLECTIONS:
+        if collection_class is ContactSet:
+            yield for_item_eq, Contact, ContactSet
+        else:
+            yield for_item_eq, collection_class._ITEM, collection_class
+
+
+def test_collection_filters():
+    """Filters should be checked against the compiled FILTERS"""
+    deals = DealSet(owner_id=1, hot=True)
+    eq_(deals.filters, {'owner_id': 1, 'hot': True})
+    assert_raises(TypeError, setattr, deals, 'owner_id', 'me')
+    assert_raises(AttributeError, setattr, deals, 'city', 'Boston')
+    eq_(sorted(DealSet._FILTER_VALIDATORS.keys()), sorted(DealSet.FILTERS.keys()))
+
+
+def test_collection_get_data_snapshot():
+    """Changing the parameters must not change the filters"""
+    deals = DealSet(ids=[1, 2])
+    data = deals.format_data_set()
+    data['ids'].append(3)
+    data['owner_id'] = 1
+    eq_(deals.filters, {'ids': [1, 2]})
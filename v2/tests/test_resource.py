@@ -4,9 +4,12 @@
 import logging
 logger = logging.getLogger(__name__)
 
+from copy import deepcopy
 from pprint import pformat
 from nose.tools import assert_raises, eq_
 from tests.test_common import SAMPLES, COLLECTIONS, RESOURCES
+from prototype import Resource
+from v1.entity import Contact as ContactV1, Deal as DealV1, Lead as LeadV1
 from v2.resource import Person, Contact, Organization, Deal, Lead, Note, Tag, Account, Address, LossReason, Task, \
     DealContact, Pipeline, Source, Stage, User
 
@@ -258,3 +261,130 @@ def test_task_getdata_resource_conversion():
 v2 Resources should properly wrap the return from format_data_get in 'data'
 """
 
+
+"""
+Lazy hydration converts each field when it is first read
+"""
+
+
+LAZY_CONTACT = {
+    'data': {
+        'id': 1,
+        'is_organization': False,
+        'name': 'Mark Johnson',
+        'address': {'line1': '2726 Smith Street', 'city': 'Hyannis'},
+        'created_at': '2014-08-27T16:32:56Z',
+    }
+}
+
+
+def test_lazy_contact():
+    """A lazily loaded Contact should mutate and only convert the fields that are read"""
+    contact = Contact(1).set_data(deepcopy(LAZY_CONTACT), lazy=True)
+    assert isinstance(contact, Person)
+    eq_(contact.name, 'Mark Johnson')
+    # Unread fields keep their raw value
+    eq_(contact._values[contact._LAYOUT['address']], LAZY_CONTACT['data']['address'])
+    assert isinstance(contact.address, Address)
+    eq_(contact.address.city, 'Hyannis')
+    # Converted values are kept
+    assert contact.address is contact.address
+    eq_(contact.created_at.year, 2014)
+
+
+LAZY_NOTE = {
+    'data': {
+        'id': 1,
+        'resource': 'deal',
+        'resource_id': 5,
+        'content': 'Call',
+        'created_at': '2014-08-27T16:32:56Z',
+    }
+}
+
+LAZY_TASK = {
+    'data': {
+        'id': 1,
+        'resource': 'lead',
+        'resource_id': 7,
+        'content': 'Send quote',
+        'due_date': '2014-09-01',
+        'created_at': '2014-08-27T16:32:56Z',
+    }
+}
+
+LAZY_CONTACT_V1 = {
+    'contact': {
+        'id': 1,
+        'name': 'Mark Johnson',
+        'is_organisation': False,
+        'organisation': {'contact': {'id': 9, 'name': 'Acme', 'is_organisation': True}},
+    }
+}
+
+
+def read_fields(resource):
+    """Reads every field (converting the pending ones of a lazy Resource) and returns their plain values"""
+    for key in list(resource._data):
+        # Reading `resource` drops `resource_id` so the keys are read once before they are collected
+        resource._data.get(key)
+    fields = {}
+    for key, value in resource._data.items():
+        if isinstance(value, Resource):
+            value = (value.__class__, getattr(value, 'id', None), read_fields(value))
+        fields[key] = value
+    return fields
+
+
+def lazy_matches_eager(class_, data):
+    eager = class_(1).set_data(deepcopy(data), lazy=False)
+    lazy = class_(1).set_data(deepcopy(data), lazy=True)
+    eq_(lazy.__class__, eager.__class__)
+    eq_(read_fields(lazy), read_fields(eager))
+
+
+def test_lazy_matches_eager():
+    """Both modes should end up with the same values"""
+    for class_, data in [(Contact, LAZY_CONTACT), (Note, LAZY_NOTE), (Task, LAZY_TASK),
+                         (ContactV1, LAZY_CONTACT_V1)]:
+        yield lazy_matches_eager, class_, data
+
+
+def test_lazy_contact_v1_organisation():
+    """The organisation of a v1 Contact should be converted into a Contact in both modes"""
+    for lazy in [False, True]:
+        contact = ContactV1(1).set_data(deepcopy(LAZY_CONTACT_V1), lazy=lazy)
+        assert isinstance(contact.organisation, ContactV1)
+        eq_(contact.organisation.name, 'Acme')
+
+
+def test_lazy_class_default():
+    """LAZY should set the default mode of a class"""
+    Note.LAZY = True
+    try:
+        note = Note(1).set_data({'data': {'id': 1, 'resource': 'deal', 'resource_id': 5, 'content': 'Call'}})
+        eq_(note._pending >> note._LAYOUT['resource'] & 1, 1)
+        assert isinstance(note.resource, Deal)
+        eq_(note.resource.id, 5)
+        assert 'resource_id' not in note._data
+    finally:
+        Note.LAZY = False
+
+
+def test_lazy_local_change():
+    """A local change should win over the raw value of a field that was never read"""
+    lead = Lead(1).set_data({'data': {'id': 1, 'address': {'city': 'Hyannis'}}}, lazy=True)
+    address = Address()
+    lead.address = address
+    assert lead.address is address
+    eq_(dict(lead._dirty), {'address': address})
+
+
+def no_instance_dict(resource):
+    assert not hasattr(resource, '__dict__'), "%s is missing __slots__" % resource.__class__.__name__
+
+
+def test_resources_slots():
+    """Every Resource should declare __slots__ so its instances keep no __dict__"""
+    for resource in RESOURCES + [ContactV1, DealV1, LeadV1]:
+        yield no_instance_dict, resource.__new__(resource)